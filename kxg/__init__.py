@@ -8,5 +8,7 @@ from .forums import *
 from .actors import *
 from .multiplayer import *
 from .messages import *
+from .journal import *
+from .replay import *
 from .tokens import *
 from .errors import *
@@ -1,7 +1,7 @@
 #!/usr/bin/env python3
 
 from .errors import *
-from .forums import ForumObserver
+from .forums import ForumObserver, SubscriptionIndex
 
 class Actor(ForumObserver):
 
@@ -11,6 +11,12 @@ class Actor(ForumObserver):
         self._forum = None
         self._id_factory = None
 
+        # The actor and its token extensions share a single subscription 
+        # index, so that the forum can dispatch each message to only the 
+        # extensions that are subscribed to it.
+
+        self._attach_to_index(SubscriptionIndex())
+
     def __rshift__(self, message):
         return self.send_message(message)
 
@@ -20,7 +26,7 @@ class Actor(ForumObserver):
         # Make sure the user didn't pass the wrong object to this function or 
         # forget to call the superclass constructor.
 
-        from .messages import require_message
+        from .messages import require_message, MessageBackpressure
         require_message(message)
 
         # Make sure this message hasn't been sent more than once.  This is 
@@ -50,7 +56,9 @@ class Actor(ForumObserver):
         # These expectations can sometimes be broken by relatively innocuous 
         # misuses of the game engine, so it's useful to have these checks.
 
-        for token in message.tokens_to_add():
+        tokens_to_add = set(message.tokens_to_add())
+
+        for token in tokens_to_add:
             if token in self.world:
                 raise ApiUsageError("""\
                         can't add {token} to the world twice.
@@ -70,35 +78,12 @@ class Actor(ForumObserver):
                         could also mean {token} was never added to the world in 
                         the first place.""")
 
-        for token in message.tokens_referenced():
-            if token not in self.world and token not in message.tokens_to_add():
-                raise ApiUsageError("""\
-                        {token} was referenced by {message} despite not 
-                        being in the world.
-
-                        Every token referenced by a message, except those being 
-                        added to the world, must be in the world.  This is 
-                        mostly a sanity check: a token that's not in the world 
-                        shouldn't be in a message because it shouldn't be 
-                        participating in the game at all!  But this is also a 
-                        synchronization issue for multiplayer games: there's no 
-                        way to communicate over the network about a token that 
-                        doesn't have an established id.
+        # Don't send the message if the forum is already waiting on too many 
+        # messages (see ClientForum).  Nothing about the message has been 
+        # changed yet, so it can be sent again later.
 
-                        There are several common ways to get this error:  
-
-                        1. Using a token that was previously removed from the 
-                           world.  This can happen if a token is removed from 
-                           the world but not from all the lists it was a part 
-                           of, for example.  
-
-                        2. Forgetting to yield a token from tokens_to_add().  
-                           Even tokens that are nested in other tokens need to 
-                           be yielded by this method to be added to the world.
-
-                        3. Using a token that was never added to the world.  
-                           This can happen if you put a token in the world 
-                           without using a message to do it.""")
+        if not self.can_send_message():
+            raise MessageBackpressure
 
         # Indicate that the message was sent by this actor and give the message 
         # a chance to assign id numbers to the tokens it's creating.  This is 
@@ -107,13 +92,24 @@ class Actor(ForumObserver):
 
         message._set_sender_id(self._id_factory)
         message._assign_token_ids(self._id_factory)
+        self._forum._prepare_message(message)
 
         # Make sure that the message isn't requesting something that can't be 
         # done.  For example, make sure the players have enough resource when 
         # they're trying to buy things.  If the message fails the check, an 
-        # exception will be raised.
+        # exception will be raised.  The message is checked before it's pickled 
+        # (see _pack_message()), because the check may store information on 
+        # the message that the other machines need to see.  If the check does 
+        # fail, first make sure it isn't because the message references a 
+        # token it shouldn't, since that's a bug rather than a bad request.
+
+        try:
+            message._check(self.world)
+        except Exception:
+            self._pack_message(message, tokens_to_add)
+            raise
 
-        message._check(self.world)
+        self._pack_message(message, tokens_to_add)
 
         # Hand the message off to the forum to be applied to the world and 
         # relayed on to all the other actors (which may or may not be on 
@@ -129,6 +125,15 @@ class Actor(ForumObserver):
     def is_referee(self):
         return isinstance(self, Referee)
 
+    def can_send_message(self):
+        """
+        Return false if `send_message` would refuse to send a message right 
+        now because too many messages are already waiting to be acknowledged 
+        by the server.  This is only ever the case for clients in multiplayer 
+        games that limit the number of messages in flight.
+        """
+        return self._forum._is_accepting_messages()
+
     def on_setup_gui(self, gui):
         pass
 
@@ -152,13 +157,52 @@ class Actor(ForumObserver):
         assert self._forum is None, "Actor already has forum."
         self._forum = forum
 
-    def _get_nested_observers(self):
-        return (token.get_extension(self)
-                for token in self.world if token.has_extension(self))
+    def _pack_message(self, message, tokens_to_add):
+        """
+        Pickle the given message, both to find every token it references and 
+        to produce the packet that will be sent over the network in 
+        multiplayer games, and make sure every referenced token is in the 
+        world (or being added to it).  Doing both in the same pass means each 
+        message only has to be pickled once.
+        """
+        tokens_referenced = message._pack(tokens_to_add)
+
+        for token in tokens_referenced:
+            if token not in self.world and token not in tokens_to_add:
+                raise ApiUsageError("""\
+                        {token} was referenced by {message} despite not 
+                        being in the world.
+
+                        Every token referenced by a message, except those being 
+                        added to the world, must be in the world.  This is 
+                        mostly a sanity check: a token that's not in the world 
+                        shouldn't be in a message because it shouldn't be 
+                        participating in the game at all!  But this is also a 
+                        synchronization issue for multiplayer games: there's no 
+                        way to communicate over the network about a token that 
+                        doesn't have an established id.
+
+                        There are several common ways to get this error:  
+
+                        1. Using a token that was previously removed from the 
+                           world.  This can happen if a token is removed from 
+                           the world but not from all the lists it was a part 
+                           of, for example.  
+
+                        2. Forgetting to yield a token from tokens_to_add().  
+                           Even tokens that are nested in other tokens need to 
+                           be yielded by this method to be added to the world.
+
+                        3. Using a token that was never added to the world.  
+                           This can happen if you put a token in the world 
+                           without using a message to do it.""")
 
     def _relay_message(self, message):
         pass
 
+    def _deliver_relayed_messages(self):
+        pass
+
 
 class Referee(Actor):
 
@@ -204,7 +248,11 @@ class Referee(Actor):
     def on_update_game(self, dt):
         with Referee.Reporter(self) as reporter:
             self.world.on_report_to_referee(reporter)
-            for token in self.world:
+
+            # Only visit the tokens that actually implement reporting and are 
+            # due to report on this frame (see Token.report_interval).
+
+            for token in self.world._get_tokens_to_report():
                 token.on_report_to_referee(reporter)
 
     def _set_forum(self, forum, id_factory):
@@ -215,7 +263,7 @@ class Referee(Actor):
 
 @debug_only
 def require_actor(object):
-    require_instance(Actor(), object)
+    require_instance(Actor, object)
 
 @debug_only
 def require_actors(objects):
@@ -120,15 +120,36 @@ def debug_only(function):
         return lambda *args, **kwargs: None
 
 @debug_only
-def require_instance(prototype, object):
-    prototype_cls = prototype.__class__.__name__
+def require_instance(cls, object):
+    """
+    Raise an `ApiUsageError` if the given object is not a fully constructed 
+    instance of the given class.
+
+    An object counts as fully constructed if it has every attribute that the 
+    class's constructor would've given it.  Those attributes are found once 
+    per class (by constructing a single prototype with no arguments) and then 
+    cached, so this check is cheap enough to run on every token and message.
+    """
+    prototype_cls = cls.__name__
     object_cls = object.__class__.__name__
 
-    if not isinstance(object, type(prototype)):
+    if not isinstance(object, cls):
         raise ApiUsageError("""\
                 expected {prototype_cls}, but got {object_cls} instead.""")
 
-    for member_name in prototype.__dict__:
+    member_names, member_name_set = get_instance_schema(cls)
+
+    # Most objects will be complete, so first try to confirm that in a single 
+    # set operation.  Only if that fails do we bother to figure out which 
+    # attribute is missing (and to look for it outside the instance dict).
+
+    try:
+        if member_name_set.issubset(object.__dict__):
+            return
+    except AttributeError:
+        pass
+
+    for member_name in member_names:
         if not hasattr(object, member_name):
             raise ApiUsageError("""\
                 forgot to call the {prototype_cls} constructor in 
@@ -139,3 +160,16 @@ def require_instance(prototype, object):
                 This usually means that you forgot to call the {prototype_cls} 
                 constructor in your subclass.""")
 
+def get_instance_schema(cls):
+    """
+    Return the names of the attributes that the constructor of the given class 
+    assigns, both as a tuple (in assignment order) and as a set.
+    """
+    try:
+        return _instance_schemas[cls]
+    except KeyError:
+        member_names = tuple(cls().__dict__)
+        schema = _instance_schemas[cls] = member_names, frozenset(member_names)
+        return schema
+
+_instance_schemas = {}
@@ -8,17 +8,36 @@ class Forum:
         self.world = None
         self.actors = None
 
+        # Count the number of times the game has been updated.  Servers use 
+        # this to tell clients which tick each message was executed on (see 
+        # ServerTick).
+
+        self.tick = 0
+
+        # A MessageJournal can be assigned here to record every message 
+        # executed by this forum, e.g. to replay or benchmark the game later.
+
+        self.journal = None
+
     def execute_message(self, message):
         info("executing message: {message}")
 
         # Relay the messages to clients running on other machines, if this is a 
         # multiplayer game.  Since the tokens referenced in the message might 
         # be changed once the message is executed, the message has to be 
-        # relayed before then.
+        # relayed before then.  The message is only serialized once no matter 
+        # how many clients it's relayed to, because the serializers cache the 
+        # packets they produce on the message itself.
 
         for actor in self.actors:
             actor._relay_message(message)
 
+        # Record the message in the journal, if there is one.  This also has 
+        # to happen before the message is executed, for the same reason.
+
+        if self.journal is not None:
+            self.journal.record_message(message, self.world)
+
         # Normally, tokens can only call methods that have been decorated with 
         # @read_only.  This is a precaution to help keep the worlds in sync on 
         # all the clients.  This restriction is lifted when the tokens are 
@@ -81,12 +100,49 @@ class Forum:
     def on_update_game(self):
         # Forum doesn't do anything on a timer; it does everything in response 
         # to a message being sent.  But the ClientForum uses this method to 
-        # react to message that have arrived from the server.
-        pass
+        # react to message that have arrived from the server.  This method is 
+        # called after every actor has been updated, so it's also the right 
+        # time for any actors that batch the messages they relay to other 
+        # machines to send the messages from this frame.
+
+        for actor in self.actors:
+            actor._deliver_relayed_messages()
 
     def on_finish_game(self):
         pass
 
+    def _finish_tick(self, elapsed_time):
+        """
+        Mark the end of a frame (i.e. tick) in the journal, if there is one, 
+        and start counting the next one.
+
+        This is called by `Game.update_game` once everything else has been 
+        updated, so every message executed during the frame precedes it.
+        """
+        if self.journal is not None:
+            self.journal.record_frame(elapsed_time)
+
+        self.tick += 1
+
+    def _prepare_message(self, message):
+        """
+        Give the forum a chance to attach information to a message that's 
+        about to be sent.
+
+        This is called by `Actor.send_message` before the message is pickled 
+        and checked, so anything attached here will be part of the packet 
+        that's sent over the network in multiplayer games.
+        """
+        pass
+
+    def _is_accepting_messages(self):
+        """
+        Return false if the forum can't take any more messages right now, e.g. 
+        because too many are still waiting to be acknowledged by the server.  
+        See `Actor.can_send_message`.
+        """
+        return True
+
     def _assign_id_factories(self):
         id_factories = {}
         actors = sorted(self.actors, key=lambda x: not x.is_referee())
@@ -102,7 +158,9 @@ class Forum:
 class ForumObserver:
 
     from collections import namedtuple
-    CallbackInfo = namedtuple('CallbackInfo', 'message_cls, callback')
+    CallbackInfo = namedtuple('CallbackInfo', 'message_cls, callback, key')
+
+    _decorated_callbacks = ()
 
     def __init__(self):
         super().__init__()
@@ -119,6 +177,15 @@ class ForumObserver:
                 'undo_response': [],
         }
 
+        # The callbacks are also registered with a subscription index, which 
+        # is what the forum actually uses to decide which callbacks to call 
+        # for each message.  Actors and the world each own an index, and the 
+        # observers nested within them (e.g. tokens and token extensions) 
+        # register their callbacks with that index as long as they're part of 
+        # the game.
+
+        self._subscription_index = None
+
         # Create a member variable indicating whether or not the ability to 
         # subscribe to or unsubscribe from messages should be enabled.  Token 
         # disable this functionality until they've been added to the world and 
@@ -127,24 +194,43 @@ class ForumObserver:
         self._is_enabled = True
 
         # Decorators can be used to automatically label methods that should be 
-        # callbacks.  Here, we look for methods that have been labeled in this 
-        # way and register them appropriately.
-
-        from inspect import getmembers, ismethod
-
-        for _, method in getmembers(self, ismethod):
-            for message_cls in getattr(method, '_kxg_subscribe_to_message', []):
-                self.subscribe_to_message(message_cls, method)
+        # callbacks.  The labeled methods are found once per class (see 
+        # __init_subclass__), so here we just need to register them.
+
+        for event, message_cls, method_name in self._decorated_callbacks:
+            self._add_callback(event, message_cls, getattr(self, method_name))
+
+    def __init_subclass__(cls, **kwargs):
+        """
+        Find the methods that have been labeled as callbacks by the 
+        `subscribe_to_message`, `subscribe_to_sync_response`, and 
+        `subscribe_to_undo_response` decorators.
+
+        The result only depends on the class, so it's computed once when the 
+        class is created rather than every time an observer is instantiated.
+        """
+        super().__init_subclass__(**kwargs)
+        from inspect import getmembers, isroutine
+
+        labels = [
+                ('_kxg_subscribe_to_message', 'message'),
+                ('_kxg_subscribe_to_sync_response', 'sync_response'),
+                ('_kxg_subscribe_to_undo_response', 'undo_response'),
+        ]
+        decorated_callbacks = []
 
-            for message_cls in getattr(method, '_kxg_subscribe_to_sync_response', []):
-                self.subscribe_to_sync_response(message_cls, method)
+        for method_name, method in getmembers(cls, isroutine):
+            for label, event in labels:
+                for message_cls in getattr(method, label, []):
+                    decorated_callbacks.append(
+                            (event, message_cls, method_name))
 
-            for message_cls in getattr(method, '_kxg_subscribe_to_undo_response', []):
-                self.subscribe_to_undo_response(message_cls, method)
+        cls._decorated_callbacks = tuple(decorated_callbacks)
 
     def __getstate__(self):
         state = self.__dict__.copy()
         del state['_callbacks']
+        del state['_subscription_index']
         del state['_is_enabled']
         return state
 
@@ -194,36 +280,148 @@ class ForumObserver:
         from .messages import require_message_cls
         require_message_cls(message_cls)
         self._check_if_forum_observation_enabled()
-        callback_info = ForumObserver.CallbackInfo(message_cls, callback)
+
+        key = None
+        if self._subscription_index is not None:
+            key = self._subscription_index.add(event, message_cls, callback)
+
+        callback_info = ForumObserver.CallbackInfo(message_cls, callback, key)
         self._callbacks[event].append(callback_info)
 
     def _drop_callback(self, event, message_cls, callback):
         from .messages import require_message_cls
         require_message_cls(message_cls)
         self._check_if_forum_observation_enabled()
-        self._callbacks[event] = [
-                x for x in self._callbacks[event]
-                if not ((x.message_cls is message_cls) and
-                        (x.callback is callback or callback is None)
-                )
-        ]
+
+        callbacks_to_keep = []
+
+        for callback_info in self._callbacks[event]:
+            is_match = (callback_info.message_cls is message_cls) and \
+                    (callback_info.callback is callback or callback is None)
+
+            if not is_match:
+                callbacks_to_keep.append(callback_info)
+            elif callback_info.key is not None:
+                self._subscription_index.drop(
+                        event, message_cls, callback_info.key)
+
+        self._callbacks[event] = callbacks_to_keep
         
     def _call_callbacks(self, event, message):
+        """
+        Call every callback registered with this observer's subscription index 
+        that is subscribed to the given message.
+
+        This includes the callbacks of every observer nested within this one 
+        (e.g. the tokens in the world or the extensions belonging to an actor), 
+        so this method should only be called on observers that own an index.
+        """
         self._check_if_forum_observation_enabled()
+        self._subscription_index.call_callbacks(event, message)
+
+    def _attach_to_index(self, index):
+        """
+        Register all of this observer's callbacks with the given subscription 
+        index, so that they'll be called when the forum dispatches a matching 
+        message to the index.
+        """
+        assert self._subscription_index is None, msg("""\
+                {self} should've been detached from its old subscription index 
+                before being attached to a new one.""")
+
+        self._subscription_index = index
+
+        for event, callbacks in self._callbacks.items():
+            self._callbacks[event] = [
+                    x._replace(key=index.add(event, x.message_cls, x.callback))
+                    for x in callbacks
+            ]
+
+    def _detach_from_index(self):
+        """
+        Unregister all of this observer's callbacks from the subscription 
+        index they were registered with.
+        """
+        index = self._subscription_index
+        if index is None:
+            return
+
+        for event, callbacks in self._callbacks.items():
+            for callback_info in callbacks:
+                index.drop(event, callback_info.message_cls, callback_info.key)
+
+            self._callbacks[event] = [x._replace(key=None) for x in callbacks]
+
+        self._subscription_index = None
+
+
+class SubscriptionIndex:
+    """
+    Keep track of which callbacks are subscribed to which messages, so that 
+    each message can be dispatched without having to visit every observer.
+
+    Callbacks are indexed by the message class they subscribed to.  When a 
+    message is dispatched, the index looks up each class in the message's MRO, 
+    so subscribing to a base class works as expected.  Callbacks are called in 
+    the order they were subscribed.
+    """
 
-        # Call the callbacks stored in this observer.
+    def __init__(self):
+        from itertools import count
 
-        for callback_info in self._callbacks[event]:
-            if isinstance(message, callback_info.message_cls):
-                callback_info.callback(message)
+        self._keys = {
+                'message': {},
+                'sync_response': {},
+                'undo_response': {},
+        }
+        self._callbacks = {}
+        self._next_key = count()
+
+    def add(self, event, message_cls, callback):
+        """
+        Subscribe the given callback to the given message class, and return a 
+        key that can be used to drop the subscription later.
+        """
+        key = next(self._next_key)
+        self._keys[event].setdefault(message_cls, {})[key] = None
+        self._callbacks[key] = callback
+        return key
+
+    def drop(self, event, message_cls, key):
+        keys = self._keys[event][message_cls]
+        del keys[key]
+        del self._callbacks[key]
+
+        if not keys:
+            del self._keys[event][message_cls]
+
+    def call_callbacks(self, event, message):
+        from heapq import merge
+
+        keys_by_cls = self._keys[event]
+        matches = [
+                keys_by_cls[cls]
+                for cls in type(message).__mro__
+                if cls in keys_by_cls
+        ]
 
-        # Call the callbacks stored in nested observers.
+        # Make a list of the matching keys before calling any callbacks, 
+        # because the callbacks may subscribe or unsubscribe.  Keys increase 
+        # with subscription order, so merging the keys from each class keeps 
+        # the callbacks in that order.
 
-        for observer in self._get_nested_observers():
-            observer._call_callbacks(event, message)
+        if not matches:
+            return
+        elif len(matches) == 1:
+            keys = list(matches[0])
+        else:
+            keys = list(merge(*matches))
 
-    def _get_nested_observers(self):
-        return []
+        for key in keys:
+            # Skip callbacks that were unsubscribed by earlier callbacks.
+            callback = self._callbacks.get(key)
+            if callback is not None:
+                callback(message)
 
 
 class IdFactory:
@@ -248,11 +446,19 @@ class IdFactory:
         self.num_ids_assigned += 1
         return next_id
 
+    def reserve(self, num_ids):
+        """
+        Return a range of the next *num_ids* ids, all reserved in one step.
+        """
+        first_id = self.num_ids_assigned * self.spacing + self.offset
+        self.num_ids_assigned += num_ids
+        return range(first_id, first_id + num_ids * self.spacing, self.spacing)
+
 
 
 @debug_only
 def require_forum(object):
-    require_instance(Forum(), object)
+    require_instance(Forum, object)
 
 def subscribe_to_message(message_cls):
     def decorator(function):
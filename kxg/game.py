@@ -2,7 +2,7 @@
 
 from .errors import *
 from .forums import Forum
-from .multiplayer import ClientForum, ServerActor
+from .multiplayer import ClientForum, ServerActor, PacketDecoder
 
 class Game:
 
@@ -63,6 +63,16 @@ class Game:
         with self.world._unlock_temporarily():
             self.world.on_update_game(elapsed_time)
 
+        # Let any batched watchers know which token methods were called this 
+        # frame (see watch_token).
+
+        self.world._call_deferred_watchers()
+
+        # Let the forum count the frame, and record it if it's keeping a 
+        # journal (see MessageJournal).
+
+        self.forum._finish_tick(elapsed_time)
+
     def finish_game(self):
         """
         Give the actors, the world, and the messaging system a chance to react 
@@ -99,18 +109,91 @@ class UniplayerGame(Game):
 
 class MultiplayerClientGame(Game):
 
-    def __init__(self, world, gui_actor, pipe):
-        forum = ClientForum(pipe)
+    def __init__(self, world, gui_actor, pipe, serializer_cls=None,
+            batch_packets=False, max_messages_in_flight=None,
+            predict_messages=False):
+        forum = ClientForum(
+                pipe, serializer_cls, batch_packets, max_messages_in_flight,
+                predict_messages)
         super().__init__(world, forum, [gui_actor])
 
 
 class MultiplayerServerGame(Game):
 
-    def __init__(self, world, referee, ai_actors, pipes):
+    def __init__(self, world, referee, ai_actors, pipes, serializer_cls=None,
+            batch_packets=False, decode_threads=None):
         forum = Forum()
-        actors = [referee] + [ServerActor(x) for x in pipes] + ai_actors
+        actors = [referee] + [
+                ServerActor(x, serializer_cls, batch_packets) for x in pipes
+        ] + ai_actors
         super().__init__(world, forum, actors)
 
+        # Optionally unpack the messages from every client at once, before 
+        # any of the actors are updated (see PacketDecoder).
+
+        self.decoder = PacketDecoder(decode_threads) if decode_threads else None
+
+    def update_game(self, elapsed_time):
+        if self.decoder:
+            self.decoder.decode(self.actors)
+
+        super().update_game(elapsed_time)
+
+    def finish_game(self):
+        super().finish_game()
+
+        if self.decoder:
+            self.decoder.shutdown()
+
+
+class FixedTimestep:
+    """
+    Decide how many fixed-length ticks to simulate each time the game loop 
+    runs, regardless of how much time actually passed.
+
+    Game loops driven by a GUI (e.g. `pyglet.clock.schedule_interval`) don't 
+    run at exactly the requested rate, so passing the elapsed time straight to 
+    `Game.update_game` makes each update simulate a slightly different amount 
+    of time.  Instead, the elapsed time can be accumulated and spent in fixed 
+    ticks.  When the loop falls behind, several ticks are simulated at once to 
+    catch up, but never more than *max_ticks_per_update*.  Any time beyond that 
+    is dropped (and counted in `num_dropped_ticks`) rather than making the next 
+    update take even longer.  See `quickstart.GameStage`.
+    """
+
+    def __init__(self, tick_rate, max_ticks_per_update=5):
+        if tick_rate <= 0:
+            raise ApiUsageError("""\
+                    expected a positive tick rate, not {tick_rate}.""")
+
+        self.tick_rate = tick_rate
+        self.tick_duration = 1 / tick_rate
+        self.max_ticks_per_update = max_ticks_per_update
+        self.accumulated_time = 0
+        self.num_dropped_ticks = 0
+
+    def __repr__(self):
+        return '{}(tick_rate={})'.format(self.__class__.__name__, self.tick_rate)
+
+    def advance(self, elapsed_time):
+        """
+        Return the number of ticks that should be simulated now that the given 
+        amount of time has passed.
+        """
+        self.accumulated_time += elapsed_time
+
+        # Multiplying by the rate (rather than dividing by the duration) keeps 
+        # round-off error from losing a tick when the elapsed time is an exact 
+        # multiple of the tick duration.
 
+        num_ticks = int(self.accumulated_time * self.tick_rate + 1e-9)
 
+        if num_ticks > self.max_ticks_per_update:
+            self.num_dropped_ticks += num_ticks - self.max_ticks_per_update
+            num_ticks = self.max_ticks_per_update
+            self.accumulated_time = 0
+        else:
+            self.accumulated_time = max(
+                    self.accumulated_time - num_ticks * self.tick_duration, 0)
 
+        return num_ticks
@@ -0,0 +1,171 @@
+#!/usr/bin/env python3
+
+from .errors import *
+from collections import namedtuple
+from struct import Struct
+
+__all__ = ['JournalMessage', 'JournalFrame', 'MessageJournal', 'JournalReader']
+
+JournalMessage = namedtuple('JournalMessage', 'frame, sender_id, message')
+JournalFrame = namedtuple('JournalFrame', 'frame, dt')
+
+class MessageJournal:
+    """
+    Record every message executed by a forum to an append-only binary file.
+
+    To start recording, assign a journal to `Forum.journal` before starting 
+    the game (e.g. ``game.forum.journal = MessageJournal('match.kxg')``).  The 
+    forum then records each message it executes, along with the number of the 
+    frame it was executed in and the id of the actor that sent it.  The end of 
+    each frame is also recorded, along with the time that elapsed during it, 
+    so that the game can be replayed (see `JournalReader`).  Messages are 
+    serialized by `MessageSerializer`, so tokens that are already in the world 
+    are recorded by id.  This usually costs nothing extra, because messages 
+    cache the packets that `MessageSerializer` produces.
+
+    The journal is most useful on the server or in uniplayer games, because 
+    clients may sync or undo messages after executing them, and that isn't 
+    recorded.
+    """
+
+    MESSAGE = 0
+    FRAME = 1
+
+    message_header = Struct('!BIiI')
+    frame_header = Struct('!BId')
+
+    def __init__(self, file):
+        # Paths are opened for appending, so existing journals are never 
+        # overwritten.
+
+        self.file, self.owns_file = open_journal_file(file, 'ab')
+        self.frame = 0
+        self.serializer = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def record_message(self, message, world):
+        """
+        Record the given message, which must not have been executed yet.
+        """
+        from .multiplayer import MessageSerializer
+
+        if self.serializer is None or self.serializer.world is not world:
+            self.serializer = MessageSerializer(world)
+
+        packet = self.serializer.pack(message)
+        header = self.message_header.pack(
+                self.MESSAGE, self.frame, message.sender_id, len(packet))
+
+        self.file.write(header)
+        self.file.write(packet)
+
+    def record_frame(self, dt):
+        """
+        Record the end of the current frame and start a new one.
+        """
+        self.file.write(self.frame_header.pack(self.FRAME, self.frame, dt))
+        self.frame += 1
+
+    def flush(self):
+        self.file.flush()
+
+    def close(self):
+        if self.owns_file:
+            self.file.close()
+        else:
+            self.file.flush()
+
+
+class JournalReader:
+    """
+    Read the messages recorded by `MessageJournal`, one at a time.
+
+    Iterating over the reader yields a `JournalMessage` for each recorded 
+    message and a `JournalFrame` for the end of each frame, in the order they 
+    were recorded.  Records are read from the file lazily, so journals of 
+    entire matches can be read without keeping them in memory.  Each message 
+    is only deserialized when it's requested, which is important because 
+    messages refer to tokens by id, and those tokens may have been added to 
+    the given world by the messages before it.  So each message should be 
+    executed before the next one is requested.  Messages can also be left 
+    unparsed (as bytes) by passing ``unpack=False``, e.g. to quickly scan a 
+    journal for messages from a particular sender.
+    """
+
+    def __init__(self, file, world, unpack=True):
+        from .multiplayer import MessageSerializer
+
+        self.file, self.owns_file = open_journal_file(file, 'rb')
+        self.serializer = MessageSerializer(world)
+        self.unpack = unpack
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __iter__(self):
+        message_header = MessageJournal.message_header
+        frame_header = MessageJournal.frame_header
+
+        # Both kinds of records start with the same byte (indicating the kind 
+        # of record), so read that first to find out how much more to read.
+
+        while True:
+            kind = self.file.read(1)
+            if not kind:
+                return
+
+            if kind[0] == MessageJournal.MESSAGE:
+                header = kind + self.read(message_header.size - 1)
+                _, frame, sender_id, size = message_header.unpack(header)
+                message = self.read(size)
+                if self.unpack:
+                    message = self.serializer.unpack(message)
+                yield JournalMessage(frame, sender_id, message)
+
+            elif kind[0] == MessageJournal.FRAME:
+                header = kind + self.read(frame_header.size - 1)
+                _, frame, dt = frame_header.unpack(header)
+                yield JournalFrame(frame, dt)
+
+            else:
+                raise ApiUsageError("""\
+                        can't read a journal record of unknown kind {kind!r}.
+
+                        This error means that JournalReader was given a file 
+                        that wasn't written by MessageJournal, or that was 
+                        opened in text mode.  Journals are binary files, so 
+                        make sure to pass either a path or a file opened with 
+                        'rb'.""")
+
+    def read(self, size):
+        # A journal that ends in the middle of a record was most likely cut 
+        # short (e.g. because the game crashed before the journal could be 
+        # flushed), so raise EOFError rather than ApiUsageError.
+
+        data = self.file.read(size)
+        if len(data) != size:
+            raise EOFError("journal ends in the middle of a record")
+        return data
+
+    def close(self):
+        if self.owns_file:
+            self.file.close()
+
+
+def open_journal_file(file, mode):
+    """
+    Return a file object for the given path (or file object opened in binary 
+    mode) and whether or not it should be closed along with the journal.
+    """
+    if isinstance(file, (str, bytes)) or hasattr(file, '__fspath__'):
+        return open(file, mode), True
+    else:
+        return file, False
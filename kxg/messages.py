@@ -2,6 +2,113 @@
 
 from .errors import *
 
+class TokenField:
+    """
+    Declare a `Message` attribute that holds a token (or, if *many* is true, 
+    a list, tuple or set of tokens).
+
+    By default, the game engine finds the tokens referenced by a message by 
+    pickling the whole message and looking at every object it contains.  A 
+    message class that declares its token attributes with this descriptor 
+    promises that no other attribute refers to a token, which lets the engine 
+    find the tokens by simply reading the declared attributes.  The message 
+    can also be packed for the network with each token replaced by its id, 
+    which is faster than hooking into the pickling of every object in the 
+    message.  Messages that declare none of their attributes work like usual.
+
+    Tokens in attributes declared with *add* or *remove* are yielded by the 
+    default `Message.tokens_to_add` or `Message.tokens_to_remove`, 
+    respectively.  Attributes that haven't been set are None (or empty, if 
+    *many* is true).
+    """
+
+    def __init__(self, *, many=False, add=False, remove=False):
+        self.name = None
+        self.many = many
+        self.add = add
+        self.remove = remove
+
+    def __repr__(self):
+        return '{}({!r})'.format(self.__class__.__name__, self.name)
+
+    def __set_name__(self, message_cls, name):
+        self.name = name
+
+    def __get__(self, message, message_cls=None):
+        # This is only called until the attribute is assigned a value, because 
+        # this is a non-data descriptor and the value ends up in the instance 
+        # dictionary.  So reading an assigned attribute is as fast as usual.
+        if message is None:
+            return self
+        return () if self.many else None
+
+    def get_tokens(self, message):
+        value = message.__dict__.get(self.name)
+        if value is None:
+            return ()
+        return value if self.many else (value,)
+
+    def pack_ids(self, value):
+        if value is None:
+            return None
+        if self.many:
+            return type(value)(token.id for token in value)
+        return value.id
+
+    def unpack_ids(self, value, world):
+        if value is None:
+            return None
+        if self.many:
+            return type(value)(world.get_token(id) for id in value)
+        return world.get_token(value)
+
+
+class ValueField:
+    """
+    Declare a `Message` attribute that holds a single plain value (e.g. a 
+    number) with the given `struct` format (e.g. ``'i'`` or ``'d'``).
+
+    Value fields are only used by `CompactMessageSerializer`, which can pack a 
+    message into a few bytes if its class has a `Message.wire_id` and every 
+    one of its attributes is declared with either this descriptor or 
+    `TokenField`.  Attributes that haven't been set have the given default.
+    """
+
+    def __init__(self, format, default=None):
+        from struct import Struct, error
+
+        try:
+            struct = Struct('!' + format)
+            num_values = len(struct.unpack(bytes(struct.size)))
+        except error:
+            num_values = None
+
+        if format[:1] in '@=<>!' or num_values != 1:
+            raise ApiUsageError("""\
+                    expected a struct format for a single value, but got 
+                    '{format}' instead.
+
+                    ValueField formats can't specify a byte order (network 
+                    byte order is always used) and must describe exactly one 
+                    value, e.g. 'i' for an int or 'd' for a float.""")
+
+        self.name = None
+        self.format = format
+        self.default = default
+
+    def __repr__(self):
+        return '{}({!r})'.format(self.__class__.__name__, self.name)
+
+    def __set_name__(self, message_cls, name):
+        self.name = name
+
+    def __get__(self, message, message_cls=None):
+        # See TokenField.__get__().
+        if message is None:
+            return self
+        return self.default
+
+
 class Message:
     # This class defers initializing all of its members until the appropriate 
     # setter is called, rather than initializing everything in a constructor.  
@@ -11,10 +118,67 @@ class Message:
         SOFT_SYNC_ERROR = 0
         HARD_SYNC_ERROR = 1
 
+    # Whether or not every token referenced by this message is held in an 
+    # attribute declared with TokenField.  This is automatically true for 
+    # classes that declare any such attributes, but it can also be set 
+    # explicitly for messages that don't reference any tokens at all.
+
+    declares_tokens = False
+    _token_fields = ()
+    _value_fields = ()
+
+    # A small integer identifying this class to CompactMessageSerializer.  
+    # Every process playing the game must assign the same ids to the same 
+    # classes, so the ids have to be given explicitly.  Ids aren't inherited; 
+    # each subclass needs its own.
+
+    wire_id = None
+    _wire_classes = {}
+
+    # The tick (see Forum.tick) on which the server executed this message.  
+    # This is only filled in on clients, for messages received from the 
+    # server (see ServerTick).
+
+    server_tick = None
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+
+        token_fields = {}
+        value_fields = {}
+
+        for base in reversed(cls.__mro__):
+            for name, member in vars(base).items():
+                if isinstance(member, TokenField):
+                    token_fields[name] = member
+                if isinstance(member, ValueField):
+                    value_fields[name] = member
+
+        cls._token_fields = tuple(token_fields.values())
+        cls._value_fields = tuple(value_fields.values())
+
+        if token_fields and 'declares_tokens' not in vars(cls):
+            cls.declares_tokens = True
+
+        if 'wire_id' not in vars(cls):
+            cls.wire_id = None
+        else:
+            require_wire_id(cls)
+            Message._wire_classes[cls.wire_id] = cls
 
     def __repr__(self):
         return self.__class__.__name__ + '()'
 
+    def __getstate__(self):
+        # The packets cached by _pack() and the serializers are just this 
+        # message in serialized form, so there's no reason to pickle them 
+        # along with the message.  The same goes for the token ids cached by 
+        # _get_referenced_token_ids().
+        state = self.__dict__.copy()
+        state.pop('_packets', None)
+        state.pop('_referenced_token_ids', None)
+        return state
+
     def was_sent(self):
         return hasattr(self, 'sender_id')
 
@@ -44,10 +208,43 @@ class Message:
         return self.was_sent_by(1)
 
     def tokens_to_add(self):
-        yield from []
+        for field in self._token_fields:
+            if field.add:
+                yield from field.get_tokens(self)
 
     def tokens_to_remove(self):
-        yield from []
+        for field in self._token_fields:
+            if field.remove:
+                yield from field.get_tokens(self)
+
+    def merge_key(self):
+        """
+        Return a key identifying the messages this message can be merged 
+        with, or None if it can't be merged with any messages.
+
+        Some messages (e.g. messages that move a unit to a new position) make 
+        earlier messages of the same kind redundant.  If packets are being 
+        batched (see `ClientForum`), two messages sent by the same actor with 
+        the same merge key in the same frame are replaced by the result of 
+        `merge` before being sent over the network.  This saves the server and 
+        the other clients from having to handle each message individually.  
+        Messages that add or remove tokens are never merged.
+        """
+        return None
+
+    def merge(self, later_message):
+        """
+        Return a message with the same effect as this message followed by 
+        *later_message*, or None if these particular messages can't be merged.
+
+        This is called for messages with the same `merge_key`.  By default, 
+        *later_message* is assumed to supersede this message, so it's 
+        returned as is.  The message that's returned is the one that will be 
+        checked by the server and, if that check fails, synced or undone by 
+        the client that sent it, so its `on_undo` should undo the effects of 
+        both messages.  It must not add or remove any tokens.
+        """
+        return later_message
 
     def tokens_referenced(self):
         """
@@ -58,7 +255,14 @@ class Message:
         is sent.  This information is used by the game engine to catch mistakes 
         like forgetting to add a token to the world or keeping a stale 
         reference to a token after its been removed.
+
+        Messages that declare their tokens (see `TokenField`) don't need to be 
+        searched, unless they're adding tokens to the world (because tokens 
+        being added may contain other tokens).
         """
+        if self.declares_tokens and not set(self.tokens_to_add()):
+            return self._get_declared_tokens()
+
         tokens = set()
 
         # Use the pickle machinery to find all the tokens contained at any 
@@ -181,12 +385,14 @@ class Message:
 
     def _set_server_response_id(self, id):
         self._server_response_id = id
+        self._clear_packets()
 
     def _get_server_response_id(self):
         return self._server_response_id
 
     def _set_server_response(self, server_response):
         self._server_response = server_response
+        self._clear_packets()
 
     def _get_server_response(self):
         try:
@@ -194,6 +400,188 @@ class Message:
         except AttributeError:
             return None
 
+    def _get_merge_key(self):
+        """
+        Return the key used to decide which messages can be merged, which 
+        includes the sender, or None if this message can't be merged.
+        """
+        key = self.merge_key()
+        if key is None or self._get_server_response() is not None:
+            return None
+        if set(self.tokens_to_add()) or set(self.tokens_to_remove()):
+            return None
+        return self.sender_id, key
+
+    def _merge(self, later_message):
+        merged_message = self.merge(later_message)
+
+        # Unless the later message is being sent as is, make sure the merged 
+        # message can stand in for it.
+
+        if merged_message is not None and merged_message is not later_message:
+            merged_message.sender_id = later_message.sender_id
+
+            try:
+                merged_message._set_server_response_id(
+                        later_message._get_server_response_id())
+            except AttributeError:
+                merged_message._clear_packets()
+
+        return merged_message
+
+    def _set_packet(self, packet, format='pickle'):
+        """
+        Cache this message in the given serialized format (see 
+        `MessageSerializer.packet_format`).  This way a message that's relayed 
+        to every client is only serialized once, rather than once per client.
+        """
+        try:
+            self._packets[format] = packet
+        except AttributeError:
+            self._packets = {format: packet}
+
+    def _get_packet(self, format='pickle'):
+        try:
+            return self._packets.get(format)
+        except AttributeError:
+            return None
+
+    def _clear_packets(self):
+        self._packets = {}
+
+    def _get_declared_tokens(self):
+        self._require_declared_tokens()
+        return {
+                token
+                for field in self._token_fields
+                for token in field.get_tokens(self)
+        }
+
+    def _require_declared_tokens(self):
+        """
+        Make sure that none of the attributes not declared with `TokenField` 
+        refer to a token.
+
+        Messages that declare their tokens aren't searched for tokens, so a 
+        token stored in any other attribute would otherwise be silently 
+        pickled by value.  Searching the message defeats the purpose of 
+        declaring its tokens, so this is only done when the token safety 
+        checks are fully enabled (see `TokenSafetyChecks`).
+        """
+        from pickle import Pickler
+        from io import BytesIO
+        from .tokens import Token, TokenSafetyChecks
+
+        if TokenSafetyChecks.policy != TokenSafetyChecks.FULL:
+            return
+
+        declared_names = {field.name for field in self._token_fields}
+        message_cls = self.__class__.__name__
+
+        def persistent_id(obj):
+            if isinstance(obj, Token):
+                tokens.append(obj)
+                return id(obj)
+
+        for name, value in self.__dict__.items():
+            if name in declared_names:
+                continue
+
+            tokens = []
+            pickler = Pickler(BytesIO())
+            pickler.persistent_id = persistent_id
+            pickler.dump(value)
+
+            if tokens:
+                raise ApiUsageError("""\
+                        {message_cls}.{name} refers to a token, but isn't 
+                        declared with TokenField.
+
+                        Messages that declare their tokens aren't searched for 
+                        any other tokens, so this token would be pickled by 
+                        value rather than by id.  Declare every attribute that 
+                        holds a token with TokenField, or set declares_tokens 
+                        to False.""")
+
+    def _get_referenced_token_ids(self):
+        """
+        Return the ids of all the tokens referenced by this message.
+
+        The ids are only worked out once, because the server may need them 
+        once for every client it relays the message to (see 
+        `ServerActor.set_relevant_tokens`).
+        """
+        try:
+            return self._referenced_token_ids
+        except AttributeError:
+            self._referenced_token_ids = frozenset(
+                    x.id for x in self.tokens_referenced())
+            return self._referenced_token_ids
+
+    def _pack(self, tokens_to_add):
+        """
+        Pickle this message for the network and return all the tokens it 
+        references.
+
+        The tokens in *tokens_to_add* are pickled in full and every other token 
+        is pickled by its id, which is what `MessageSerializer` expects.  The 
+        pickled data is cached on the message (see `_set_packet`), so it 
+        doesn't have to be pickled again when it's sent to the server or 
+        relayed to each client.  Because the same pass visits every token in 
+        the message, `Actor.send_message` can use the return value to check 
+        the message without pickling it into a throwaway buffer first.
+
+        Any change to the message after this method is called will not be 
+        reflected in the cached packet, so this should be called right before 
+        the message is executed, after it has been assigned all of its ids and 
+        checked.
+        """
+        from pickle import Pickler, dumps
+        from io import BytesIO
+        from .tokens import Token
+
+        # If every token is in a declared attribute and none are being added 
+        # to the world (in which case they'd have to be pickled in full), the 
+        # tokens can be found and replaced with their ids directly.  This 
+        # avoids having to call persistent_id() on every object in the message.
+
+        if self.declares_tokens and not tokens_to_add:
+            self._set_packet(dumps(_DeclaredTokenPacker(self)))
+            return self._get_declared_tokens()
+
+        tokens = set()
+
+        def persistent_id(obj):
+            if isinstance(obj, Token):
+                tokens.add(obj)
+
+                # Pickle tokens that are being added to the world in full, and 
+                # every other token by id.  Tokens without ids also end up 
+                # being pickled in full, just like in tokens_referenced(), but 
+                # those messages will be rejected by Actor.send_message().
+
+                if obj not in tokens_to_add:
+                    return obj.id
+
+        buffer = BytesIO()
+        pickler = Pickler(buffer)
+        pickler.persistent_id = persistent_id
+        pickler.dump(self)
+
+        self._set_packet(buffer.getvalue())
+        return tokens
+
+    def _unpack_token_ids(self, world):
+        """
+        Replace the token ids left in this message by `_DeclaredTokenPacker` 
+        with the corresponding tokens from the given world.
+        """
+        if self.__dict__.pop('_packed_token_ids', False):
+            for field in self._token_fields:
+                if field.name in self.__dict__:
+                    self.__dict__[field.name] = field.unpack_ids(
+                            self.__dict__[field.name], world)
+
     def _assign_token_ids(self, id_factory):
         """
         Assign id numbers to any tokens that will be added to the world by this 
@@ -207,8 +595,11 @@ class Message:
         that `_check` can make sure that valid ids were assigned (although by 
         default it doesn't).
         """
-        for token in self.tokens_to_add():
-            token._give_id(id_factory)
+        tokens = list(self.tokens_to_add())
+        ids = id_factory.reserve(len(tokens))
+
+        for token, id in zip(tokens, ids):
+            token._give_id(id)
 
     def _check(self, world):
         self.on_check(world)
@@ -220,8 +611,7 @@ class Message:
     def _execute(self, world):
         # Deal with tokens to be created or destroyed.
 
-        for token in self.tokens_to_add():
-            world._add_token(token)
+        world._add_tokens(self.tokens_to_add())
 
         # Save the id numbers for the tokens we're removing so we can restore 
         # them if we need to undo this message.
@@ -252,9 +642,12 @@ class Message:
         # the world.  We want to add them back, and we want to make sure they 
         # end up with the id as before.
 
-        for token in self.tokens_to_remove():
+        tokens = list(self.tokens_to_remove())
+
+        for token in tokens:
             token._id = self._removed_token_ids[token]
-            world._add_token(token)
+
+        world._add_tokens(tokens)
 
         # Let derived classes execute themselves.
 
@@ -265,9 +658,80 @@ class MessageCheck(Exception):
     pass
 
 
+class MessageBackpressure(MessageCheck):
+    """
+    Raised by `Actor.send_message` if the message can't be sent yet because 
+    too many of the messages sent before it are still waiting to be 
+    acknowledged by the server (see the ``max_messages_in_flight`` argument to 
+    `ClientForum`).  The message isn't sent, so it's safe to try sending it 
+    again on a later frame.  Use `Actor.can_send_message` to avoid this.
+    """
+    pass
+
+
+class _DeclaredTokenPacker:
+    """
+    Pickle a message that declares its tokens (see `TokenField`) with each 
+    token replaced by its id.
+
+    When unpickled, this produces the message itself, but with ids still in 
+    place of the tokens.  `MessageSerializer.unpack` then looks up the tokens 
+    in the world, because that can't be done during unpickling.
+    """
+
+    def __init__(self, message):
+        self.message = message
+
+    def __reduce__(self):
+        message = self.message
+        state = dict(message.__getstate__())
+
+        for field in message._token_fields:
+            if field.name in state:
+                state[field.name] = field.pack_ids(state[field.name])
+
+        return _unpack_declared_tokens, (message.__class__, state)
+
+
+def _unpack_declared_tokens(message_cls, state):
+    message = message_cls.__new__(message_cls)
+
+    if hasattr(message, '__setstate__'):
+        message.__setstate__(state)
+    else:
+        message.__dict__.update(state)
+
+    message._packed_token_ids = True
+    return message
+
+
 @debug_only
 def require_message(object):
-    require_instance(Message(), object)
+    require_instance(Message, object)
+
+def require_wire_id(cls):
+    wire_id = cls.wire_id
+    if not isinstance(wire_id, int) or not 0 <= wire_id < 2**16:
+        raise ApiUsageError("""\
+                {cls.__name__}.wire_id must be an integer between 0 and 
+                65535, not {wire_id!r}.""")
+
+    # Compare the classes themselves rather than their names, because classes 
+    # with the same name (e.g. in different modules, or redefined) would 
+    # otherwise silently take each other's place.
+
+    other_cls = Message._wire_classes.get(wire_id)
+    if other_cls and other_cls is not cls:
+        cls_name = '{}.{}'.format(cls.__module__, cls.__qualname__)
+        other_cls_name = '{}.{}'.format(
+                other_cls.__module__, other_cls.__qualname__)
+        raise ApiUsageError("""\
+                {cls_name} and {other_cls_name} can't both have 
+                wire_id={wire_id}.
+
+                Each message class must have a unique wire_id, because the id 
+                is all CompactMessageSerializer sends to indicate which class 
+                a message belongs to.""")
 
 @debug_only
 def require_message_cls(cls):
@@ -1,20 +1,46 @@
 from .errors import *
 from .forums import Forum, IdFactory
 from .actors import Actor
+from .messages import Message
 
 class ClientForum(Forum):
 
-    def __init__(self, pipe):
+    def __init__(self, pipe, serializer_cls=None, batch_packets=False,
+            max_messages_in_flight=None, predict_messages=False):
         super().__init__()
         self.pipe = pipe
         self.pipe.lock()
+        self.serializer_cls = serializer_cls or MessageSerializer
+        self.outbox = PacketBatcher(pipe, batch_packets)
 
-        from collections import OrderedDict
+        # If a limit is given, refuse to send any more messages once that many 
+        # are waiting to be acknowledged by the server (see 
+        # Actor.can_send_message).  This keeps the sent message cache (and the 
+        # work needed to clear it every frame) from growing without bound on 
+        # laggy connections.
+
+        self.max_messages_in_flight = max_messages_in_flight
+
+        from collections import OrderedDict, deque
 
         self.actor_id_factory = None
         self.response_id_factory = IdFactory(0, 1)
         self.sent_message_cache = OrderedDict()
 
+        # The most recent tick the server has told this client about (see 
+        # ServerTick).
+
+        self.server_tick = None
+
+        # If prediction is enabled, save a checkpoint before executing each 
+        # message until the server has accepted every message sent from this 
+        # client.  If the server rejects a message, the world can then be 
+        # rolled back to the state it was in before that message and every 
+        # message after it can be executed again, so messages don't need to 
+        # implement on_undo() (see _roll_back_message()).
+
+        self.checkpoints = deque() if predict_messages else None
+
     def receive_id_from_server(self):
         """
         Listen for an id from the server.  Return true if an id has been 
@@ -65,24 +91,80 @@ class ClientForum(Forum):
         super().connect_everyone(world, actors)
 
     def execute_message(self, message):
-        # Cache the message and give it an id number the server can reference 
-        # in its response.  Messages are cached so they can be undone if they 
-        # are rejected by the server.  The id is necessary so the client forum 
-        # (i.e. this object) can associate each response with a cached message.
+        # Cache the message so it can be undone if it's rejected by the server.  
+        # The message was given an id number that the server can reference in 
+        # its response by _prepare_message(), so the client forum (i.e. this 
+        # object) can associate each response with a cached message.
 
-        message._set_server_response_id(self.response_id_factory.next())
         self.sent_message_cache[message._get_server_response_id()] = message
 
         # Relay the message to a ServerActor running on the server to update 
-        # the world on all of the other machines playing the game as well.
+        # the world on all of the other machines playing the game as well.  The 
+        # message was already pickled by Actor.send_message(), so this just 
+        # sends the cached packet.  If packets are being batched, the message 
+        # won't actually be delivered until the end of the frame.
 
-        self.pipe.send(message)
-        self.pipe.deliver()
+        merge = self.outbox.send(message)
+
+        # If the message was merged with a message sent earlier in this frame, 
+        # the server will only respond to the merged message.  So make sure 
+        # the cache is waiting for that response instead of the ones that will 
+        # never come.
+
+        if merge is not None:
+            earlier_message, merged_message = merge
+            earlier_id = earlier_message._get_server_response_id()
+            merged_id = merged_message._get_server_response_id()
+
+            del self.sent_message_cache[earlier_id]
+            self.sent_message_cache[merged_id] = merged_message
 
-        # Have the message update the local world like usual.
+            # If the merged message is rejected, the earlier message will have 
+            # to be rolled back along with it.
+
+            for checkpoint in self.checkpoints or ():
+                if checkpoint.response_id == earlier_id:
+                    checkpoint.response_id = merged_id
+
+        # Have the message update the local world like usual, after saving a 
+        # checkpoint if predictions are being made.
+
+        if self.checkpoints is not None:
+            self.checkpoints.append(MessageCheckpoint(
+                    self.world, message, message._get_server_response_id()))
 
         super().execute_message(message)
 
+    def _prepare_message(self, message):
+        # Give the message an id number before it's pickled, so that the id is 
+        # included in the packet sent to the server.
+        message._set_server_response_id(self.response_id_factory.next())
+
+    def _is_accepting_messages(self):
+        return self.max_messages_in_flight is None or \
+                len(self.sent_message_cache) < self.max_messages_in_flight
+
+    def _acknowledge_messages(self, ack):
+        """
+        Drop every message the server has acknowledged without asking for a 
+        sync or an undo from the sent message cache.
+
+        The cache is ordered by response id, so only the messages up to the 
+        one being acknowledged need to be visited.  Messages that did get a 
+        sync or undo response stay in the cache until that response is handled 
+        (see on_update_game()).
+        """
+        acknowledged_ids = []
+
+        for id, message in self.sent_message_cache.items():
+            if id > ack.id:
+                break
+            if message._get_server_response() is None:
+                acknowledged_ids.append(id)
+
+        for id in acknowledged_ids:
+            del self.sent_message_cache[id]
+
     def execute_sync(self, message):
         """
         Respond when the server indicates that the client is out of sync.
@@ -120,10 +202,15 @@ class ClientForum(Forum):
         """
         info("undoing message: {message}")
 
-        # Roll back changes that the original message made to the world.
+        # Roll back changes that the original message made to the world.  If 
+        # predictions are being made, this is done automatically using the 
+        # checkpoints.  Otherwise the message has to undo itself.
 
         with self.world._unlock_temporarily():
-            message._undo(self.world)
+            if self.checkpoints is not None:
+                self._roll_back_message(message)
+            else:
+                message._undo(self.world)
             self.world._react_to_undo_response(message)
 
         # Give the actors a chance to react to the error.  For example, a 
@@ -134,12 +221,57 @@ class ClientForum(Forum):
             actor._react_to_undo_response(message)
 
     def on_start_game(self):
-        serializer = MessageSerializer(self.world)
+        serializer = self.serializer_cls(self.world)
         self.pipe.push_serializer(serializer)
 
-    def on_update_game(self):
-        from .messages import Message
+    def _roll_back_message(self, message):
+        """
+        Undo the given message by rolling the world back to the checkpoint 
+        saved just before it was executed, then executing every message that 
+        came after it again.
+
+        The messages are executed again without being checked, relayed, or 
+        reported to the actors, because all of that already happened the first 
+        time.  Only the world and its tokens react to them again.
+        """
+        response_id = message._get_server_response_id()
+        checkpoints = list(self.checkpoints)
+
+        for i, checkpoint in enumerate(checkpoints):
+            if checkpoint.response_id == response_id:
+                break
+        else:
+            raise AssertionError(msg("""\
+                    No checkpoint was saved for {message}.  Every message sent 
+                    from this client should have a checkpoint until the server 
+                    accepts or rejects it."""))
+
+        # Roll back the messages in the reverse order they were executed.
 
+        for checkpoint in reversed(checkpoints[i:]):
+            checkpoint.restore(self.world)
+            self.checkpoints.pop()
+
+        # Execute every message except those being undone again, saving new 
+        # checkpoints in case they need to be rolled back again later.
+
+        for checkpoint in checkpoints[i:]:
+            if checkpoint.response_id == response_id:
+                continue
+
+            redo = checkpoint.message
+            self.checkpoints.append(MessageCheckpoint(
+                    self.world, redo, checkpoint.response_id))
+
+            redo._execute(self.world)
+            self.world._react_to_message(redo)
+
+            response = redo._get_server_response()
+            if response and response.sync_needed and not response.undo_needed:
+                redo._sync(self.world)
+                self.world._react_to_sync_response(redo)
+
+    def on_update_game(self):
         # An attempt is made to immediately deliver any messages passed into 
         # execute_message(), but sometimes it takes more than one try to send a 
         # message.  So in case there are any messages waiting to be sent, the 
@@ -149,7 +281,7 @@ class ClientForum(Forum):
 
         # For each message received from the server:
 
-        for packet in self.pipe.receive():
+        for packet in self.outbox.receive():
 
             # If the incoming packet is a message, execute it on this client 
             # and, if necessary, synchronize this client's world with the 
@@ -158,6 +290,16 @@ class ClientForum(Forum):
 
             if isinstance(packet, Message):
                 info("receiving message: {packet}")
+                packet.server_tick = self.server_tick
+
+                # If any messages sent from this client haven't been accepted 
+                # yet, this message might have to be executed again if they 
+                # end up being rolled back.
+
+                if self.checkpoints:
+                    self.checkpoints.append(
+                            MessageCheckpoint(self.world, packet))
+
                 super().execute_message(packet)
                 response = packet._get_server_response()
                 if response and response.sync_needed:
@@ -173,6 +315,22 @@ class ClientForum(Forum):
                 message = self.sent_message_cache[packet.id]
                 message._set_server_response(packet)
 
+            # If the incoming packet acknowledges that every message up to a 
+            # certain id was accepted as is, drop all of those messages from 
+            # the cache at once.  Messages that need to be synced or undone 
+            # get their own responses (see above), which always arrive before 
+            # the acknowledgement that covers them.
+
+            elif isinstance(packet, ServerAck):
+                self._acknowledge_messages(packet)
+
+            # If the incoming packet marks the start of a new tick on the 
+            # server, remember it so that the messages that follow can be 
+            # stamped with it.
+
+            elif isinstance(packet, ServerTick):
+                self.server_tick = packet.tick
+
         # Try to clear the sent message cache:
 
         while self.sent_message_cache:
@@ -201,7 +359,20 @@ class ClientForum(Forum):
 
             self.sent_message_cache.popitem()
 
+        # Forget the checkpoints that can no longer be rolled back to, i.e. all 
+        # those from before the oldest message that hasn't been accepted yet.
+
+        if self.checkpoints is not None:
+            while self.checkpoints and self.checkpoints[0].response_id \
+                    not in self.sent_message_cache:
+                self.checkpoints.popleft()
+
+        # Send any messages that were batched up during this frame.
+
+        self.outbox.deliver()
+
     def on_finish_game(self):
+        self.outbox.deliver()
         self.pipe.pop_serializer()
 
     def _assign_id_factories(self):
@@ -213,25 +384,99 @@ class ClientForum(Forum):
 
 class ServerActor(Actor):
 
-    def __init__(self, pipe):
+    def __init__(self, pipe, serializer_cls=None, batch_packets=False):
         super().__init__()
         self._disable_forum_observation()
         self.pipe = pipe
         self.pipe.lock()
+        self.serializer_cls = serializer_cls or MessageSerializer
+        self.outbox = PacketBatcher(pipe, batch_packets)
+        self.last_tick_sent = None
+
+        # The ids of the tokens the client cares about, or None if it cares 
+        # about every token (see set_relevant_tokens()).
+
+        self.relevant_token_ids = None
 
     def send_message(self, message):
         raise NotImplementedError
 
+    def set_relevant_tokens(self, tokens):
+        """
+        Only relay messages about the given tokens to this client.
+
+        This is meant for games where each player can only see part of the 
+        world (e.g. the area around their units, or what their team can see).  
+        Calling this every frame (e.g. from `Referee.on_update_game`) with the 
+        tokens the player can currently see means that the server only sends, 
+        and the client only executes, the messages that matter to that player.
+
+        A message is relayed as usual if it references any relevant token or 
+        if it doesn't reference any tokens.  Messages that add or remove 
+        tokens are always relayed, so every client always has every token (and 
+        every token id stays valid).  Otherwise the message is skipped, so the 
+        client's copies of the tokens it references go stale.  For that 
+        reason, each token that becomes relevant again is sent to the client 
+        in its current state (see `TokenSnapshot`).  Note that the client's 
+        world won't be up-to-date if skipped messages change anything other 
+        than the tokens they reference.
+
+        Pass None to go back to relaying every message.
+        """
+        if tokens is None:
+            self.relevant_token_ids = None
+            return
+
+        tokens = list(tokens)
+        relevant_token_ids = {x.id for x in tokens}
+
+        # If every token was relevant before, the client is already up to date.
+
+        # The snapshots are sent on behalf of the referee, like every other 
+        # message that originates on the server.
+
+        if self.relevant_token_ids is not None:
+            referee = next(x for x in self._forum.actors if x.is_referee())
+
+            for token in tokens:
+                if token.id not in self.relevant_token_ids:
+                    snapshot = TokenSnapshot(token)
+                    snapshot._set_sender_id(referee._id_factory)
+                    self._send_packet(snapshot)
+
+        self.relevant_token_ids = relevant_token_ids
+
+    def is_relevant(self, message):
+        """
+        Return true if the given message should be relayed to this client.  
+        See `set_relevant_tokens`.
+        """
+        if self.relevant_token_ids is None:
+            return True
+
+        if any(message.tokens_to_add()) or any(message.tokens_to_remove()):
+            return True
+
+        token_ids = message._get_referenced_token_ids()
+
+        return not token_ids or \
+                not self.relevant_token_ids.isdisjoint(token_ids)
+
     def on_start_game(self, num_players):
-        serializer = MessageSerializer(self.world)
+        serializer = self.serializer_cls(self.world)
         self.pipe.push_serializer(serializer)
 
     def on_update_game(self, dt):
         from .messages import MessageCheck
 
+        # Keep track of the last message that was accepted as is, so that all 
+        # the messages received this frame can be acknowledged at once.
+
+        ack = None
+
         # For each message received from the connected client:
 
-        for message in self.pipe.receive():
+        for message in self.outbox.receive():
             info("received message: {message}")
 
             # Make sure the message wasn't sent by an actor with a different id 
@@ -256,6 +501,12 @@ class ServerActor(Actor):
             else:
                 response.sync_needed = False
 
+            # The check may have stored information on the message, so don't 
+            # relay the packet the message arrived in.  The message will be 
+            # packed again, but only once for all the clients.
+
+            message._clear_packets()
+
             # Decide if it will be enough for the clients to sync themselves, 
             # or if this message shouldn't be relayed at all (and should be 
             # undone on the client that sent it).  The message is also given a 
@@ -266,15 +517,19 @@ class ServerActor(Actor):
                         self.world, response)
 
             # Tell the clients how to treat this message.  For the client that 
-            # sent the message in the first place, the response is sent on its 
-            # own.  If a sync or an undo is needed, the client will retrieve 
-            # the original message from its cache and use it to reconcile its 
-            # world with the server's.  Otherwise, the client will just clear 
-            # the original message from its cache.  For all the other clients, 
-            # the response is attached to the message, but only if a sync is 
-            # needed (otherwise nothing special needs to be done).
+            # sent the message in the first place, a response is sent on its 
+            # own if a sync or an undo is needed.  The client will retrieve the 
+            # original message from its cache and use it to reconcile its world 
+            # with the server's.  Otherwise, the message is acknowledged along 
+            # with every other message accepted this frame (see below), and the 
+            # client will just clear it from its cache.  For all the other 
+            # clients, the response is attached to the message, but only if a 
+            # sync is needed (otherwise nothing special needs to be done).
 
-            self.pipe.send(response)
+            if response.sync_needed:
+                self._send_packet(response)
+            else:
+                ack = ServerAck(response.id)
 
             # If the message doesn't have an irreparable sync error, execute it 
             # on the server and relay it to all the other clients.
@@ -282,12 +537,21 @@ class ServerActor(Actor):
             if not response.undo_needed:
                 self._forum.execute_message(message)
 
+        # Acknowledge every message that was accepted as is.  Response ids 
+        # only ever increase, so one acknowledgement covers them all.
+
+        if ack is not None:
+            self._send_packet(ack)
+
         # Deliver any messages waiting to be sent.  This has to be done every 
-        # frame because it sometimes takes more than one try to send a message.
+        # frame because it sometimes takes more than one try to send a message.  
+        # If packets are being batched, this is also when everything queued 
+        # since the last frame is actually sent.
 
-        self.pipe.deliver()
+        self.outbox.deliver()
 
     def on_finish_game(self):
+        self.outbox.deliver()
         self.pipe.pop_serializer()
 
     def _set_forum(self, forum, id):
@@ -302,9 +566,34 @@ class ServerActor(Actor):
         """
         info("relaying message: {message}")
 
-        if not message.was_sent_by(self._id_factory):
-            self.pipe.send(message)
-            self.pipe.deliver()
+        if not message.was_sent_by(self._id_factory) and \
+                self.is_relevant(message):
+            self._send_packet(message)
+
+    def _send_packet(self, packet):
+        """
+        Send the given packet to the client, preceded by a `ServerTick` if it's 
+        the first packet sent on the current tick.  This way every message is 
+        stamped with the tick it was executed on, without the stamp having to 
+        be part of the message (which would mean serializing every message 
+        again after it's executed).
+        """
+        tick = self._forum.tick
+        header = None
+
+        if tick != self.last_tick_sent:
+            header = ServerTick(tick)
+            self.last_tick_sent = tick
+
+        self.outbox.send(packet, header)
+
+    def _deliver_relayed_messages(self):
+        """
+        Send any messages relayed since this actor was updated (e.g. messages 
+        sent by actors that were updated after this one) without waiting for 
+        the next frame.  This only matters if packets are being batched.
+        """
+        self.outbox.deliver()
 
     def _react_to_message(self, message):
         """
@@ -318,6 +607,263 @@ class ServerActor(Actor):
         pass
 
 
+class PacketBatcher:
+    """
+    Send messages through a pipe either one at a time or, if batching is 
+    enabled, in one packet per frame.
+
+    Without batching, every message is written to the socket as soon as it's 
+    sent.  With batching, messages are serialized as soon as they're sent 
+    (because they might change once they're executed) but only written to 
+    the socket, all together in a single `PacketBatch`, when `deliver` is 
+    called at the end of the frame.  This saves a system call and a packet 
+    header for every message after the first.  The receiving end doesn't need 
+    to have batching enabled to understand batches.
+    """
+
+    def __init__(self, pipe, is_enabled=False):
+        from itertools import count
+        from collections import deque
+
+        self.pipe = pipe
+        self.is_enabled = is_enabled
+        self.packets = {}
+        self.mergeable_messages = {}
+        self.packet_indices = count()
+
+        # Packets that were read (and maybe unpacked) ahead of time by 
+        # prefetch(), but haven't been handed out by receive() yet, along with 
+        # the world they were unpacked against and how many tokens had been 
+        # removed from it at the time.
+
+        self.prefetched_packets = deque()
+        self.prefetch_world = None
+        self.prefetch_num_tokens_removed = 0
+
+    def send(self, message, header=None):
+        """
+        Send the given message, or queue it to be sent at the end of the frame 
+        if batching is enabled.
+
+        Messages queued in the same frame are merged if they have the same 
+        merge key (see `Message.merge_key`).  If that happens, a tuple of the 
+        message that was superseded and the message that replaced it is 
+        returned, so the caller can update its own records.  Otherwise None is 
+        returned.
+
+        If a header is given (e.g. a `ServerTick`), it's sent just before the 
+        message, in the same packet.  Writing small packets to the socket one 
+        after another can delay the second by tens of milliseconds (see 
+        Nagle's algorithm), which is why the header isn't just sent on its own.
+        """
+        if not self.is_enabled:
+            if header is not None:
+                serializer = self.pipe.serializer
+                message = PacketBatch([
+                    serializer.pack(header),
+                    serializer.pack(message),
+                ])
+            self.pipe.send(message)
+            self.pipe.deliver()
+            return None
+
+        if header is not None:
+            self.packets[next(self.packet_indices)] = \
+                    self.pipe.serializer.pack(header)
+
+        merge = None
+        merge_key = None
+
+        if isinstance(message, Message):
+            merge_key = message._get_merge_key()
+
+        if merge_key is not None:
+            index, earlier_message = self.mergeable_messages.pop(
+                    merge_key, (None, None))
+
+            if earlier_message is not None:
+                merged_message = earlier_message._merge(message)
+
+                if merged_message is not None:
+                    del self.packets[index]
+                    merge = earlier_message, merged_message
+                    message = merged_message
+
+        # The merged message takes the place of the later message, so that 
+        # it's executed after any other messages sent in between.
+
+        index = next(self.packet_indices)
+        self.packets[index] = self.pipe.serializer.pack(message)
+
+        if merge_key is not None:
+            self.mergeable_messages[merge_key] = index, message
+
+        return merge
+
+    def deliver(self):
+        if self.packets:
+            self.pipe.send(PacketBatch(list(self.packets.values())))
+            self.packets = {}
+            self.mergeable_messages = {}
+
+        self.pipe.deliver()
+
+    def receive(self):
+        """
+        Yield each message received from the pipe, unpacking any batches.
+
+        Messages in a batch are only unpacked once the previous message has 
+        been handled, because they may refer to tokens created by the 
+        previous messages.  The exception is packets that were already 
+        unpacked by `prefetch`, which are yielded first.  If any tokens have 
+        been removed from the world since then, the remaining packets are 
+        unpacked again, so that they can't refer to tokens that are no 
+        longer in the world.
+        """
+        # Take each packet off the queue before it's handled, so that if it 
+        # can't be unpacked, the packets after it are still there next time.
+
+        while self.prefetched_packets:
+            data, packet = self.prefetched_packets.popleft()
+            world = self.prefetch_world
+            if world._num_tokens_removed != self.prefetch_num_tokens_removed:
+                packet = None
+
+            if packet is None:
+                packet = self.pipe.serializer.unpack(data)
+
+            if isinstance(packet, PacketBatch):
+                yield from packet.unpack(self.pipe.serializer)
+            else:
+                yield packet
+
+        for packet in self.pipe.receive():
+            if isinstance(packet, PacketBatch):
+                yield from packet.unpack(self.pipe.serializer)
+            else:
+                yield packet
+
+    def prefetch(self, world):
+        """
+        Read every packet waiting in the pipe and unpack as many of them as 
+        possible, so that `receive` can yield them without unpacking them.
+
+        This is meant to be called by `PacketDecoder`, i.e. from a worker 
+        thread, while the given world isn't changing.  Unlike `receive`, every 
+        packet is unpacked before any of them are handled, so a packet that 
+        refers to a token created by an earlier message can't be unpacked yet.  
+        Those packets are kept as bytes and unpacked by `receive` instead, once 
+        the earlier messages have been executed.
+        """
+        serializer = self.pipe.serializer
+        self.prefetch_world = world
+        self.prefetch_num_tokens_removed = world._num_tokens_removed
+        self.pipe.push_serializer(PacketBatcher.RawSerializer())
+
+        try:
+            packets = list(self.pipe.receive())
+        finally:
+            self.pipe.pop_serializer()
+
+        # A missing token usually means the packet refers to a token that an 
+        # earlier message will create.  Any packet that can't be unpacked is 
+        # left for receive() to unpack again on the main thread, which will 
+        # raise the error there if it happens again.
+
+        def try_unpack(data):
+            try:
+                return data, serializer.unpack(data)
+            except Exception:
+                return data, None
+
+        for data, packet in map(try_unpack, packets):
+            if isinstance(packet, PacketBatch):
+                self.prefetched_packets.extend(map(try_unpack, packet.packets))
+            else:
+                self.prefetched_packets.append((data, packet))
+
+
+    class RawSerializer:
+        """
+        Leave received packets as bytes, so they can be unpacked later.
+        """
+
+        def unpack(self, packet):
+            return packet
+
+
+class PacketBatch:
+    """
+    Hold the serialized messages sent through a pipe in a single frame.
+    """
+
+    def __init__(self, packets):
+        self.packets = packets
+
+    def __repr__(self):
+        return '{}(num_packets={})'.format(
+                self.__class__.__name__, len(self.packets))
+
+    def unpack(self, serializer):
+        for packet in self.packets:
+            yield serializer.unpack(packet)
+
+
+class PacketDecoder:
+    """
+    Unpack the packets received by every `ServerActor` at once, using a pool 
+    of worker threads.
+
+    Normally each `ServerActor` unpacks the messages from its client one at a 
+    time as it handles them, and the actors are updated one after another, so 
+    on a server with many clients a lot of each frame is spent unpacking 
+    messages.  If `MultiplayerServerGame` is given a number of threads, it 
+    uses this class to unpack all the packets received by all its actors (one 
+    task per actor) before any of the actors are updated.  The actors then 
+    check and execute the unpacked messages exactly as before: in the same 
+    order, one at a time, on the main thread.
+
+    Messages are only checked on the main thread because each check needs to 
+    see the effects of the messages executed before it.  Otherwise two 
+    conflicting messages (e.g. two players picking up the same item) could 
+    both be accepted.  Note also that the speed-up depends on the serializer: 
+    pickling holds the global interpreter lock, but decompressing packets 
+    (see `CompressedSerializer`) doesn't.
+    """
+
+    def __init__(self, num_threads):
+        from concurrent.futures import ThreadPoolExecutor
+
+        self.num_threads = num_threads
+        self.executor = ThreadPoolExecutor(
+                num_threads, thread_name_prefix='kxg-decoder')
+
+    def __repr__(self):
+        return '{}(num_threads={})'.format(
+                self.__class__.__name__, self.num_threads)
+
+    def decode(self, actors):
+        """
+        Unpack the packets waiting to be received by the given actors, and 
+        wait for every actor to be finished.
+        """
+        futures = [
+                self.executor.submit(x.outbox.prefetch, x.world)
+                for x in actors if isinstance(x, ServerActor)
+        ]
+
+        # Wait for every task (rather than returning as soon as one fails), 
+        # so no worker is still reading from a pipe when this returns.
+
+        for future in futures:
+            future.exception()
+        for future in futures:
+            future.result()
+
+    def shutdown(self):
+        self.executor.shutdown()
+
+
 class ServerResponse:
 
     def __init__(self, message):
@@ -330,6 +876,136 @@ class ServerResponse:
                 self.__class__.__name__, self.sync_needed, self.undo_needed)
     
 
+class MessageCheckpoint:
+    """
+    Save the state of everything a message is likely to change, so that 
+    `ClientForum` can roll the message back if it's rejected by the server.
+
+    Only the world and the tokens referenced by the message are saved, so 
+    messages that change other tokens can't be completely rolled back.  The 
+    state of each token (see `Token._get_checkpoint`) is pickled, so that 
+    containers modified in place are restored too.  References to tokens are 
+    kept as is rather than being pickled.
+
+    Restoring a checkpoint doesn't touch the extensions of the tokens whose 
+    state is restored.  But tokens added or removed by the rolled back 
+    messages are removed from or put back in the world the usual way, just 
+    like `Message._undo` does.  So `Token.on_add_to_world` and 
+    `Token.on_remove_from_world` are called for them, and their extensions 
+    (e.g. sprites) are thrown away and created again.  This includes tokens 
+    added by the messages that are executed again after the rollback.
+    """
+
+    def __init__(self, world, message, response_id=None):
+        from pickle import Pickler
+        from io import BytesIO
+        from .tokens import Token
+
+        self.message = message
+        self.response_id = response_id
+        self.tokens = [world] + [
+                x for x in message.tokens_referenced()
+                if x is not world and x in world
+        ]
+        self.added_token_ids = [x.id for x in message.tokens_to_add()]
+        self.token_refs = []
+
+        def persistent_id(obj):
+            if isinstance(obj, Token):
+                self.token_refs.append(obj)
+                return len(self.token_refs) - 1
+
+        buffer = BytesIO()
+        delegate = Pickler(buffer)
+        delegate.persistent_id = persistent_id
+        delegate.dump([x._get_checkpoint() for x in self.tokens])
+        self.states = buffer.getvalue()
+
+    def __repr__(self):
+        return '{}(message={}, response_id={})'.format(
+                self.__class__.__name__, self.message, self.response_id)
+
+    def restore(self, world):
+        from pickle import Unpickler
+        from io import BytesIO
+
+        message = self.message
+
+        # Remove the tokens the message added and put back the tokens it 
+        # removed, just like Message._undo() but without calling on_undo().  
+        # The tokens keep their ids, in case the message is executed again.
+
+        for token in message.tokens_to_add():
+            world._remove_token(world.get_token(token.id))
+
+        for token, id in zip(message.tokens_to_add(), self.added_token_ids):
+            token._id = id
+
+        tokens = list(message.tokens_to_remove())
+        for token in tokens:
+            token._id = message._removed_token_ids[token]
+        world._add_tokens(tokens)
+
+        # Restore the saved state of the world and the referenced tokens.
+
+        delegate = Unpickler(BytesIO(self.states))
+        delegate.persistent_load = lambda i: self.token_refs[i]
+
+        for token, state in zip(self.tokens, delegate.load()):
+            token._restore_checkpoint(state)
+
+
+class TokenSnapshot(Message):
+    """
+    Bring a client's copy of a token up to date with the server's.
+
+    The server sends these to clients that didn't receive every message about 
+    a token because it wasn't relevant to them (see 
+    `ServerActor.set_relevant_tokens`).  Actors and tokens can subscribe to 
+    this message like any other, e.g. to redraw the token.
+    """
+
+    def __init__(self, token):
+        self.token = token
+        self.state = token._get_checkpoint()
+
+    def __repr__(self):
+        return '{}(token={})'.format(self.__class__.__name__, self.token)
+
+    def on_check(self, world):
+        pass
+
+    def on_execute(self, world):
+        self.token._restore_checkpoint(self.state)
+
+
+class ServerAck:
+    """
+    Tell a client that every message it sent, up to and including the one with 
+    the given response id, was accepted by the server without needing to be 
+    synced or undone.
+    """
+
+    def __init__(self, id):
+        self.id = id
+
+    def __repr__(self):
+        return "{}(id={})".format(self.__class__.__name__, self.id)
+
+
+class ServerTick:
+    """
+    Tell a client that the messages that follow were executed by the server 
+    on the given tick (see `Forum.tick`).
+    """
+
+    def __init__(self, tick):
+        self.tick = tick
+
+    def __repr__(self):
+        return "{}(tick={})".format(self.__class__.__name__, self.tick)
+
+
 class MessageSerializer:
     """
     Pickle messages before they are sent over the network, and unpickle them 
@@ -338,6 +1014,12 @@ class MessageSerializer:
     the remote world when the message is deserialized.
     """
 
+    # The key used to cache packets produced by this serializer on each 
+    # message (see Message._set_packet()).  Subclasses that produce different 
+    # packets must use different keys.
+
+    packet_format = 'pickle'
+
     def __init__(self, world):
         self.world = world
 
@@ -345,11 +1027,24 @@ class MessageSerializer:
         from pickle import Pickler
         from io import BytesIO
         from .tokens import Token
-        from .messages import Message, require_message
+        from .messages import require_message
+
+        # Messages are usually pickled once by Actor.send_message() (or 
+        # arrive already pickled from a client, see unpack()), in which case 
+        # the cached packet can be sent as is.  This saves the server from 
+        # pickling every message once for each client it's relayed to.
+
+        if isinstance(message, Message):
+            packet = message._get_packet(MessageSerializer.packet_format)
+            if packet is not None:
+                return packet
 
         buffer = BytesIO()
         delegate = Pickler(buffer)
 
+        if isinstance(message, Message):
+            tokens_to_add = set(message.tokens_to_add())
+
         def persistent_id(token):
             if isinstance(token, Token):
                 assert isinstance(message, Message), msg("""\
@@ -363,14 +1058,14 @@ class MessageSerializer:
                         id by Actor.send_message().""")
 
                 if token in self.world:
-                    assert token not in message.tokens_to_add(), msg("""\
+                    assert token not in tokens_to_add, msg("""\
                             Actor.send_message() should've refused to send a 
                             message that would add a token that's already in 
                             the world.""")
                     return token.id
 
                 else:
-                    assert token in message.tokens_to_add(), msg("""\
+                    assert token in tokens_to_add, msg("""\
                             Actor.send_message() should've refused to send a 
                             message referencing tokens that aren't in the world 
                             and aren't being added to the world.""")
@@ -378,8 +1073,12 @@ class MessageSerializer:
 
         delegate.persistent_id = persistent_id
         delegate.dump(message)
+        packet = buffer.getvalue()
 
-        return buffer.getvalue()
+        if isinstance(message, Message):
+            message._set_packet(packet, MessageSerializer.packet_format)
+
+        return packet
 
     def unpack(self, packet):
         from pickle import Unpickler
@@ -389,6 +1088,456 @@ class MessageSerializer:
         delegate = Unpickler(buffer)
 
         delegate.persistent_load = lambda id: self.world.get_token(int(id))
-        return delegate.load()
+        message = delegate.load()
+
+        # Remember the packet each message arrived in, so that the server can 
+        # relay the message to the other clients without pickling it again.  
+        # Any change that should be reflected in the relayed message (e.g. 
+        # attaching a ServerResponse) discards the cached packet.
+
+        if isinstance(message, Message):
+            message._unpack_token_ids(self.world)
+            message._set_packet(packet, MessageSerializer.packet_format)
+
+        return message
+
+
+
+class CompactMessageSerializer(MessageSerializer):
+    """
+    Pack messages and server responses into a compact binary format.
+
+    Messages are packed using `struct` rather than `pickle` if their class has 
+    a `Message.wire_id` and every one of their attributes is declared with 
+    `TokenField` or `ValueField`.  In that case, the packet only contains the 
+    wire id, the ids of the sender and the server response, the values of the 
+    declared fields, and the id of each token.  Server responses and 
+    acknowledgements (along with ticks) are packed in the same way.  Anything 
+    else (e.g. messages that add tokens to the world, which have to be sent in 
+    full, or server responses carrying information for `Message.on_sync`) is 
+    pickled by `MessageSerializer` like usual.
+
+    To use this serializer, pass it to both the `ClientForum` and the 
+    `ServerActor` constructors (or to `MultiplayerClientGame` and 
+    `MultiplayerServerGame`).
+    """
+
+    from struct import Struct
+
+    packet_format = 'compact'
+
+    PICKLE = 0
+    MESSAGE = 1
+    RESPONSE = 2
+    ACK = 3
+    TICK = 4
 
+    HAS_SENDER_ID = 0x1
+    HAS_RESPONSE_ID = 0x2
+    SYNC_NEEDED = 0x1
+    UNDO_NEEDED = 0x2
 
+    NO_TOKEN = 2**32 - 1
+
+    message_header = Struct('!BHB')
+    response_header = Struct('!BIB')
+    ack_header = Struct('!BI')
+    tick_header = Struct('!BI')
+    id = Struct('!I')
+    num_ids = Struct('!BH')
+
+    # The containers that TokenField(many=True) attributes can be packed from 
+    # and unpacked into, indexed by the code sent over the network.
+
+    containers = list, tuple, set, frozenset
+
+    def __init__(self, world):
+        super().__init__(world)
+        self.layouts = {}
+
+    def pack(self, message):
+        # Like MessageSerializer, cache the packet for each message so that a 
+        # message relayed to every client is only packed once.
+
+        if isinstance(message, Message):
+            packet = message._get_packet(self.packet_format)
+            if packet is None:
+                packet = self.pack_message(message) or self.pack_pickle(message)
+                message._set_packet(packet, self.packet_format)
+            return packet
+
+        if isinstance(message, ServerResponse):
+            return self.pack_response(message) or self.pack_pickle(message)
+
+        if isinstance(message, ServerAck):
+            return self.pack_ack(message) or self.pack_pickle(message)
+
+        if isinstance(message, ServerTick):
+            return self.pack_tick(message) or self.pack_pickle(message)
+
+        return self.pack_pickle(message)
+
+    def unpack(self, packet):
+        tag = packet[0]
+
+        if tag == self.MESSAGE:
+            message = self.unpack_message(packet)
+        elif tag == self.RESPONSE:
+            return self.unpack_response(packet)
+        elif tag == self.ACK:
+            return self.unpack_ack(packet)
+        elif tag == self.TICK:
+            return self.unpack_tick(packet)
+        else:
+            message = super().unpack(packet[1:])
+
+        if isinstance(message, Message):
+            message._set_packet(packet, self.packet_format)
+
+        return message
+
+    def pack_pickle(self, message):
+        return bytes([self.PICKLE]) + super().pack(message)
+
+    def pack_message(self, message):
+        """
+        Return the given message packed into bytes, or None if it can't be 
+        packed without pickle.
+        """
+        from struct import error as struct_error
+
+        layout = self.get_layout(type(message))
+        if layout is None:
+            return None
+
+        field_names, values_struct, value_fields, token_fields, \
+                many_token_fields = layout
+
+        # Make sure the message doesn't have any attributes that would be lost 
+        # in this format.  This is the same as checking that the state which 
+        # would be pickled only contains the attributes we know about.
+
+        state = message.__dict__
+        if not field_names.issuperset(state):
+            return None
+        if state.get('_server_response') is not None:
+            return None
+
+        flags = 0
+        ids = []
+
+        if 'sender_id' in state:
+            flags |= self.HAS_SENDER_ID
+            ids.append(state['sender_id'])
+
+        if '_server_response_id' in state:
+            flags |= self.HAS_RESPONSE_ID
+            ids.append(state['_server_response_id'])
+
+        values = [
+                state.get(field.name, field.default)
+                for field in value_fields
+        ]
+        if None in values:
+            return None
+
+        for field in token_fields:
+            token = state.get(field.name)
+            token_id = self.pack_token(token)
+            if token_id is None:
+                return None
+            values.append(token_id)
+
+        many_token_ids = []
+
+        for field in many_token_fields:
+            tokens = state.get(field.name, ())
+            if type(tokens) not in self.containers:
+                return None
+
+            token_ids = [self.pack_token(x) for x in tokens]
+            if None in token_ids or self.NO_TOKEN in token_ids:
+                return None
+
+            container = self.containers.index(type(tokens))
+            many_token_ids.append((container, token_ids))
+
+        # Ids or values that don't fit in the layout (e.g. ids that are too 
+        # big for 32 bits) can still be pickled.
+
+        try:
+            chunks = [self.message_header.pack(
+                self.MESSAGE, message.wire_id, flags)]
+            chunks += [self.id.pack(x) for x in ids]
+            chunks.append(values_struct.pack(*values))
+
+            for container, token_ids in many_token_ids:
+                chunks.append(self.num_ids.pack(container, len(token_ids)))
+                chunks.append(self.Struct('!{}I'.format(len(token_ids))).pack(
+                    *token_ids))
+
+        except struct_error:
+            return None
+
+        return b''.join(chunks)
+
+    def unpack_message(self, packet):
+        tag, wire_id, flags = self.message_header.unpack_from(packet)
+        offset = self.message_header.size
+
+        message_cls = Message._wire_classes[wire_id]
+        message = message_cls.__new__(message_cls)
+        state = message.__dict__
+
+        field_names, values_struct, value_fields, token_fields, \
+                many_token_fields = self.get_layout(message_cls)
+
+        if flags & self.HAS_SENDER_ID:
+            state['sender_id'], = self.id.unpack_from(packet, offset)
+            offset += self.id.size
+
+        if flags & self.HAS_RESPONSE_ID:
+            state['_server_response_id'], = self.id.unpack_from(packet, offset)
+            offset += self.id.size
+
+        values = values_struct.unpack_from(packet, offset)
+        offset += values_struct.size
+
+        for field, value in zip(value_fields, values):
+            state[field.name] = value
+
+        for field, token_id in zip(token_fields, values[len(value_fields):]):
+            state[field.name] = self.unpack_token(token_id)
+
+        for field in many_token_fields:
+            container, num_tokens = self.num_ids.unpack_from(packet, offset)
+            offset += self.num_ids.size
+
+            token_ids = self.Struct('!{}I'.format(num_tokens)).unpack_from(
+                    packet, offset)
+            offset += 4 * num_tokens
+
+            state[field.name] = self.containers[container](
+                    self.world.get_token(x) for x in token_ids)
+
+        return message
+
+    def pack_response(self, response):
+        from struct import error as struct_error
+
+        if response.__dict__.keys() != {'id', 'sync_needed', 'undo_needed'}:
+            return None
+
+        flags = 0
+        if response.sync_needed: flags |= self.SYNC_NEEDED
+        if response.undo_needed: flags |= self.UNDO_NEEDED
+
+        try:
+            return self.response_header.pack(self.RESPONSE, response.id, flags)
+        except struct_error:
+            return None
+
+    def unpack_response(self, packet):
+        tag, id, flags = self.response_header.unpack(packet)
+
+        response = ServerResponse.__new__(ServerResponse)
+        response.id = id
+        response.sync_needed = bool(flags & self.SYNC_NEEDED)
+        response.undo_needed = bool(flags & self.UNDO_NEEDED)
+        return response
+
+    def pack_ack(self, ack):
+        from struct import error as struct_error
+
+        try:
+            return self.ack_header.pack(self.ACK, ack.id)
+        except struct_error:
+            return None
+
+    def unpack_ack(self, packet):
+        tag, id = self.ack_header.unpack(packet)
+        return ServerAck(id)
+
+    def pack_tick(self, tick):
+        from struct import error as struct_error
+
+        try:
+            return self.tick_header.pack(self.TICK, tick.tick)
+        except struct_error:
+            return None
+
+    def unpack_tick(self, packet):
+        tag, tick = self.tick_header.unpack(packet)
+        return ServerTick(tick)
+
+    def pack_token(self, token):
+        """
+        Return the id that should be sent for the given token, or None if the 
+        token isn't in the world (e.g. because it's being added by the message 
+        being packed) and so can't be referred to by id.
+        """
+        if token is None:
+            return self.NO_TOKEN
+        if token in self.world:
+            return token.id
+        return None
+
+    def unpack_token(self, id):
+        return None if id == self.NO_TOKEN else self.world.get_token(id)
+
+    def get_layout(self, message_cls):
+        """
+        Return the information needed to pack and unpack messages of the given 
+        class, or None if they can't be packed by this serializer.  This is 
+        only worked out once per class.
+        """
+        try:
+            return self.layouts[message_cls]
+        except KeyError:
+            pass
+
+        layout = None
+
+        # Every attribute of the message has to be declared for the message 
+        # to be packed, so there's no need to check Message.declares_tokens.
+
+        if message_cls.wire_id is not None:
+            engine_names = {
+                    '_packets', '_referenced_token_ids', 'sender_id',
+                    '_server_response_id', '_server_response',
+            }
+            value_fields = message_cls._value_fields
+            token_fields = [
+                    x for x in message_cls._token_fields if not x.many]
+            many_token_fields = [
+                    x for x in message_cls._token_fields if x.many]
+            field_names = frozenset(engine_names | {
+                    x.name for x in value_fields + message_cls._token_fields})
+            values_struct = self.Struct('!' + ''.join(
+                    [x.format for x in value_fields] + ['I'] * len(token_fields)))
+
+            layout = (field_names, values_struct,
+                    value_fields, token_fields, many_token_fields)
+
+        self.layouts[message_cls] = layout
+        return layout
+
+
+class CompressedSerializer:
+    """
+    Compress the packets produced by another serializer with zlib, if they're 
+    big enough for it to be worthwhile.
+
+    Each packet starts with a flag indicating whether or not it's compressed.  
+    Only packets of at least *threshold* bytes are compressed, and only if 
+    that actually makes them smaller, so small messages (which are usually 
+    the most frequent ones) don't pay for compression.  Messages that carry 
+    new tokens (e.g. map chunks or inventories) can be much smaller this way.
+
+    To use this serializer, pass a factory for it to both the `ClientForum` 
+    and the `ServerActor` constructors, e.g.::
+
+        functools.partial(
+                kxg.CompressedSerializer,
+                serializer_cls=kxg.CompactMessageSerializer,
+                threshold=256)
+
+    The `metrics` attribute keeps track of how much compression is saving.  
+    The serializer used by a pipe is available as ``pipe.serializer``.
+    """
+
+    UNCOMPRESSED = 0
+    COMPRESSED = 1
+
+    def __init__(self, world, serializer_cls=None, threshold=1024, level=6):
+        self.serializer = (serializer_cls or MessageSerializer)(world)
+        self.packet_format = 'zlib/' + self.serializer.packet_format
+        self.threshold = threshold
+        self.level = level
+        self.metrics = CompressionMetrics()
+
+    def pack(self, message):
+        # The underlying serializer and this one both cache their packets on 
+        # each message (see Message._set_packet()), so neither packing nor 
+        # compressing has to be repeated for every client a message is relayed 
+        # to.
+
+        data = self.serializer.pack(message)
+
+        # The packets in a batch have already been through this serializer 
+        # (see PacketBatcher), so don't compress or count them a second time.
+
+        if isinstance(message, PacketBatch):
+            return bytes([self.UNCOMPRESSED]) + data
+
+        if isinstance(message, Message):
+            packet = message._get_packet(self.packet_format)
+            if packet is None:
+                packet = self.compress(data)
+                message._set_packet(packet, self.packet_format)
+        else:
+            packet = self.compress(data)
+
+        self.metrics.record_packet(
+                len(data), len(packet), packet[0] == self.COMPRESSED)
+        return packet
+
+    def unpack(self, packet):
+        from zlib import decompress
+
+        data = packet[1:]
+        if packet[0] == self.COMPRESSED:
+            data = decompress(data)
+
+        message = self.serializer.unpack(data)
+
+        if isinstance(message, Message):
+            message._set_packet(packet, self.packet_format)
+
+        return message
+
+    def compress(self, data):
+        from zlib import compress
+
+        if len(data) >= self.threshold:
+            compressed_data = compress(data, self.level)
+            if len(compressed_data) < len(data):
+                return bytes([self.COMPRESSED]) + compressed_data
+
+        return bytes([self.UNCOMPRESSED]) + data
+
+
+class CompressionMetrics:
+    """
+    Keep track of how much `CompressedSerializer` is shrinking the packets it 
+    sends.
+    """
+
+    def __init__(self):
+        self.num_packets = 0
+        self.num_compressed_packets = 0
+        self.uncompressed_bytes = 0
+        self.compressed_bytes = 0
+
+    def __repr__(self):
+        return '{}(num_packets={}, compression_ratio={:.2f})'.format(
+                self.__class__.__name__,
+                self.num_packets, self.compression_ratio)
+
+    @property
+    def compression_ratio(self):
+        """
+        The number of bytes that would've been sent without compression, 
+        divided by the number of bytes that were actually sent.  Bigger is 
+        better.  This includes the flag added to every packet, so it can be 
+        less than 1 if hardly any packets are big enough to compress.
+        """
+        if not self.compressed_bytes:
+            return 1.0
+        return self.uncompressed_bytes / self.compressed_bytes
+
+    def record_packet(self, uncompressed_size, compressed_size, is_compressed):
+        self.num_packets += 1
+        self.num_compressed_packets += is_compressed
+        self.uncompressed_bytes += uncompressed_size
+        self.compressed_bytes += compressed_size
@@ -24,7 +24,7 @@ class Theater:
         self._initial_stage = initial_stage
         self._current_stage = None
         self._current_update = self._update_before_loop
-        self._previous_time = time.time()
+        self._previous_time = time.monotonic()
 
     @property
     def gui(self):
@@ -75,7 +75,7 @@ class Theater:
 
     def _update_main_loop(self, dt):
         if dt is None:
-            current_time = time.time()
+            current_time = time.monotonic()
             dt = current_time - self._previous_time
             self._previous_time = current_time
 
@@ -161,11 +161,23 @@ class Stage:
 
 
 class GameStage(Stage):
+    """
+    Play the given game until the world says it's over.
+
+    By default, the game is updated once per clock cycle, with however much 
+    time actually elapsed.  If a *tick_rate* is given, the game is instead 
+    updated at that constant rate, with a fixed time step (see 
+    `FixedTimestep`).  This is recommended for servers, because it makes the 
+    simulation (and the CPU it needs) independent of how regularly the GUI 
+    toolkit schedules updates.
+    """
 
-    def __init__(self, game):
+    def __init__(self, game, tick_rate=None, max_ticks_per_update=5):
         Stage.__init__(self)
         self.game = game
         self.successor = None
+        self.timestep = tick_rate and \
+                FixedTimestep(tick_rate, max_ticks_per_update)
 
     def on_enter_stage(self):
         for actor in self.game.actors:
@@ -174,7 +186,17 @@ class GameStage(Stage):
         self.game.start_game()
 
     def on_update_stage(self, dt):
-        self.game.update_game(dt)
+        if not self.timestep:
+            self.game.update_game(dt)
+
+        else:
+            num_ticks = self.timestep.advance(dt)
+            tick_duration = self.timestep.tick_duration
+
+            for i in range(num_ticks):
+                self.game.update_game(tick_duration)
+                if self.game.world.has_game_ended():
+                    break
 
         if self.game.world.has_game_ended():
             self.exit_stage()
@@ -186,13 +208,14 @@ class GameStage(Stage):
 class ServerConnectionStage(Stage):
 
     def __init__(self, world, referee, num_clients, ai_actors=None,
-            host=DEFAULT_HOST, port=DEFAULT_PORT):
+            host=DEFAULT_HOST, port=DEFAULT_PORT, tick_rate=None):
         super().__init__()
         self.world = world
         self.referee = referee
         self.ai_actors = ai_actors or []
         self.host = host
         self.port = port
+        self.tick_rate = tick_rate
         self.pipes = []
         self.greetings = []
         self.server = linersock.Server(
@@ -211,8 +234,10 @@ class ServerConnectionStage(Stage):
         self.pipes += pipes
 
     def on_exit_stage(self):
-        self.successor = GameStage(MultiplayerServerGame(
-                self.world, self.referee, self.ai_actors, self.pipes))
+        self.successor = GameStage(
+                MultiplayerServerGame(
+                    self.world, self.referee, self.ai_actors, self.pipes),
+                tick_rate=self.tick_rate)
 
 
 class ClientConnectionStage(Stage):
@@ -388,7 +413,8 @@ class MultiplayerDebugger:
     def __init__(self, world_cls, referee_cls, gui_cls, gui_actor_cls,
             num_guis=2, ai_actor_cls=None, num_ais=0, theater_cls=PygletTheater,
             host=DEFAULT_HOST, port=DEFAULT_PORT, log_format=
-            '%(levelname)s: %(processName)s: %(name)s: %(message)s'):
+            '%(levelname)s: %(processName)s: %(name)s: %(message)s',
+            tick_rate=None):
 
         # Members of this class have to be pickle-able, because this object 
         # will be pickled and sent to every process that gets started.  That's 
@@ -410,6 +436,7 @@ class MultiplayerDebugger:
         self.host = host
         self.port = port
         self.log_format = log_format
+        self.tick_rate = tick_rate
 
     def play(self):
         # Configure the logging system to print to stderr and include the 
@@ -440,6 +467,7 @@ class MultiplayerDebugger:
                 ai_actors=[self.ai_actor_cls() for i in range(self.num_ais)],
                 host=self.host,
                 port=self.port,
+                tick_rate=self.tick_rate,
         )
         theater.play()
 
@@ -469,8 +497,8 @@ Run a game being developed with the kxg game engine.
 Usage:
     {exe_name} sandbox [<num_ais>] [-v...]
     {exe_name} client [--host HOST] [--port PORT] [-v...]
-    {exe_name} server <num_guis> [<num_ais>] [--host HOST] [--port PORT] [-v...] 
-    {exe_name} debug <num_guis> [<num_ais>] [--host HOST] [--port PORT] [-v...]
+    {exe_name} server <num_guis> [<num_ais>] [--host HOST] [--port PORT] [--tick-rate RATE] [-v...] 
+    {exe_name} debug <num_guis> [<num_ais>] [--host HOST] [--port PORT] [--tick-rate RATE] [-v...]
     {exe_name} --help
 
 Commands:
@@ -512,6 +540,10 @@ Options:
         The port that the server should listen on.  Don't specify a value less 
         than 1024 unless the server is running with root permissions.
 
+    -t --tick-rate RATE
+        Update the game on the server exactly this many times per second, with 
+        a fixed time step, rather than once per frame.
+
     -v --verbose 
         Have the game engine log more information about what it's doing.  You 
         can specify this option several times to get more and more information.
@@ -531,6 +563,7 @@ more information on this process.
     num_guis = int(args['<num_guis>'] or 1)
     num_ais = int(args['<num_ais>'] or 0)
     host, port = args['--host'], int(args['--port'])
+    tick_rate = float(args['--tick-rate'] or 0) or None
 
     logging.basicConfig(
             format='%(levelname)s: %(name)s: %(message)s',
@@ -548,7 +581,8 @@ it.  In the mean time, don't let this confuse you!
 *******************************************************************************""")
         game = MultiplayerDebugger(
                 world_cls, referee_cls, gui_cls, gui_actor_cls, num_guis,
-                ai_actor_cls, num_ais, theater_cls, host, port)
+                ai_actor_cls, num_ais, theater_cls, host, port,
+                tick_rate=tick_rate)
     else:
         game = theater_cls()
         ai_actors = [ai_actor_cls() for i in range(num_ais)]
@@ -567,11 +601,11 @@ it.  In the mean time, don't let this confuse you!
         if args['server']:
             game.initial_stage = ServerConnectionStage(
                     world_cls(), referee_cls(), num_guis, ai_actors,
-                    host, port)
+                    host, port, tick_rate)
 
     game.play()
 
 def require_stage(object):
-    require_instance(Stage(), object)
+    require_instance(Stage, object)
 
 
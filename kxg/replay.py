@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+
+from .errors import *
+
+__all__ = ['ReplayStats', 'replay_journal']
+
+class ReplayStats:
+    """
+    Keep track of how long `replay_journal` spent on each phase of the game.
+
+    All times are in seconds.  The phases are: reading messages from the 
+    journal (including deserializing them), executing messages, and updating 
+    the world at the end of each frame.
+    """
+
+    def __init__(self):
+        self.num_frames = 0
+        self.num_messages = 0
+        self.read_time = 0
+        self.execute_time = 0
+        self.update_time = 0
+
+    def __repr__(self):
+        return '{}(num_frames={}, num_messages={}, total_time={:.3f})'.format(
+                self.__class__.__name__,
+                self.num_frames, self.num_messages, self.total_time)
+
+    def __str__(self):
+        return '\n'.join([
+            '{:.0f} frames/sec ({} frames)'.format(
+                self.frames_per_sec, self.num_frames),
+            '{:.0f} messages/sec ({} messages)'.format(
+                self.messages_per_sec, self.num_messages),
+            'read:    {:.3f} s'.format(self.read_time),
+            'execute: {:.3f} s'.format(self.execute_time),
+            'update:  {:.3f} s'.format(self.update_time),
+            'total:   {:.3f} s'.format(self.total_time),
+        ])
+
+    @property
+    def total_time(self):
+        return self.read_time + self.execute_time + self.update_time
+
+    @property
+    def frames_per_sec(self):
+        return self.num_frames / self.total_time if self.total_time else 0.0
+
+    @property
+    def messages_per_sec(self):
+        return self.num_messages / self.total_time if self.total_time else 0.0
+
+
+def replay_journal(file, world):
+    """
+    Replay the game recorded in the given journal as fast as possible, and 
+    return a `ReplayStats` object describing how long it took.
+
+    The game is replayed without any actors, pipes, or GUI, so the only thing 
+    being measured is the engine itself (i.e. `Forum.execute_message` and 
+    `World.on_update_game`).  This makes replays useful as a repeatable 
+    benchmark based on real game traffic, and as a regression test: the state 
+    of the world after the replay should be the same as it was at the end of 
+    the original game.  The given world must be a new instance of the same 
+    class that was used to record the journal (see `MessageJournal`), and the 
+    messages will be deserialized into it.  Messages are executed just like 
+    they were in the original game, but they aren't checked again, because 
+    they were already checked before they were recorded.
+
+    Journals opened from a path are appended to, so a single file may contain 
+    several sessions one after another.  Each session would have to be 
+    replayed into its own world, so an `ApiUsageError` is raised if the frame 
+    numbers ever go backwards (which is where a new session starts).
+    """
+    from .game import Game
+    from .forums import Forum
+    from .journal import JournalReader, JournalMessage
+    from time import perf_counter
+
+    game = Game(world, Forum(), [])
+    stats = ReplayStats()
+    game.start_game()
+
+    with JournalReader(file, world) as reader:
+        records = iter(reader)
+        frame = 0
+
+        while True:
+            start = perf_counter()
+            record = next(records, None)
+            stats.read_time += perf_counter() - start
+
+            if record is None:
+                break
+
+            if record.frame < frame:
+                raise ApiUsageError("""\
+                        can't replay a journal containing more than one 
+                        session.
+
+                        Frame {record.frame} was recorded after frame {frame}, 
+                        which most likely means that a second game was 
+                        appended to the same journal file.  Each session needs 
+                        to be replayed into a new world, so record each game 
+                        into its own journal file.""")
+
+            frame = record.frame
+
+            # Messages don't need to be checked or relayed; just execute them 
+            # exactly as they were executed in the original game.
+
+            if isinstance(record, JournalMessage):
+                start = perf_counter()
+                game.forum.execute_message(record.message)
+                stats.execute_time += perf_counter() - start
+                stats.num_messages += 1
+
+            # Update the world at the end of every frame, using the same time 
+            # step as the original game.
+
+            else:
+                start = perf_counter()
+                game.update_game(record.dt)
+                stats.update_time += perf_counter() - start
+                stats.num_frames += 1
+
+    game.finish_game()
+    return stats
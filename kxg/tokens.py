@@ -1,9 +1,10 @@
 #!/usr/bin/env python3
 
 import contextlib
+from weakref import WeakSet
 
 from .errors import *
-from .forums import ForumObserver
+from .forums import ForumObserver, SubscriptionIndex
 from .actors import require_actor
 
 def read_only(method):
@@ -14,7 +15,7 @@ def read_only(method):
     setattr(method, '_kxg_read_only', True)
     return method
 
-def watch_token(method):
+def watch_token(method=None, *, batch=False):
     """
     Mark a token extension method that should automatically be called when a 
     token method of the same name is called.
@@ -26,9 +27,38 @@ def watch_token(method):
     in the `TokenExtension` constructor, which searches for the label added 
     here.  But other classes won't make this search and will silently do 
     nothing.
+
+    The decorator can be used either bare (``@watch_token``) or with 
+    arguments (``@watch_token(batch=True)``).  Batched watchers are called at 
+    most once per frame, at the end of the frame and with the arguments from 
+    the last time the token method was called.  This is useful for extensions 
+    that only need to know that something changed, e.g. to redraw a sprite 
+    after a unit has moved several times.
     """
-    method._kxg_watch_token = True
-    return method
+    def decorator(method):
+        method._kxg_watch_token = True
+        method._kxg_watch_token_batch = batch
+        return method
+
+    return decorator(method) if method is not None else decorator
+
+def lazy_extension(extension_cls):
+    """
+    Mark a `TokenExtension` class that shouldn't be instantiated until it's 
+    actually needed.
+
+    Normally every token extension is instantiated as soon as its token is 
+    added to the world.  Extensions of classes marked with this decorator are 
+    instead instantiated the first time they're requested (e.g. by 
+    `Token.get_extension`) or the first time they need to handle a message 
+    they've subscribed to with the `subscribe_to_message` decorator (or 
+    similar).  This saves time and memory in worlds where most tokens never 
+    need their extensions.  Extensions that use the `watch_token` decorator 
+    are always instantiated right away, because they need to see every call to 
+    the methods they're watching.
+    """
+    extension_cls._kxg_lazy_extension = True
+    return extension_cls
 
 class TokenSafetyChecks(type):
     """
@@ -48,85 +78,201 @@ class TokenSafetyChecks(type):
     
     The checks configured by this metaclass help find bugs, but may also incur 
     unnecessary computational expense once the game has been fully debugged.  
-    For this reason, you can skip the checks by invoking python with 
-    optimization enabled (i.e. passing -O).
+    For this reason, `set_policy` can be used at any time to choose between 
+    checking every call (`FULL`), checking only one in every few calls 
+    (`SAMPLED`), or not checking at all (`OFF`), either for every token class 
+    or for particular token classes.  When the checks are off, the original 
+    methods are restored, so they don't cost anything.  The checks are off by 
+    default if python is invoked with optimization enabled (i.e. passing -O).
     """
 
+    FULL = 'full'
+    SAMPLED = 'sampled'
+    OFF = 'off'
+
+    policy = FULL if __debug__ else OFF
+    sample_interval = 100
+
+    _token_classes = WeakSet()
+
     def __new__(meta, name, bases, members):
-        if __debug__:
-            meta.add_safety_checks(members)
+        cls = super().__new__(meta, name, bases, members)
+        cls._kxg_unchecked_methods = {
+                member_name: member_value
+                for member_name, member_value in members.items()
+                if meta.needs_safety_check(member_name, member_value)
+        }
+        meta._token_classes.add(cls)
+        meta.apply_policy(cls)
+        return cls
 
-        return super().__new__(meta, name, bases, members)
-        
+    @classmethod
+    def set_policy(meta, policy, token_cls=None, sample_interval=None):
+        """
+        Choose how thoroughly token methods should be checked.
+
+        The policy must be one of `FULL`, `SAMPLED`, or `OFF`.  If a token 
+        class is given, the policy only applies to that class and its 
+        subclasses (unless they have a policy of their own), and passing None 
+        makes that class go back to using the global policy.  Otherwise the 
+        policy applies to every token class without a policy of its own.  The 
+        sample interval controls how many calls to each method are made for 
+        every one that's checked when the `SAMPLED` policy is in effect.  The 
+        calls are counted per method, not per token, so every instance of a 
+        class shares the same count: calling a method on one token brings the 
+        next check closer for every other token of that class.
+        """
+        if policy not in (meta.FULL, meta.SAMPLED, meta.OFF, None):
+            raise ApiUsageError("""\
+                    unknown safety check policy {policy!r}.
+
+                    The safety check policy must be one of 
+                    TokenSafetyChecks.FULL, TokenSafetyChecks.SAMPLED, or 
+                    TokenSafetyChecks.OFF.""")
+
+        if token_cls is not None:
+            token_cls._kxg_safety_check_policy = policy
+        elif policy is not None:
+            meta.policy = policy
+
+        if sample_interval is not None:
+            meta.sample_interval = sample_interval
+
+        # Apply the policy to every class before reinstalling any watch 
+        # dispatchers, because the dispatchers for subclasses may wrap methods 
+        # inherited from their base classes.
+
+        token_classes = list(meta._token_classes)
+
+        for cls in token_classes:
+            meta.apply_policy(cls)
+
+        for cls in token_classes:
+            meta.apply_watch_dispatches(cls)
+
+    @classmethod
+    def get_policy(meta, token_cls):
+        """
+        Return the policy in effect for the given token class.
+        """
+        return getattr(token_cls, '_kxg_safety_check_policy', None) \
+                or meta.policy
 
     @classmethod
-    def add_safety_checks(meta, members):
+    def apply_policy(meta, cls):
         """
-        Iterate through each member of the class being created and add a 
-        safety check to every method that isn't marked as read-only.
+        Replace each method of the given class that needs to be checked with a 
+        version that is checked according to the current policy.
         """
-        for member_name, member_value in members.items():
-            members[member_name] = meta.add_safety_check(
-                    member_name, member_value)
+        policy = meta.get_policy(cls)
+
+        for member_name, member_value in cls._kxg_unchecked_methods.items():
+            if policy == meta.OFF:
+                method = member_value
+            else:
+                method = meta.add_safety_check(
+                        member_name, member_value, policy, meta.sample_interval)
+
+            setattr(cls, member_name, method)
 
     @staticmethod
-    def add_safety_check(member_name, member_value):
+    def apply_watch_dispatches(cls):
         """
-        If the given member is a method that is public (i.e. doesn't start with 
-        an underscore) and hasn't been marked as read-only, replace it with a 
-        version that will check to make sure the world is locked.  This ensures 
-        that methods that alter the token are only called from update methods 
-        or messages.
+        Reinstall the dispatchers for any methods of the given class that are 
+        being watched, so that they wrap the methods installed by the current 
+        policy.
         """
-        import functools
-        from types import FunctionType
+        for method_name in cls.__dict__.get('_kxg_watched_method_names', ()):
+            cls._add_watch_dispatch(method_name)
 
-        # Bail if the given member is read-only, private, or not a method.
+    @staticmethod
+    def needs_safety_check(member_name, member_value):
+        """
+        Return true if the given member is a method that is public (i.e. 
+        doesn't start with an underscore) and hasn't been marked as read-only.
+        """
+        from types import FunctionType
 
         is_method = isinstance(member_value, FunctionType)
         is_read_only = hasattr(member_value, '_kxg_read_only')
         is_private = member_name.startswith('_')
 
-        if not is_method or is_read_only or is_private:
-            return member_value
-
-        def safety_checked_method(self, *args, **kwargs):
-            """
-            Make sure that the token the world is locked before a non-read-only 
-            method is called.
-            """
-            # Because these checks are pretty magical, I want to be really 
-            # careful to avoid raising any exceptions other than the check 
-            # itself (which comes with a very clear error message).  Here, that 
-            # means using getattr() to make sure the world attribute actually 
-            # exists.  For example, there's nothing wrong with the following 
-            # code, but it does call a safety-checked method before the world 
-            # attribute is defined:
-            #
-            # class MyToken(kxg.Token):
-            #     def __init__(self):
-            #         self.init_helper()
-            #         super().__init__()
-
-            world = getattr(self, 'world', None)
-            if world and world.is_locked():
-                nonlocal member_name
-                raise ApiUsageError("""\
-                        attempted unsafe invocation of 
-                        {self.__class__.__name__}.{member_name}().
-
-                        This error brings attention to situations that might 
-                        cause synchronization issues in multiplayer games.  The 
-                        {member_name}() method is not marked as read-only, but 
-                        was invoked from outside the context of a message.  
-                        This means that if {member_name}() makes any changes to 
-                        the world, those changes will not be propagated.  If 
-                        {member_name}() is actually read-only, label it with 
-                        the @kxg.read_only decorator.""")
-
-            # After making that check, call the method as usual.
-
-            return member_value(self, *args, **kwargs)
+        return is_method and not is_read_only and not is_private
+
+    @staticmethod
+    def add_safety_check(member_name, member_value, policy, sample_interval):
+        """
+        Return a version of the given method that will check to make sure the 
+        world is locked.  This ensures that methods that alter the token are 
+        only called from update methods or messages.
+        """
+        import functools
+
+        if policy == TokenSafetyChecks.FULL:
+
+            def safety_checked_method(self, *args, **kwargs):
+                """
+                Make sure that the world is unlocked before a non-read-only 
+                method is called.
+                """
+                # Because these checks are pretty magical, I want to be really 
+                # careful to avoid raising any exceptions other than the check 
+                # itself (which comes with a very clear error message).  Here, 
+                # that means catching the AttributeError that will be raised if 
+                # the token isn't in the world (and so its world is None) or if 
+                # its world attribute hasn't been defined yet.  For example, 
+                # there's nothing wrong with the following code, but it does 
+                # call a safety-checked method before the world attribute is 
+                # defined:
+                #
+                # class MyToken(kxg.Token):
+                #     def __init__(self):
+                #         self.init_helper()
+                #         super().__init__()
+                #
+                # The lock flag is read directly (rather than via the world 
+                # property and World.is_locked()) to keep the check cheap.
+
+                try:
+                    is_locked = self._world._is_locked
+                except AttributeError:
+                    is_locked = False
+
+                if is_locked:
+                    raise _unsafe_invocation_error(self, member_name)
+
+                # After making that check, call the method as usual.
+
+                return member_value(self, *args, **kwargs)
+
+        elif policy == TokenSafetyChecks.SAMPLED:
+            calls_until_check = 1
+
+            def safety_checked_method(self, *args, **kwargs):
+                """
+                Make sure that the world is unlocked before a non-read-only 
+                method is called, but only check every so often.
+                """
+                nonlocal calls_until_check
+                calls_until_check -= 1
+
+                if not calls_until_check:
+                    calls_until_check = sample_interval
+
+                    try:
+                        is_locked = self._world._is_locked
+                    except AttributeError:
+                        is_locked = False
+
+                    if is_locked:
+                        raise _unsafe_invocation_error(self, member_name)
+
+                return member_value(self, *args, **kwargs)
+
+        else:
+            raise AssertionError(msg("""\
+                    TokenSafetyChecks.set_policy() should've refused the 
+                    unknown policy {policy!r}."""))
 
         # Preserve any "forum observer" decorations that have been placed on 
         # the method and restore the method's original name and module strings, 
@@ -142,27 +288,53 @@ class TokenSafetyChecks(type):
         )
         return safety_checked_method
 
+def _unsafe_invocation_error(self, member_name):
+    return ApiUsageError("""\
+            attempted unsafe invocation of 
+            {self.__class__.__name__}.{member_name}().
+
+            This error brings attention to situations that might cause 
+            synchronization issues in multiplayer games.  The {member_name}() 
+            method is not marked as read-only, but was invoked from outside the 
+            context of a message.  This means that if {member_name}() makes any 
+            changes to the world, those changes will not be propagated.  If 
+            {member_name}() is actually read-only, label it with the 
+            @kxg.read_only decorator.""")
+
 class TokenExtension(ForumObserver):
 
+    _watched_methods = ()
+
     def __init__(self, actor, token):
         super().__init__()
         self.actor = actor
         self.token = token
+        self._attach_to_index(actor._subscription_index)
 
-        # Iterate through all of the extension methods to find ones wanting to 
-        # "watch" the token, then configure the token to call these methods 
-        # whenever a token method of the same name is called.
-        
-        from inspect import getmembers, ismethod
+        # Configure the token to call any extension methods that want to 
+        # "watch" it whenever a token method of the same name is called.  The 
+        # watching methods are found once per class (see __init_subclass__).
+
+        for method_name, batch in self._watched_methods:
+            token.watch_method(method_name, getattr(self, method_name), batch)
 
-        for method_name, method in getmembers(self, ismethod):
+    def __init_subclass__(cls, **kwargs):
+        """
+        Find the methods that have been labeled by the `watch_token` decorator.
 
-            # Methods with the '_kxg_watch_token' attribute set should be set 
-            # up to watch the token.  This attribute is typically set using the
-            # @watch_token decorator.
+        Methods with the '_kxg_watch_token' attribute set should be set up to 
+        watch the token.  The result only depends on the class, so it's 
+        computed once when the class is created rather than every time an 
+        extension is instantiated.
+        """
+        super().__init_subclass__(**kwargs)
+        from inspect import getmembers, isroutine
 
-            if hasattr(method, '_kxg_watch_token'):
-                token.watch_method(method_name, method)
+        cls._watched_methods = tuple(
+                (method_name, getattr(method, '_kxg_watch_token_batch', False))
+                for method_name, method in getmembers(cls, isroutine)
+                if hasattr(method, '_kxg_watch_token')
+        )
 
     def __rshift__(self, message):
         return self.send_message(message)
@@ -172,25 +344,22 @@ class TokenExtension(ForumObserver):
 
 class Token(ForumObserver, metaclass=TokenSafetyChecks):
 
-    class WatchedMethod:
-
-        def __init__(self, method):
-            self.method = method
-            self.watchers = []
+    # The number of frames between calls to on_update_game().  Tokens that 
+    # don't need to be updated every frame can set this to a larger number, 
+    # in which case on_update_game() will be given the time elapsed since the 
+    # token was last updated.
+    update_interval = 1
 
-        def __call__(self, *args, **kwargs):
-            self.method(*args, **kwargs)
-            for watcher in self.watchers:
-                watcher(*args, **kwargs)
-
-        def add_watcher(self, watcher):
-            self.watchers.append(watcher)
+    # The number of frames between calls to on_report_to_referee().
+    report_interval = 1
 
     def __init__(self):
         super().__init__()
         self._id = None
         self._world = None
         self._extensions = {}
+        self._pending_extensions = {}
+        self._watchers = {}
         self._disable_forum_observation()
 
     def __repr__(self, **kwargs):
@@ -205,6 +374,8 @@ class Token(ForumObserver, metaclass=TokenSafetyChecks):
         state = super().__getstate__()
         del state['_world']
         del state['_extensions']
+        del state['_pending_extensions']
+        del state['_watchers']
         return state
 
     def __setstate__(self, state):
@@ -236,31 +407,40 @@ class Token(ForumObserver, metaclass=TokenSafetyChecks):
     @read_only
     def has_extension(self, actor):
         require_actor(actor)
-        return actor in self._extensions
+        return actor in self._extensions or actor in self._pending_extensions
 
     @read_only
     def get_extension(self, actor):
         require_actor(actor)
-        return self._extensions[actor]
+        try:
+            return self._extensions[actor]
+        except KeyError:
+            if actor not in self._pending_extensions:
+                raise
+            return self._instantiate_extension(actor)
 
     @read_only
     def get_extensions(self):
+        for actor in list(self._pending_extensions):
+            self._instantiate_extension(actor)
         return list(self._extensions.values())
 
     @read_only
-    def watch_method(self, method_name, callback):
+    def watch_method(self, method_name, callback, batch=False):
         """
         Register the given callback to be called whenever the method with the 
         given name is called.  You can easily take advantage of this feature in 
         token extensions by using the `watch_token` decorator.
+
+        If *batch* is true, the callback will be called at most once per frame 
+        (see `watch_token`).  Callbacks are forgotten when the token is removed 
+        from the world.
         """
 
         # Make sure a token method with the given name exists, and complain if 
         # nothing is found.
 
-        try:
-            method = getattr(self, method_name)
-        except AttributeError:
+        if not callable(getattr(type(self), method_name, None)):
             raise ApiUsageError("""\
                     {self.__class__.__name__} has no such method 
                     {method_name}() to watch.
@@ -270,18 +450,25 @@ class Token(ForumObserver, metaclass=TokenSafetyChecks):
                     didn't match the name of any method in the corresponding 
                     token class.  Check for typos.""")
 
-        # Wrap the method in a WatchedMethod object, if that hasn't already 
-        # been done.  This object manages a list of callback method and takes 
-        # responsibility for calling them after the method itself has been 
-        # called.
+        # Make sure the token's class has a dispatcher for the given method.  
+        # The dispatcher is shared by every instance of the class, and takes 
+        # responsibility for calling the callbacks registered with each 
+        # instance after the method itself has been called.
 
-        if not isinstance(method, Token.WatchedMethod):
-            setattr(self, method_name, Token.WatchedMethod(method))
-            method = getattr(self, method_name)
+        cls = type(self)
+        if method_name not in cls.__dict__.get('_kxg_watched_method_names', ()):
+            cls._add_watch_dispatch(method_name)
 
         # Add the given callback to the watched method.
 
-        method.add_watcher(callback)
+        self._watchers.setdefault(method_name, []).append((callback, batch))
+
+        # The world only calls hooks like on_update_game() for tokens that 
+        # override them (see TokenScheduler), so let it know that this hook 
+        # needs to be called now that something is watching it.
+
+        if self._world is not None and self._world is not self:
+            self._world._schedule_watched_token(self, method_name)
 
     def on_add_to_world(self, world):
         pass
@@ -296,19 +483,72 @@ class Token(ForumObserver, metaclass=TokenSafetyChecks):
     def on_remove_from_world(self):
         pass
 
-    def _give_id(self, id_factory):
-        require_token(self)
+    @classmethod
+    def _add_watch_dispatch(cls, method_name):
+        """
+        Replace the given method of this class with a version that calls the 
+        watchers registered with each instance after calling the method.
+        """
+        import functools
+
+        if '_kxg_watched_method_names' not in cls.__dict__:
+            cls._kxg_watched_method_names = set()
+        cls._kxg_watched_method_names.add(method_name)
+
+        # If this class already has a dispatcher, take it out so it can be 
+        # replaced.  If this class inherits a dispatcher from a base class, 
+        # wrap the method inside it rather than the dispatcher itself.
 
-        from .forums import IdFactory
-        assert isinstance(id_factory, IdFactory), msg("""\
-                The argument to Token._give_id() should be an IdFactory.  This 
-                method should also only be called by the game engine itself.""")
+        current_method = cls.__dict__.get(method_name)
+        if hasattr(current_method, '_kxg_unwatched'):
+            if current_method._kxg_is_inherited:
+                delattr(cls, method_name)
+            else:
+                setattr(cls, method_name, current_method._kxg_unwatched)
+
+        is_inherited = method_name not in cls.__dict__
+        method = getattr(cls, method_name)
+        method = getattr(method, '_kxg_unwatched', method)
+
+        def watched_method(self, *args, **kwargs):
+            result = method(self, *args, **kwargs)
+
+            # Only notify the watchers from the dispatcher belonging to the 
+            # instance's own class.  Otherwise a method that calls super() 
+            # would notify its watchers twice.
+
+            if type(self) is cls:
+                watchers = self._watchers.get(method_name)
+                if watchers:
+                    self._notify_watchers(watchers, args, kwargs)
+
+            return result
+
+        functools.update_wrapper(watched_method, method)
+        watched_method._kxg_unwatched = method
+        watched_method._kxg_is_inherited = is_inherited
+        setattr(cls, method_name, watched_method)
+
+    def _notify_watchers(self, watchers, args, kwargs):
+        for callback, batch in watchers:
+            if batch and self._world is not None:
+                self._world._defer_watcher(self, callback, args, kwargs)
+            else:
+                callback(*args, **kwargs)
+
+    def _give_id(self, id):
+        """
+        Assign the given id number, which should've been reserved from an 
+        `IdFactory` by `Message._assign_token_ids`, to this token.  This method 
+        should only be called by the game engine itself.
+        """
+        require_token(self)
         assert not self.has_id, msg("""\
                 Can't give {self} and id because it already has one.  
                 Actor.send_message() should've refused to send a message that 
                 would add a duplicate token to the world.""")
 
-        self._id = id_factory.next()
+        self._id = id
 
     def _check_if_forum_observation_enabled(self):
         """
@@ -341,11 +581,13 @@ class Token(ForumObserver, metaclass=TokenSafetyChecks):
     def _add_to_world(self, world, actors):
         self._world = world
         self._enable_forum_observation()
+        self._attach_to_index(world._token_subscriptions)
         self._create_extensions(actors)
         self.on_add_to_world(world)
 
     def _create_extensions(self, actors):
         self._extensions = {}
+        self._pending_extensions = {}
         extension_classes = self.__extend__()
 
         for actor in actors:
@@ -353,33 +595,71 @@ class Token(ForumObserver, metaclass=TokenSafetyChecks):
             extension_class = extension_classes.get(actor_class)
 
             if extension_class:
+                require_extension_class(extension_class)
+
+                # Either instantiate the extension and store a reference to 
+                # it, or wait until it's actually needed.
 
-                # Raise an easy-to-understand error if the extension class's 
-                # constructor takes something other than (self, actor, token).  
-                # An error would be raised anyway as soon as we try to 
-                # instantiate the extension, but that error would be hard to 
-                # understand because it wouldn't contain the name of the 
-                # offending extension and would come from pretty deep in the 
-                # game engine.
-
-                from inspect import getfullargspec
-                argspec = getfullargspec(extension_class.__init__)
-                if len(argspec.args) != 3:
-                    raise ApiUsageError("""\
-                            the {extension_class.__name__} constructor doesn't 
-                            take the right arguments.
-
-                            Token extension constructors must take exactly 
-                            three arguments: self, actor, and token.  These are 
-                            the arguments provided by tokens when they 
-                            automatically instantiate their extensions.  Fix 
-                            this error by making the {extension_class} 
-                            constructor compatible with these arguments.""")
-
-                # Instantiate the extension and store a reference to it.
-
-                extension = extension_class(actor, self)
-                self._extensions[actor] = extension
+                is_lazy = getattr(extension_class, '_kxg_lazy_extension', False)
+                is_watching = bool(getattr(
+                        extension_class, '_watched_methods', ()))
+
+                if is_lazy and not is_watching:
+                    self._defer_extension(actor, extension_class)
+                else:
+                    extension = extension_class(actor, self)
+                    self._extensions[actor] = extension
+
+    def _defer_extension(self, actor, extension_class):
+        """
+        Arrange for the given extension to be instantiated the first time it 
+        needs to handle a message.
+
+        In place of each callback the extension would subscribe to (via 
+        decorators), a placeholder is registered with the actor's subscription 
+        index.  When any placeholder is called, the extension is instantiated 
+        (which registers its real callbacks) and handed the message.
+        """
+        index = actor._subscription_index
+        placeholders = []
+
+        def placeholder(event):
+            return lambda message: \
+                    self._react_with_pending_extension(actor, event, message)
+
+        for event, message_cls, _ in extension_class._decorated_callbacks:
+            key = index.add(event, message_cls, placeholder(event))
+            placeholders.append((event, message_cls, key))
+
+        self._pending_extensions[actor] = extension_class, placeholders
+
+    def _instantiate_extension(self, actor):
+        extension_class, placeholders = self._pending_extensions.pop(actor)
+
+        for event, message_cls, key in placeholders:
+            actor._subscription_index.drop(event, message_cls, key)
+
+        extension = extension_class(actor, self)
+        self._extensions[actor] = extension
+        return extension
+
+    def _drop_pending_extensions(self):
+        for actor, (_, placeholders) in self._pending_extensions.items():
+            for event, message_cls, key in placeholders:
+                actor._subscription_index.drop(event, message_cls, key)
+
+        self._pending_extensions = {}
+
+    def _react_with_pending_extension(self, actor, event, message):
+        # The extension's real callbacks are registered when it's 
+        # instantiated, but too late to be called for the message currently 
+        # being dispatched.  So call any that match this message by hand.
+
+        extension = self._instantiate_extension(actor)
+
+        for callback_info in extension._callbacks[event]:
+            if isinstance(message, callback_info.message_cls):
+                callback_info.callback(message)
 
     def _remove_from_world(self):
         """
@@ -391,11 +671,142 @@ class Token(ForumObserver, metaclass=TokenSafetyChecks):
         responsible for setting the internal state of the token being removed.
         """
         self.on_remove_from_world()
+        for extension in self._extensions.values():
+            extension._detach_from_index()
         self._extensions = {}
+        self._drop_pending_extensions()
+        self._watchers = {}
+        self._detach_from_index()
         self._disable_forum_observation()
         self._world = None
         self._id = None
 
+    def _get_checkpoint(self):
+        """
+        Return the state needed to restore this token to its current state 
+        with `_restore_checkpoint`.  This is the same state that's pickled 
+        when the token is sent over the network, so it doesn't include any of 
+        the internal data the token needs while it's part of the world.
+        """
+        return self.__getstate__()
+
+    def _restore_checkpoint(self, state):
+        """
+        Restore the state saved by `_get_checkpoint`.  This is used by 
+        `ClientForum` to roll back messages that were rejected by the server 
+        (see the *predict_messages* argument).
+        """
+        for key in self._get_checkpoint().keys() - state.keys():
+            delattr(self, key)
+
+        self.__dict__.update(state)
+
+class TokenScheduler:
+    """
+    Decide which tokens are due for a periodic hook (e.g. 
+    `Token.on_update_game`) on each frame.
+
+    Tokens are only scheduled if their class overrides the hook or something 
+    is watching it, so no time is spent calling no-op methods.  Each token is 
+    called every N frames, where N is read from the given interval attribute 
+    of the token.  Tokens are bucketed first by interval and then by phase 
+    (i.e. which frame of the interval they're called on), so that each frame 
+    only visits the tokens that are due.  Tokens that share an interval are 
+    staggered by id, so that they don't all get called on the same frame.
+    """
+
+    def __init__(self, method_name, interval_name):
+        self.method_name = method_name
+        self.interval_name = interval_name
+        self.num_frames = 0
+        self.elapsed_time = 0
+        self.buckets = {}
+        self.scheduled_tokens = {}
+        self.last_times = {}
+
+    def __contains__(self, token_or_id):
+        id = token_or_id.id if isinstance(token_or_id, Token) else token_or_id
+        return id in self.scheduled_tokens
+
+    def schedule(self, token):
+        # Tokens whose hook is being watched (see watch_token) still have to 
+        # be called, even if the hook itself doesn't do anything.
+
+        if not is_overridden(type(token), self.method_name) and \
+                self.method_name not in token._watchers:
+            return
+
+        if token.id in self.scheduled_tokens:
+            return
+
+        self.require_valid_interval(token)
+        interval = getattr(token, self.interval_name)
+
+        try:
+            buckets = self.buckets[interval]
+        except KeyError:
+            buckets = self.buckets[interval] = [{} for i in range(interval)]
+
+        bucket = buckets[token.id % interval]
+        bucket[token.id] = token
+        self.scheduled_tokens[token.id] = bucket
+
+        if interval > 1:
+            self.last_times[token.id] = self.elapsed_time
+
+    def require_valid_interval(self, token):
+        """
+        Complain if the given token doesn't have a valid interval.  The world 
+        calls this before adding any tokens, so that a bad interval doesn't 
+        leave tokens half-added.  The interval is checked even if the token 
+        doesn't need to be scheduled yet, because something may start 
+        watching the hook later on.
+        """
+        interval = getattr(token, self.interval_name)
+
+        if not isinstance(interval, int) or interval < 1:
+            interval_name = self.interval_name
+            method_name = self.method_name
+            raise ApiUsageError("""\
+                    {token.__class__.__name__}.{interval_name} must be a 
+                    positive integer, not {interval!r}.
+
+                    The {interval_name} is the number of frames between calls 
+                    to {method_name}().  Use 1 to call it every frame.""")
+
+    def unschedule(self, id):
+        bucket = self.scheduled_tokens.pop(id, None)
+        if bucket is not None:
+            del bucket[id]
+            self.last_times.pop(id, None)
+
+    def advance(self, dt=0):
+        """
+        Move on to the next frame and iterate over the tokens that are due on 
+        that frame, along with the time elapsed since each was last due.
+        """
+        frame = self.num_frames
+        self.num_frames += 1
+        self.elapsed_time += dt
+
+        for interval, buckets in list(self.buckets.items()):
+            bucket = buckets[frame % interval]
+
+            # Make a copy of the bucket, because tokens may be scheduled or 
+            # unscheduled while the tokens already due are being called.
+
+            for id, token in list(bucket.items()):
+                if bucket.get(id) is not token:
+                    continue
+
+                if interval == 1:
+                    yield token, dt
+                else:
+                    token_dt = self.elapsed_time - self.last_times[id]
+                    self.last_times[id] = self.elapsed_time
+                    yield token, token_dt
+
+
 class World(Token):
     """
     Manage all of the tokens participating in the game.
@@ -405,9 +816,38 @@ class World(Token):
         super().__init__()
         self._id = 0
         self._tokens = {}
+        self._tokens_by_type = {}
+        self._deferred_watchers = {}
+        self._token_slots = []
+        self._token_slot_indices = {}
+        self._num_empty_token_slots = 0
+        self._num_active_iterators = 0
         self._actors = []
         self._is_locked = True
         self._has_game_ended = False
+
+        # Keep track of which tokens need to be updated (or need to report to 
+        # the referee) on which frames, so that each frame only visits the 
+        # tokens that are due.
+
+        self._update_scheduler = TokenScheduler(
+                'on_update_game', 'update_interval')
+        self._report_scheduler = TokenScheduler(
+                'on_report_to_referee', 'report_interval')
+        self._sleeping_token_ids = set()
+
+        # Count the tokens that have ever been removed, so that anything 
+        # holding on to tokens from an earlier point in the frame can tell if 
+        # they might be stale (see PacketBatcher.prefetch()).
+
+        self._num_tokens_removed = 0
+
+        # The world and every token in it share a single subscription index, 
+        # so that the forum can dispatch each message to only the tokens that 
+        # are subscribed to it.
+
+        self._token_subscriptions = SubscriptionIndex()
+
         with self._unlock_temporarily():
             self._add_token(self)
 
@@ -415,11 +855,25 @@ class World(Token):
         return '{}()'.format(self.__class__.__name__)
 
     def __iter__(self):
-        # Make a copy of self._tokens.values() because it's possible for tokens 
-        # to be added or removed from the world while the world is being 
-        # iterated through.  Concretely, this can happen when a token extension 
-        # sends a message to add or remove a token during on_update_game().
-        return (x for x in list(self._tokens.values()) if x is not self)
+        # It's possible for tokens to be added or removed from the world while 
+        # the world is being iterated through.  Concretely, this can happen 
+        # when a token extension sends a message to add or remove a token 
+        # during on_update_game().  Rather than copying every token each time 
+        # the world is iterated, the tokens are kept in a list of slots that 
+        # only ever grows while an iteration is in progress: new tokens are 
+        # appended (and not visited until the next iteration) and removed 
+        # tokens leave an empty slot behind (and are skipped).  The empty 
+        # slots are compacted away once no iterations are in progress.
+        self._num_active_iterators += 1
+        try:
+            slots = self._token_slots
+            for i in range(len(slots)):
+                token = slots[i]
+                if token is not None and token is not self:
+                    yield token
+        finally:
+            self._num_active_iterators -= 1
+            self._compact_token_slots()
 
     def __len__(self):
         return len(self._tokens)
@@ -443,6 +897,16 @@ pickled.""")
         raise AssertionError("""\
                 World.__getstate__ should've refused to pickle the world.""")
 
+    def _get_checkpoint(self):
+        # All of the state the world needs to manage its tokens is private, 
+        # and it's restored by adding and removing the tokens themselves.  So 
+        # only the public attributes (i.e. those added by subclasses to 
+        # describe the game) need to be saved.
+        return {
+                k: v for k, v in self.__dict__.items()
+                if not k.startswith('_')
+        }
+
     @read_only
     def get_token(self, id):
         """
@@ -463,6 +927,20 @@ pickled.""")
         """
         return max(self._tokens)
 
+    @read_only
+    def tokens_of_type(self, cls):
+        """
+        Iterate over every token in the world that is an instance of the given 
+        class.
+
+        The world keeps an index of its tokens by class (including every base 
+        class), so this takes time proportional to the number of matching 
+        tokens rather than the total number of tokens.  Like iterating over the 
+        world itself, the world is not included in the results.
+        """
+        tokens = self._tokens_by_type.get(cls, {})
+        return iter(list(tokens.values()))
+
     @read_only
     def is_locked(self):
         """
@@ -483,9 +961,39 @@ pickled.""")
     def on_start_game(self):
         pass
 
+    def sleep_token(self, token):
+        """
+        Stop calling `Token.on_update_game` for the given token until 
+        `wake_token` is called.
+        """
+        require_active_token(token)
+
+        if token.id not in self._sleeping_token_ids:
+            self._update_scheduler.unschedule(token.id)
+            self._sleeping_token_ids.add(token.id)
+
+    def wake_token(self, token):
+        """
+        Resume calling `Token.on_update_game` for a token that was put to sleep 
+        by `sleep_token`.  The time the token spent asleep won't be included in 
+        the time passed to its next update.
+        """
+        require_active_token(token)
+
+        if token.id in self._sleeping_token_ids:
+            self._sleeping_token_ids.remove(token.id)
+            self._update_scheduler.schedule(token)
+
+    @read_only
+    def is_token_sleeping(self, token):
+        return token.id in self._sleeping_token_ids
+
     def on_update_game(self, dt):
-        for token in self:
-            token.on_update_game(dt)
+        # Only tokens that override on_update_game(), aren't sleeping, and are 
+        # due to be updated on this frame are visited.
+
+        for token, token_dt in self._update_scheduler.advance(dt):
+            token.on_update_game(token_dt)
 
     def on_finish_game(self):
         pass
@@ -502,8 +1010,8 @@ pickled.""")
         only briefly unlocks it (using this method) when tokens are allowed to 
         make changes.  When the world is locked, token methods that aren't 
         marked as being read-only can't be called.  When the world is unlocked, 
-        any token method can be called.  These checks can be disabled by 
-        running python with optimization enabled.
+        any token method can be called.  These checks can be disabled using 
+        `TokenSafetyChecks.set_policy`.
 
         You should never call this method manually from within your own game.  
         This method is intended to be used by the game engine, which was 
@@ -520,23 +1028,71 @@ pickled.""")
                 self._is_locked = True
 
     def _add_token(self, token):
-        require_token(token)
-        assert token.has_id, msg("""\
-                token {token} should've been assigned an id by 
-                Message._assign_token_ids() before World._add_token() was 
-                called.""")
-        assert token not in self, msg("""\
-                Message._assign_token_ids() should've refused to process a 
-                token that was already in the world.""")
-
-        info('adding token to world: {token}')
-
-        # Add the token to the world.
+        self._add_tokens([token])
+        return token
 
-        self._tokens[token.id] = token
-        token._add_to_world(self, self._actors)
+    def _add_tokens(self, tokens):
+        """
+        Add any number of tokens to the world at once.
+
+        Messages that create lots of tokens (e.g. while loading a level) add 
+        them all through this method, so the bookkeeping that only needs to 
+        happen once per batch (e.g. logging) isn't repeated for every token.  
+        Every token is registered with the world before any of them are told 
+        that they've been added, so tokens that are added together can refer 
+        to each other in `Token.on_add_to_world`.
+        """
+        tokens = list(tokens)
+
+        for token in tokens:
+            require_token(token)
+            assert token.has_id, msg("""\
+                    token {token} should've been assigned an id by 
+                    Message._assign_token_ids() before World._add_tokens() was 
+                    called.""")
+            assert token not in self, msg("""\
+                    Message._assign_token_ids() should've refused to process a 
+                    token that was already in the world.""")
+
+            # Check the intervals before changing anything, so that a bad 
+            # interval doesn't leave any of the tokens half-added.
+
+            if token is not self:
+                self._update_scheduler.require_valid_interval(token)
+                self._report_scheduler.require_valid_interval(token)
+
+        if len(tokens) == 1:
+            info('adding token to world: {tokens[0]}')
+        elif tokens:
+            num_tokens = len(tokens)
+            info('adding {num_tokens} tokens to world')
+
+        # Add the tokens to the world.
+
+        for token in tokens:
+            self._tokens[token.id] = token
+            self._token_slot_indices[token.id] = len(self._token_slots)
+            self._token_slots.append(token)
+            self._index_token(token)
+
+            if token is not self:
+                self._update_scheduler.schedule(token)
+                self._report_scheduler.schedule(token)
+
+        for token in tokens:
+            token._add_to_world(self, self._actors)
+
+    def _schedule_watched_token(self, token, method_name):
+        """
+        Start calling the given hook for the given token, if it wasn't being 
+        called already because the token doesn't override it.
+        """
+        if method_name == self._update_scheduler.method_name:
+            if token.id not in self._sleeping_token_ids:
+                self._update_scheduler.schedule(token)
 
-        return token
+        if method_name == self._report_scheduler.method_name:
+            self._report_scheduler.schedule(token)
 
     def _remove_token(self, token):
         require_active_token(token)
@@ -544,10 +1100,90 @@ pickled.""")
 
         id = token.id
         token._remove_from_world()
+        self._unindex_token(token, id)
+        self._update_scheduler.unschedule(id)
+        self._report_scheduler.unschedule(id)
+        self._sleeping_token_ids.discard(id)
+        self._num_tokens_removed += 1
         del self._tokens[id]
 
-    def _get_nested_observers(self):
-        return iter(self)
+        # Leave an empty slot behind rather than deleting it, in case the 
+        # world is being iterated through right now.
+
+        slot = self._token_slot_indices.pop(id)
+        self._token_slots[slot] = None
+        self._num_empty_token_slots += 1
+        self._compact_token_slots()
+
+    def _index_token(self, token):
+        """
+        Record the given token under its class and each of its base classes, 
+        so that `tokens_of_type` doesn't have to search the whole world.
+        """
+        if token is self:
+            return
+
+        for cls in type(token).__mro__:
+            self._tokens_by_type.setdefault(cls, {})[token.id] = token
+
+    def _unindex_token(self, token, id):
+        if token is self:
+            return
+
+        for cls in type(token).__mro__:
+            tokens = self._tokens_by_type[cls]
+            del tokens[id]
+            if not tokens:
+                del self._tokens_by_type[cls]
+
+    def _defer_watcher(self, token, callback, args, kwargs):
+        """
+        Remember to call the given batched watcher at the end of the frame.  
+        If the watcher is deferred more than once in the same frame, only the 
+        arguments from the last time are kept.
+        """
+        self._deferred_watchers.pop(callback, None)
+        self._deferred_watchers[callback] = token, args, kwargs
+
+    def _call_deferred_watchers(self):
+        """
+        Call every batched watcher that was deferred this frame, skipping those 
+        belonging to tokens that have since been removed from the world.
+        """
+        deferred_watchers = self._deferred_watchers
+        self._deferred_watchers = {}
+
+        for callback, (token, args, kwargs) in deferred_watchers.items():
+            if token._world is self:
+                callback(*args, **kwargs)
+
+    def _get_tokens_to_report(self):
+        """
+        Iterate over the tokens that override `Token.on_report_to_referee` and 
+        are due to report on this frame.  This should be called once per frame 
+        by the referee.
+        """
+        for token, _ in self._report_scheduler.advance():
+            yield token
+
+    def _compact_token_slots(self):
+        """
+        Remove the empty slots left behind by tokens that have been removed 
+        from the world.
+
+        This is only safe when the world isn't being iterated through, and is 
+        only worth doing once a significant fraction of the slots are empty, 
+        so that the cost of compacting is amortized over many removals.
+        """
+        if self._num_active_iterators:
+            return
+        if self._num_empty_token_slots * 2 < len(self._token_slots):
+            return
+
+        self._token_slots = [x for x in self._token_slots if x is not None]
+        self._token_slot_indices = {
+                x.id: i for i, x in enumerate(self._token_slots)}
+        self._num_empty_token_slots = 0
 
     def _set_actors(self, actors):
         """
@@ -562,7 +1198,59 @@ def require_token(object):
     Raise an `ApiUsageError` if the given object is not a fully constructed 
     instance of a `Token` subclass.
     """
-    require_instance(Token(), object)
+    require_instance(Token, object)
+
+def is_overridden(token_cls, method_name):
+    """
+    Return true if the given token class overrides the `Token` method with the 
+    given name.
+
+    The engine uses this to avoid calling no-op hooks (e.g. 
+    `Token.on_update_game`) on every token every frame.
+    """
+    for cls in token_cls.__mro__:
+        if cls is Token:
+            return False
+
+        # Ignore the dispatchers installed on subclasses to watch methods 
+        # inherited from Token, because they don't change what the method does.
+
+        member = cls.__dict__.get(method_name)
+        if member is not None and not getattr(member, '_kxg_is_inherited', False):
+            return True
+
+    return False
+
+def require_extension_class(extension_class):
+    """
+    Raise an `ApiUsageError` if the constructor of the given token extension 
+    class doesn't take the arguments that tokens provide.
+
+    An error would be raised anyway as soon as we try to instantiate the 
+    extension, but that error would be hard to understand because it wouldn't 
+    contain the name of the offending extension and would come from pretty 
+    deep in the game engine.  The constructor's signature is only inspected 
+    once per class.
+    """
+    if extension_class in _valid_extension_classes:
+        return
+
+    from inspect import getfullargspec
+    argspec = getfullargspec(extension_class.__init__)
+    if len(argspec.args) != 3:
+        raise ApiUsageError("""\
+                the {extension_class.__name__} constructor doesn't take the 
+                right arguments.
+
+                Token extension constructors must take exactly three 
+                arguments: self, actor, and token.  These are the arguments 
+                provided by tokens when they automatically instantiate their 
+                extensions.  Fix this error by making the {extension_class} 
+                constructor compatible with these arguments.""")
+
+    _valid_extension_classes.add(extension_class)
+
+_valid_extension_classes = WeakSet()
 
 @debug_only
 def require_active_token(object):
@@ -598,5 +1286,5 @@ def require_world(object):
     Raise an `ApiUsageError` if the given object is not a fully constructed 
     `World` instance.
     """
-    return require_instance(World(), object)
+    return require_instance(World, object)
 
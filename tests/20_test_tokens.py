@@ -52,6 +52,12 @@ def test_token_type_checking():
     with raises_api_usage_error("expected Token, but got NonTokenClass"):
         kxg.require_token(non_token)
 
+    # Make sure the attributes expected of each token are only found once.
+
+    schema = kxg.errors.get_instance_schema(kxg.Token)
+    assert schema is kxg.errors.get_instance_schema(kxg.Token)
+    assert '_id' in schema[1]
+
 def test_token_safety_checking():
     from inspect import signature
 
@@ -122,6 +128,59 @@ def test_token_safety_checking():
         force_remove_token(world, token)
         assert_safety_checks_off(token)
 
+def test_token_safety_policies():
+    world = DummyWorld()
+    token = DummyToken()
+    force_add_token(world, token)
+
+    checks = kxg.TokenSafetyChecks
+    unsafe_method = DummyToken.unsafe_method
+
+    try:
+        # Turning the checks off should restore the original method.
+
+        checks.set_policy(checks.OFF)
+        token.unsafe_method(1)
+        assert DummyToken.unsafe_method is \
+                DummyToken._kxg_unchecked_methods['unsafe_method']
+
+        # Sampled checks should only catch one out of every few calls.
+
+        checks.set_policy(checks.SAMPLED, sample_interval=3)
+        num_errors = 0
+        for i in range(9):
+            try:
+                token.unsafe_method(i)
+            except kxg.ApiUsageError:
+                num_errors += 1
+        assert num_errors == 3
+
+        # Per-class policies should override the global policy, and should be 
+        # inherited by subclasses.
+
+        checks.set_policy(checks.FULL)
+        checks.set_policy(checks.OFF, DummySuperToken)
+        token.unsafe_method(1)
+        token.unsafe_super_method(2)
+
+        checks.set_policy(checks.FULL, DummyToken)
+        token.unsafe_super_method(3)
+        with raises_api_usage_error("unsafe invocation"):
+            token.unsafe_method(4)
+
+        checks.set_policy(None, DummyToken)
+        checks.set_policy(None, DummySuperToken)
+        with raises_api_usage_error("unsafe invocation"):
+            token.unsafe_super_method(5)
+
+        with raises_api_usage_error("unknown safety check policy"):
+            checks.set_policy('sometimes')
+
+    finally:
+        checks.set_policy(checks.FULL, sample_interval=100)
+
+    assert DummyToken.unsafe_method.__name__ == unsafe_method.__name__
+
 def test_token_extensions():
     actor = DummyActor()
     world = DummyWorld(); world._set_actors([actor])
@@ -216,6 +275,367 @@ def test_token_extensions():
     assert extension_1.method_1_calls == [((1,),{'a':2}), ((5,6),{})]
     assert extension_1.method_2_calls == [((3,),{'b':4}), ((7,8),{})]
 
+def test_extension_classes_can_be_collected():
+    import gc, weakref
+
+    # Extension classes that have already been checked are remembered, but 
+    # that shouldn't keep classes created on the fly (e.g. in tests) alive.
+
+    class TemporaryExtension (DummyExtension):
+        pass
+
+    kxg.tokens.require_extension_class(TemporaryExtension)
+    assert TemporaryExtension in kxg.tokens._valid_extension_classes
+
+    ref = weakref.ref(TemporaryExtension)
+    del TemporaryExtension
+    gc.collect()
+
+    assert ref() is None
+
+def test_tokens_of_type():
+    world = DummyWorld()
+
+    class OtherToken (DummySuperToken):
+        pass
+
+    super_token = DummySuperToken(); force_add_token(world, super_token)
+    token_1 = DummyToken(); force_add_token(world, token_1)
+    token_2 = DummyToken(); force_add_token(world, token_2)
+    other_token = OtherToken(); force_add_token(world, other_token)
+
+    assert list(world.tokens_of_type(DummyToken)) == [token_1, token_2]
+    assert list(world.tokens_of_type(OtherToken)) == [other_token]
+    assert list(world.tokens_of_type(DummySuperToken)) == \
+            [super_token, token_1, token_2, other_token]
+    assert list(world.tokens_of_type(kxg.Token)) == list(world)
+    assert list(world.tokens_of_type(DummyWorld)) == []
+
+    force_remove_token(world, token_1)
+
+    assert list(world.tokens_of_type(DummyToken)) == [token_2]
+    assert list(world.tokens_of_type(DummySuperToken)) == \
+            [super_token, token_2, other_token]
+
+    force_remove_token(world, other_token)
+
+    assert list(world.tokens_of_type(OtherToken)) == []
+
+def test_world_iteration():
+    world = DummyWorld()
+    tokens = [DummyToken() for i in range(4)]
+
+    for token in tokens:
+        force_add_token(world, token)
+
+    assert list(world) == tokens
+
+    # Tokens added while the world is being iterated through shouldn't be 
+    # visited until the next iteration, and tokens removed while the world is 
+    # being iterated through shouldn't be visited at all.
+
+    new_token = DummyToken()
+    visited = []
+
+    for token in world:
+        visited.append(token)
+        if token is tokens[0]:
+            force_add_token(world, new_token)
+            force_remove_token(world, tokens[2])
+
+    assert visited == [tokens[0], tokens[1], tokens[3]]
+    assert list(world) == [tokens[0], tokens[1], tokens[3], new_token]
+
+    # Make sure the slots left behind by removed tokens are eventually 
+    # reclaimed, once the world isn't being iterated through.
+
+    for token in [tokens[0], tokens[1], tokens[3]]:
+        force_remove_token(world, token)
+
+    assert list(world) == [new_token]
+    assert len(world._token_slots) < 6
+
+def test_watching_token_methods():
+    actor = DummyActor()
+    world = DummyWorld(); world._set_actors([actor])
+
+    class WatchedToken (DummyToken):
+
+        def __extend__(self):
+            return {DummyActor: WatchingExtension}
+
+        def move(self, x):
+            return x
+
+    class WatchedSubToken (WatchedToken):
+
+        def move(self, x):
+            return super().move(x) + 1
+
+    class WatchingExtension (DummyExtension):
+
+        def __init__(self, actor, token):
+            super().__init__(actor, token)
+            self.moves = []
+            self.batched_moves = []
+
+        @kxg.watch_token
+        def move(self, x):
+            self.moves.append(x)
+
+        @kxg.watch_token(batch=True)
+        def unsafe_method(self, x):
+            self.batched_moves.append(x)
+
+    token = WatchedToken(); force_add_token(world, token)
+    sub_token = WatchedSubToken(); force_add_token(world, sub_token)
+    extension = token.get_extension(actor)
+    sub_extension = sub_token.get_extension(actor)
+
+    # Watchers are called through a dispatcher shared by the whole class, not 
+    # through a wrapper stored on each token.
+
+    assert 'move' not in token.__dict__
+    assert 'move' in WatchedToken.__dict__
+
+    # Methods that call super() should only notify their watchers once, and 
+    # return values should be passed through.
+
+    with world._unlock_temporarily():
+        assert token.move(1) == 1
+        assert sub_token.move(2) == 3
+
+    assert extension.moves == [1]
+    assert sub_extension.moves == [2]
+
+    # Batched watchers should only be called once per frame, with the last 
+    # arguments.
+
+    with world._unlock_temporarily():
+        token.unsafe_method(1)
+        token.unsafe_method(2)
+
+    assert extension.batched_moves == []
+    world._call_deferred_watchers()
+    assert extension.batched_moves == [2]
+    world._call_deferred_watchers()
+    assert extension.batched_moves == [2]
+
+    # Changing the safety check policy shouldn't remove the dispatchers.
+
+    checks = kxg.TokenSafetyChecks
+    try:
+        checks.set_policy(checks.OFF)
+        token.move(3)
+        sub_token.move(4)
+        token.unsafe_method(5)
+    finally:
+        checks.set_policy(checks.FULL)
+
+    assert extension.moves == [1, 3]
+    assert sub_extension.moves == [2, 4]
+    world._call_deferred_watchers()
+    assert extension.batched_moves == [2, 5]
+
+    with raises_api_usage_error("unsafe invocation"):
+        token.move(6)
+
+    # Removed tokens should forget their watchers.
+
+    force_remove_token(world, token)
+    token.move(7)
+    token.unsafe_method(8)
+    world._call_deferred_watchers()
+
+    assert extension.moves == [1, 3]
+    assert extension.batched_moves == [2, 5]
+
+def test_lazy_token_extensions():
+    actor = DummyActor()
+    world = DummyWorld(); world._set_actors([actor])
+
+    @kxg.lazy_extension
+    class LazyExtension (DummyExtension):
+        num_instances = 0
+
+        def __init__(self, actor, token):
+            super().__init__(actor, token)
+            LazyExtension.num_instances += 1
+
+    class LazyToken (DummyToken):
+
+        def __extend__(self):
+            return {DummyActor: LazyExtension}
+
+    # Extensions shouldn't be instantiated until they're asked for...
+
+    token_1 = LazyToken(); force_add_token(world, token_1)
+    assert LazyExtension.num_instances == 0
+    assert token_1.has_extension(actor)
+
+    extension_1 = token_1.get_extension(actor)
+    assert LazyExtension.num_instances == 1
+    assert token_1.get_extension(actor) is extension_1
+    assert token_1.get_extensions() == [extension_1]
+
+    # ...or until they have a message to handle.
+
+    token_2 = LazyToken(); force_add_token(world, token_2)
+    assert LazyExtension.num_instances == 1
+
+    message_1 = DummyMessage()
+    actor._react_to_message(message_1)
+    extension_2 = token_2.get_extension(actor)
+
+    assert LazyExtension.num_instances == 2
+    assert extension_1.dummy_messages_received == [message_1]
+    assert extension_2.dummy_messages_received == [message_1]
+
+    message_2 = DummyMessage()
+    actor._react_to_message(message_2)
+
+    assert extension_2.dummy_messages_received == [message_1, message_2]
+
+    # Extensions that are never needed should never be instantiated.
+
+    token_3 = LazyToken(); force_add_token(world, token_3)
+    force_remove_token(world, token_3)
+    actor._react_to_message(DummyMessage())
+
+    assert LazyExtension.num_instances == 2
+
+def test_token_update_scheduling():
+    world = DummyWorld()
+
+    class UpdatingToken (DummyToken):
+
+        def __init__(self):
+            super().__init__()
+            self.updates = []
+
+        def on_update_game(self, dt):
+            self.updates.append(dt)
+
+    class SlowUpdatingToken (UpdatingToken):
+        update_interval = 3
+
+    class BadIntervalToken (UpdatingToken):
+        update_interval = 0
+
+    idle_token = DummyToken(); force_add_token(world, idle_token)
+    token = UpdatingToken(); force_add_token(world, token)
+    slow_token = SlowUpdatingToken(); force_add_token(world, slow_token)
+
+    # Tokens that don't override on_update_game() shouldn't be scheduled.
+
+    assert idle_token not in world._update_scheduler
+    assert token in world._update_scheduler
+
+    def update(num_frames):
+        with world._unlock_temporarily():
+            for i in range(num_frames):
+                world.on_update_game(1)
+
+    # Slow tokens should be updated every few frames, and should be given the 
+    # time elapsed since their last update.
+
+    update(6)
+    assert token.updates == [1] * 6
+    assert len(slow_token.updates) == 2
+    assert sum(slow_token.updates) <= 6
+    assert slow_token.updates[-1] == 3
+
+    # Sleeping tokens shouldn't be updated until they're woken up.
+
+    with world._unlock_temporarily():
+        world.sleep_token(token)
+        world.sleep_token(slow_token)
+
+    assert world.is_token_sleeping(token)
+    update(6)
+    assert token.updates == [1] * 6
+    assert len(slow_token.updates) == 2
+
+    with world._unlock_temporarily():
+        world.wake_token(token)
+        world.wake_token(slow_token)
+
+    assert not world.is_token_sleeping(token)
+    update(3)
+    assert token.updates == [1] * 9
+    assert len(slow_token.updates) == 3
+    assert slow_token.updates[-1] <= 3
+
+    # Removed tokens shouldn't be updated.
+
+    force_remove_token(world, token)
+    update(1)
+    assert token.updates == [1] * 9
+
+    with raises_api_usage_error("update_interval must be a positive integer"):
+        force_add_token(world, BadIntervalToken(), 100)
+
+    # A bad interval shouldn't leave any of the tokens in a batch half-added.
+
+    good_token = UpdatingToken(); good_token._id = 101
+    bad_token = BadIntervalToken(); bad_token._id = 102
+    num_tokens = len(world)
+
+    with raises_api_usage_error("update_interval must be a positive integer"):
+        with world._unlock_temporarily():
+            world._add_tokens([good_token, bad_token])
+
+    assert len(world) == num_tokens
+    assert good_token not in world
+    assert good_token not in world._update_scheduler
+    assert not good_token.has_world
+
+def test_watched_update_scheduling():
+    actor = DummyActor()
+    world = DummyWorld(); world._set_actors([actor])
+
+    class WatchedIdleToken (DummyToken):
+
+        def __extend__(self):
+            return {DummyActor: UpdateWatchingExtension}
+
+    class UpdateWatchingExtension (DummyExtension):
+
+        def __init__(self, actor, token):
+            super().__init__(actor, token)
+            self.updates = []
+
+        @kxg.watch_token
+        def on_update_game(self, dt):
+            self.updates.append(dt)
+
+    # Tokens that don't override on_update_game() should still be scheduled 
+    # if something is watching that method.
+
+    token = WatchedIdleToken(); force_add_token(world, token)
+    extension = token.get_extension(actor)
+    assert token in world._update_scheduler
+
+    with world._unlock_temporarily():
+        for i in range(3):
+            world.on_update_game(1)
+
+    assert extension.updates == [1] * 3
+
+    # The same goes for watchers added after the token joins the world.
+
+    idle_token = DummyToken(); force_add_token(world, idle_token)
+    assert idle_token not in world._update_scheduler
+
+    updates = []
+    idle_token.watch_method('on_update_game', updates.append)
+    assert idle_token in world._update_scheduler
+
+    with world._unlock_temporarily():
+        world.on_update_game(1)
+
+    assert updates == [1]
+
 def test_cant_pickle_world():
     import pickle
     world = DummyWorld()
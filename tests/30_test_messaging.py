@@ -86,6 +86,18 @@ class AddDummyToken (kxg.Message):
         pass
 
 
+class AddDummyTokens (kxg.Message):
+
+    def __init__(self, tokens):
+        self.tokens = tokens
+
+    def tokens_to_add(self):
+        yield from self.tokens
+
+    def on_check(self, world):
+        pass
+
+
 class AddDummyTokenAndSync (TriggerResponse, AddDummyToken):
     
     def on_prepare_sync(self, world, memento):
@@ -156,6 +168,156 @@ class ListeningToken (kxg.Token):
         self.messages.append(message)
 
 
+class NeighborToken (DummyToken):
+
+    def on_add_to_world(self, world):
+        self.neighbors_in_world = all(x in world for x in self.neighbors)
+
+
+class CountingReporterToken (DummyToken):
+    report_interval = 2
+
+    def __init__(self):
+        super().__init__()
+        self.num_reports = 0
+
+    @kxg.read_only
+    def on_report_to_referee(self, reporter):
+        self.num_reports += 1
+
+
+class CountingPickleMessage (DummyAcceptedMessage):
+    num_pickles = 0
+
+    def __getstate__(self):
+        CountingPickleMessage.num_pickles += 1
+        return super().__getstate__()
+
+
+class CheckedValueMessage (DummyAcceptedMessage):
+
+    def on_check(self, world):
+        self.checked_value = 42
+
+
+class UnpicklableMessage (DummyAcceptedMessage):
+
+    def __setstate__(self, state):
+        raise ValueError("can't unpickle this message")
+
+
+class ThreadRecordingMessage (DummyAcceptedMessage):
+
+    def __setstate__(self, state):
+        import threading
+        self.__dict__.update(state)
+        self.unpacked_by = threading.current_thread().name
+
+
+class DeclaredTokensMessage (kxg.Message):
+    token = kxg.TokenField()
+    tokens = kxg.TokenField(many=True)
+    new_tokens = kxg.TokenField(many=True, add=True)
+
+    def on_check(self, world):
+        pass
+
+    def on_execute(self, world):
+        world.dummy_messages_executed.append(self)
+
+
+class CompactMessage (kxg.Message):
+    wire_id = 1
+    x = kxg.ValueField('i')
+    y = kxg.ValueField('d', 0.5)
+    token = kxg.TokenField()
+    tokens = kxg.TokenField(many=True)
+
+    def on_check(self, world):
+        pass
+
+    def on_execute(self, world):
+        world.dummy_messages_executed.append(self)
+
+
+class CountingCompactSerializer (kxg.CompactMessageSerializer):
+    num_packs = 0
+
+    def pack_message(self, message):
+        CountingCompactSerializer.num_packs += 1
+        return super().pack_message(message)
+
+
+class MergeableMessage (DummyAcceptedMessage):
+
+    def __init__(self, key):
+        super().__init__()
+        self.key = key
+
+    def merge_key(self):
+        return self.key
+
+
+class SummingMessage (MergeableMessage):
+
+    def __init__(self, key, value):
+        super().__init__(key)
+        self.value = value
+
+    def merge(self, later_message):
+        if self.value + later_message.value > 10:
+            return None
+        return SummingMessage(self.key, self.value + later_message.value)
+
+
+class MergeableUndoResponse (TriggerResponse, DummyMessage):
+
+    def merge_key(self):
+        return 'undo'
+
+    def on_undo(self, world):
+        world.dummy_undo_responses_executed.append(self)
+
+
+class PredictedToken (DummyToken):
+
+    def __init__(self):
+        super().__init__()
+        self.x = 0
+
+
+class ExtendedPredictedToken (PredictedToken):
+
+    def __extend__(self):
+        return {DummyActor: DummyExtension}
+
+
+class ShiftPredictedToken (DummyMessage):
+
+    def __init__(self, token, dx, new_token=None):
+        super().__init__()
+        self.token = token
+        self.dx = dx
+        self.new_token = new_token
+
+    def tokens_to_add(self):
+        if self.new_token:
+            yield self.new_token
+
+    def on_check(self, world):
+        pass
+
+    def on_execute(self, world):
+        super().on_execute(world)
+        self.token.x += self.dx
+
+
+class RejectedShiftPredictedToken (TriggerResponse, ShiftPredictedToken):
+
+    def on_undo(self, world):
+        raise AssertionError
+
+
 class StaleReporterToken (kxg.Token):
 
     def __init__(self):
@@ -230,6 +392,10 @@ def test_id_factory():
     assert 4 not in id
     assert 5 in id
 
+    assert id.reserve(3) == range(11, 18, 3)
+    assert id.reserve(0) == range(20, 20, 3)
+    assert id.next() == 20
+
 def test_messaging_reprs():
     message = kxg.Message(); message._set_server_response_id(1)
     assert kxg.ServerResponse(message).__repr__() == 'ServerResponse(sync_needed=False, undo_needed=False)'
@@ -374,6 +540,214 @@ def test_message_serialization():
     force_add_token(world, p.t5)
     p.t5.subscribe_to_message(DummyMessage, lambda x: None)
 
+def test_message_packing():
+    world = DummyWorld()
+    t1 = DummyToken(); t1._id = 1
+    t2 = DummyToken(); t2.t1 = t1
+    force_add_token(world, t2, 2)
+
+    serializer = kxg.MessageSerializer(world)
+
+    # Find every referenced token and cache the packet in the same pass.
+    m = DummyMessage()
+    m.t1 = t1
+    m.t2 = t2
+    m.add = [t1]
+    m._set_server_response_id(1)
+    assert m._get_packet() is None
+    assert m._pack({t1}) == {t1, t2}
+
+    packet = m._get_packet()
+    assert packet is not None
+    assert serializer.pack(m) is packet
+
+    # The cached packet shouldn't be pickled along with the message.
+    p = serializer.unpack(packet)
+    assert p.t1.id == t1.id
+    assert p.t2 is t2
+    assert '_packets' not in p.__getstate__()
+
+    # Received messages remember the packet they arrived in.
+    assert p._get_packet() is packet
+
+    # Changes that need to be sent with the message discard the packet.
+    m._set_server_response(kxg.ServerResponse(p))
+    assert m._get_packet() is None
+    assert serializer.pack(m) is not packet
+
+def test_declared_message_tokens():
+    world = DummyWorld()
+    t1 = DummyToken(); t1._id = 1
+    t2 = DummyToken(); t2.t1 = t1
+    t3 = DummyToken()
+    force_add_token(world, t2, 2)
+    force_add_token(world, t3, 3)
+
+    serializer = kxg.MessageSerializer(world)
+
+    assert DeclaredTokensMessage.declares_tokens
+    assert not DummyMessage.declares_tokens
+    assert [x.name for x in DeclaredTokensMessage._token_fields] == \
+            ['token', 'tokens', 'new_tokens']
+
+    # Unset fields don't refer to any tokens.
+    m = DeclaredTokensMessage()
+    assert m.token is None
+    assert m.tokens == ()
+    assert not m.tokens_referenced()
+    assert not list(m.tokens_to_add())
+
+    # Find tokens without searching the message, and pack them by id.
+    m = DeclaredTokensMessage()
+    m.token = t2
+    m.tokens = [t2, t3]
+    assert m.tokens_referenced() == {t2, t3}
+    assert m._pack(set()) == {t2, t3}
+    assert b'DummyToken' not in m._get_packet()
+
+    p = serializer.unpack(serializer.pack(m))
+    assert p.token is t2
+    assert p.tokens == [t2, t3]
+    assert not hasattr(p, '_packed_token_ids')
+
+    # The message itself shouldn't be changed by being packed.
+    assert m.token is t2
+    assert m.tokens == [t2, t3]
+
+    # Tokens being added have to be searched, because they can contain other 
+    # tokens.  They're also yielded from tokens_to_add() automatically.
+    t4 = DummyToken(); t4._id = 4; t4.t2 = t2
+
+    m = DeclaredTokensMessage()
+    m.new_tokens = [t4]
+    assert list(m.tokens_to_add()) == [t4]
+    assert m.tokens_referenced() == {t4}
+    assert m._pack({t4}) == {t2, t4}
+
+    p = serializer.unpack(serializer.pack(m))
+    assert p.new_tokens[0].id == t4.id
+    assert p.new_tokens[0].t2 is t2
+
+    # Tokens in undeclared attributes would be pickled by value, so they're 
+    # rejected, but only when the safety checks are fully enabled.
+    m = DeclaredTokensMessage()
+    m.token = t2
+    m.undeclared = {'t3': [t3]}
+
+    with raises_api_usage_error("DeclaredTokensMessage.undeclared refers to a token"):
+        m.tokens_referenced()
+    with raises_api_usage_error("DeclaredTokensMessage.undeclared refers to a token"):
+        m._pack(set())
+
+    checks = kxg.TokenSafetyChecks
+    try:
+        checks.set_policy(checks.OFF)
+        assert m.tokens_referenced() == {t2}
+    finally:
+        checks.set_policy(checks.FULL)
+
+def test_compact_message_serialization():
+    world = DummyWorld()
+    t1 = DummyToken(); force_add_token(world, t1, 1)
+    t2 = DummyToken(); force_add_token(world, t2, 2)
+    t3 = DummyToken(); t3._id = 3
+
+    serializer = kxg.CompactMessageSerializer(world)
+    pack_unpack = lambda m: serializer.unpack(serializer.pack(m))
+
+    # Pack messages with every attribute declared without pickle.
+    m = CompactMessage()
+    m.x = 42
+    m.token = t1
+    m.tokens = {t1, t2}
+    m.sender_id = 7
+    packet = serializer.pack(m)
+    p = serializer.unpack(packet)
+
+    assert packet[0] == serializer.MESSAGE
+    assert len(packet) < 40
+    assert type(p) is CompactMessage
+    assert p.x == 42
+    assert p.y == 0.5
+    assert p.token is t1
+    assert p.tokens == {t1, t2}
+    assert p.sender_id == 7
+    assert not hasattr(p, '_server_response_id')
+
+    # Unset tokens are sent as None.
+    m = CompactMessage()
+    m.x = 1
+    p = pack_unpack(m)
+    assert p.token is None
+    assert p.tokens == ()
+
+    # Fall back on pickle for anything that can't be packed.
+    m = CompactMessage()
+    p = pack_unpack(m)
+    assert serializer.pack(m)[0] == serializer.PICKLE
+    assert p.x is None
+
+    m = CompactMessage(); m.x = 1; m.extra = 'undeclared'
+    assert serializer.pack(m)[0] == serializer.PICKLE
+    assert pack_unpack(m).extra == 'undeclared'
+
+    m = CompactMessage(); m.x = 2**40
+    assert serializer.pack(m)[0] == serializer.PICKLE
+    assert pack_unpack(m).x == 2**40
+
+    m = DummyMessage(); m.add = [t3]; m.t3 = t3
+    assert serializer.pack(m)[0] == serializer.PICKLE
+    assert pack_unpack(m).t3.id == 3
+
+    # Pack server responses.
+    m._set_server_response_id(5)
+    r = kxg.ServerResponse(m); r.sync_needed = True
+    packet = serializer.pack(r)
+    p = serializer.unpack(packet)
+    assert packet[0] == serializer.RESPONSE
+    assert (p.id, p.sync_needed, p.undo_needed) == (5, True, False)
+
+    r.memento = 'extra info'
+    assert serializer.pack(r)[0] == serializer.PICKLE
+    assert pack_unpack(r).memento == 'extra info'
+
+    # Pack acknowledgements.
+    packet = serializer.pack(kxg.ServerAck(5))
+    assert packet[0] == serializer.ACK
+    assert serializer.unpack(packet).id == 5
+
+    # Pack ticks.
+    packet = serializer.pack(kxg.ServerTick(6))
+    assert packet[0] == serializer.TICK
+    assert serializer.unpack(packet).tick == 6
+
+def test_cant_misdeclare_compact_message():
+    with raises_api_usage_error("expected a struct format for a single value"):
+        kxg.ValueField('ii')
+    with raises_api_usage_error("expected a struct format for a single value"):
+        kxg.ValueField('<i')
+
+    with raises_api_usage_error("must be an integer between 0 and 65535"):
+        class BadWireIdMessage (kxg.Message):
+            wire_id = -1
+
+    with raises_api_usage_error("can't both have wire_id=1"):
+        class DuplicateWireIdMessage (kxg.Message):
+            wire_id = 1
+
+    # Classes with the same name as the class that already has the wire id 
+    # should be refused too, whether they're in another module or not.
+
+    for module in (CompactMessage.__module__, 'other_module'):
+        with raises_api_usage_error("can't both have wire_id=1"):
+            type('CompactMessage', (kxg.Message,), {
+                '__module__': module,
+                '__qualname__': CompactMessage.__qualname__,
+                'wire_id': 1,
+            })
+
+    assert kxg.Message._wire_classes[1] is CompactMessage
+
 def test_uniplayer_message_sending():
     test = DummyUniplayerGame()
     messages = []
@@ -424,6 +798,29 @@ def test_uniplayer_token_management():
         remove_dummy_token(actor, token)
         assert token not in test.world
 
+def test_uniplayer_batch_token_management():
+    test = DummyUniplayerGame()
+    tokens = [NeighborToken() for i in range(10)]
+    for token in tokens:
+        token.neighbors = tokens
+    test.random_actor >> AddDummyTokens(tokens)
+
+    assert len({x.id for x in tokens}) == len(tokens)
+    for token in tokens:
+        assert token in test.world
+        assert token.neighbors_in_world
+        assert token.get_extensions()
+
+def test_multiplayer_batch_token_management():
+    test = DummyMultiplayerGame()
+    tokens = [DummyToken() for i in range(10)]
+    test.random_client_actor >> AddDummyTokens(tokens)
+    test.update()
+
+    for world in test.worlds:
+        for token in tokens:
+            assert token.id in world
+
 def test_uniplayer_token_messaging():
     test = DummyUniplayerGame()
 
@@ -473,6 +870,17 @@ def test_uniplayer_reporter_messaging():
         assert observer.dummy_messages_received == [message]
     assert test.world.dummy_messages_executed == [message]
 
+def test_uniplayer_reporter_cadence():
+    test = DummyUniplayerGame()
+    token = add_dummy_token(test.referee, CountingReporterToken())
+    idle_token = add_dummy_token(test.referee)
+
+    assert token in test.world._report_scheduler
+    assert idle_token not in test.world._report_scheduler
+
+    test.update(6)
+    assert token.num_reports == 3
+
 def test_uniplayer_was_sent_by():
     test = DummyUniplayerGame()
 
@@ -529,6 +937,610 @@ def test_multiplayer_message_sending():
                     assert observer.dummy_messages_received == messages
                 assert part_j.world.dummy_messages_executed == messages
 
+def test_multiplayer_messages_pickled_once():
+    test = DummyMultiplayerGame(num_players=3)
+
+    # Each message should be pickled once by the actor that sent it.  Messages 
+    # from clients are pickled once more by the server after they're checked 
+    # (in case the check changed them), but not once for every client.
+
+    for actor in test.actors:
+        CountingPickleMessage.num_pickles = 0
+        message = send_dummy_message(actor, CountingPickleMessage())
+        test.update()
+
+        num_pickles = 1 if actor in test.server.actors else 2
+        assert CountingPickleMessage.num_pickles == num_pickles
+        for world in test.worlds:
+            assert world.dummy_messages_executed[-1] == message
+
+def test_multiplayer_declared_message_tokens():
+    test = DummyMultiplayerGame()
+
+    for actor in test.actors:
+        token = add_dummy_token(actor)
+        test.update()
+
+        message = DeclaredTokensMessage()
+        message.token = token
+        message.tokens = {token}
+        message.new_tokens = [DummyToken()]
+        actor >> message
+        test.update()
+
+        for world in test.worlds:
+            received = world.dummy_messages_executed[-1]
+            assert received.token is world.get_token(token.id)
+            assert received.tokens == {received.token}
+            assert received.new_tokens[0] in world
+
+def test_multiplayer_state_set_by_check():
+    test = DummyMultiplayerGame()
+
+    # Anything the check stores on a message should reach every machine, 
+    # whether the message was sent by the server or by a client.
+
+    for actor in test.actors:
+        message = CheckedValueMessage()
+        actor >> message
+        test.update()
+
+        for world in test.worlds:
+            assert world.dummy_messages_executed[-1].checked_value == 42
+
+def test_multiplayer_compact_messages():
+    test = DummyMultiplayerGame(serializer_cls=kxg.CompactMessageSerializer)
+
+    for actor in test.actors:
+        token = add_dummy_token(actor)
+        test.update()
+
+        message = CompactMessage()
+        message.x = actor.id
+        message.token = token
+        actor >> message
+        test.update()
+
+        for world in test.worlds:
+            received = world.dummy_messages_executed[-1]
+            assert received.x == actor.id
+            assert received.token is world.get_token(token.id)
+
+    # Make sure responses that can't be packed compactly still work.
+
+    for actor in test.client_actors:
+        message = send_dummy_message(actor, response='sync')
+        test.update()
+
+        for world in test.client_worlds:
+            assert world.dummy_sync_responses_executed[-1] == message
+
+def test_multiplayer_compact_messages_packed_once():
+    test = DummyMultiplayerGame(
+            num_players=3, serializer_cls=CountingCompactSerializer)
+
+    # Each message should be packed once by the machine that sent it, and 
+    # broadcast by the server without being packed once for every client 
+    # (see test_multiplayer_messages_pickled_once).
+
+    for actor in test.actors:
+        CountingCompactSerializer.num_packs = 0
+        message = CompactMessage(); message.x = 1
+        actor >> message
+        test.update()
+
+        num_packs = 1 if actor in test.server.actors else 2
+        assert CountingCompactSerializer.num_packs == num_packs
+        for world in test.worlds:
+            assert world.dummy_messages_executed[-1].x == 1
+
+def test_compressed_serialization():
+    world = DummyWorld()
+    token = DummyToken(); token._id = 1; token.inventory = list(range(1000))
+
+    serializer = kxg.CompressedSerializer(world, threshold=100)
+    pack_unpack = lambda m: serializer.unpack(serializer.pack(m))
+
+    # Don't compress small packets.
+    m = DummyMessage()
+    packet = serializer.pack(m)
+    assert packet[0] == serializer.UNCOMPRESSED
+    assert type(pack_unpack(m)) is DummyMessage
+
+    # Compress big packets, and only compress each message once.
+    m = DummyMessage(); m.add = [token]; m.token = token
+    packet = serializer.pack(m)
+    assert packet[0] == serializer.COMPRESSED
+    assert serializer.pack(m) is packet
+    assert pack_unpack(m).token.inventory == token.inventory
+
+    # Keep track of how much space is being saved.
+    metrics = serializer.metrics
+    assert metrics.num_packets == 5
+    assert metrics.num_compressed_packets == 3
+    assert metrics.compression_ratio > 1
+    assert repr(metrics).startswith('CompressionMetrics(num_packets=5')
+
+    # Compress packets produced by other serializers.
+    serializer = kxg.CompressedSerializer(
+            world, kxg.CompactMessageSerializer, threshold=0)
+    m = CompactMessage(); m.x = 1; m._set_server_response_id(3)
+    assert pack_unpack(m).x == 1
+    assert pack_unpack(kxg.ServerResponse(m)).id == 3
+
+    # Don't compress or count packets again when they're sent in a batch.
+    packets = [serializer.pack(m), serializer.pack(kxg.ServerTick(1))]
+    num_packets = serializer.metrics.num_packets
+    packet = serializer.pack(kxg.PacketBatch(packets))
+    assert packet[0] == serializer.UNCOMPRESSED
+    assert serializer.metrics.num_packets == num_packets
+    assert pack_unpack(kxg.PacketBatch(packets)).packets == packets
+
+def test_multiplayer_compressed_messages():
+    from functools import partial
+
+    serializer_cls = partial(kxg.CompressedSerializer, threshold=0)
+    test = DummyMultiplayerGame(serializer_cls=serializer_cls)
+
+    for actor in test.actors:
+        token = add_dummy_token(actor)
+        test.update()
+
+        for world in test.worlds:
+            assert token in world
+
+    for client in test.clients:
+        assert client.pipe.serializer.metrics.num_compressed_packets
+
+def test_multiplayer_packet_batching():
+    test = DummyMultiplayerGame(batch_packets=True)
+
+    for client in test.clients:
+        actor = client.gui_actor
+
+        # Send several messages in one frame, including one that refers to a 
+        # token created by an earlier message in the same batch.
+
+        token = add_dummy_token(actor)
+        message_1 = send_dummy_message(actor)
+        message_2 = DummyAcceptedMessage(); message_2.token = token
+        actor >> message_2
+        sync_message = send_dummy_message(actor, response='sync')
+
+        assert len(client.game.forum.outbox.packets) == 4
+        assert not client.pipe.outgoing
+
+        test.update()
+
+        assert not client.game.forum.outbox.packets
+
+        for world in test.worlds:
+            assert token in world
+            assert world.dummy_messages_executed[-3:] == \
+                    [message_1, message_2, sync_message]
+            assert world.dummy_messages_executed[-2].token is \
+                    world.get_token(token.id)
+        for world in test.client_worlds:
+            assert world.dummy_sync_responses_executed[-1] == sync_message
+
+        assert not client.game.forum.sent_message_cache
+
+def test_multiplayer_parallel_decoding():
+    test = DummyMultiplayerGame(
+            num_players=3,
+            server_kwargs=dict(decode_threads=2),
+            client_kwargs=dict(batch_packets=True),
+    )
+    token = add_dummy_token(test.referee)
+    test.update()
+
+    assert test.server.game.decoder.num_threads == 2
+
+    # Have every client send a batch of messages in the same frame, including 
+    # a message that refers to a token created earlier in the same batch.  
+    # That message can't be unpacked until the token has been added.
+
+    expected_messages = []
+
+    for client in test.clients:
+        actor = client.gui_actor
+        message_1 = ThreadRecordingMessage(); message_1.token = token
+        actor >> message_1
+        new_token = add_dummy_token(actor)
+        message_2 = ThreadRecordingMessage(); message_2.token = new_token
+        actor >> message_2
+        expected_messages += [message_1, message_2]
+
+    test.update()
+
+    # The messages that could be unpacked ahead of time should've been 
+    # unpacked by the worker threads, and the rest by the main thread.
+
+    server_messages = test.server.world.dummy_messages_executed[-6:]
+
+    for message in server_messages[0::2]:
+        assert message.unpacked_by.startswith('kxg-decoder')
+        assert message.token is test.server.world.get_token(token.id)
+    for message in server_messages[1::2]:
+        assert message.unpacked_by == 'MainThread'
+        assert message.token in test.server.world
+
+    # The messages should still be executed in a deterministic order: client 
+    # by client, in the order each client sent them.
+
+    assert server_messages == expected_messages
+
+    for world in test.client_worlds:
+        for message in expected_messages:
+            assert message in world.dummy_messages_executed
+
+    for actor in test.server.game.actors:
+        if isinstance(actor, kxg.ServerActor):
+            assert not actor.outbox.prefetched_packets
+
+    test.server.game.finish_game()
+
+def test_multiplayer_parallel_decoding_removed_tokens():
+    test = DummyMultiplayerGame(server_kwargs=dict(decode_threads=2))
+    token = add_dummy_token(test.referee)
+    test.update()
+
+    # Have one client remove a token while another client sends a message 
+    # about it.  Both messages are unpacked before either is handled, but the 
+    # second message shouldn't end up referring to the removed token.  
+    # Instead, it should fail to unpack just like it would without threads.
+
+    client_0, client_1 = test.clients
+    remove_dummy_token(client_0.gui_actor, client_0.world.get_token(token.id))
+    message = DummyAcceptedMessage()
+    message.token = client_1.world.get_token(token.id)
+    client_1.gui_actor >> message
+    time.sleep(0.1)
+
+    with pytest.raises(KeyError):
+        test.server.game.update_game(1/60)
+
+    assert token not in test.server.world
+    assert message not in test.server.world.dummy_messages_executed
+
+    test.server.game.decoder.shutdown()
+
+def test_multiplayer_parallel_decoding_errors():
+    test = DummyMultiplayerGame(server_kwargs=dict(decode_threads=2))
+    actor = test.clients[0].gui_actor
+
+    # Errors raised while unpacking a message should be raised on the main 
+    # thread, and shouldn't cause any later messages to be lost.
+
+    actor >> UnpicklableMessage()
+    message = send_dummy_message(actor)
+    time.sleep(0.1)
+
+    with pytest.raises(ValueError, match="can't unpickle this message"):
+        test.server.game.update_game(1/60)
+
+    test.update()
+
+    assert test.server.world.dummy_messages_executed == [message]
+
+    test.server.game.finish_game()
+
+def test_multiplayer_message_merging():
+    test = DummyMultiplayerGame(batch_packets=True)
+
+    for client in test.clients:
+        actor = client.gui_actor
+        forum = client.game.forum
+
+        # Messages with the same merge key are merged before being sent, and 
+        # take the place of the last message.
+
+        a1 = send_dummy_message(actor, MergeableMessage('a'))
+        b1 = send_dummy_message(actor, MergeableMessage('b'))
+        x1 = send_dummy_message(actor)
+        a2 = send_dummy_message(actor, MergeableMessage('a'))
+        a3 = send_dummy_message(actor, MergeableMessage('a'))
+
+        assert len(forum.outbox.packets) == 3
+        assert list(forum.sent_message_cache.values()) == [b1, x1, a3]
+        assert client.world.dummy_messages_executed[-5:] == [a1, b1, x1, a2, a3]
+
+        test.update()
+
+        assert not forum.sent_message_cache
+        for world in test.worlds:
+            if world is not client.world:
+                assert world.dummy_messages_executed[-3:] == [b1, x1, a3]
+
+        # Merged messages can be different from the messages they replace, 
+        # and some messages can refuse to be merged.
+
+        send_dummy_message(actor, SummingMessage('a', 3))
+        send_dummy_message(actor, SummingMessage('a', 4))
+        send_dummy_message(actor, SummingMessage('a', 5))
+
+        test.update()
+
+        assert not forum.sent_message_cache
+        for world in test.worlds:
+            if world is not client.world:
+                assert [x.value for x in world.dummy_messages_executed[-2:]] \
+                        == [7, 5]
+
+        # Only the merged message is undone if it's rejected by the server.
+
+        u1 = send_dummy_message(actor, MergeableUndoResponse())
+        u2 = send_dummy_message(actor, MergeableUndoResponse())
+        test.update()
+
+        assert not forum.sent_message_cache
+        assert client.world.dummy_undo_responses_executed[-1] is u2
+        assert u1 not in client.world.dummy_undo_responses_executed
+
+def test_multiplayer_cumulative_acks():
+    test = DummyMultiplayerGame()
+
+    for client in test.clients:
+        actor = client.gui_actor
+        forum = client.game.forum
+
+        # Messages that the server accepts as is are acknowledged all at once, 
+        # without individual responses.
+
+        messages = [send_dummy_message(actor) for i in range(5)]
+        assert list(forum.sent_message_cache.values()) == messages
+
+        test.update()
+
+        assert not forum.sent_message_cache
+        assert all(x._get_server_response() is None for x in messages)
+
+        # Messages that need to be synced or undone still get their own 
+        # responses, even if they're sent between messages that don't.
+
+        a = send_dummy_message(actor)
+        b = send_dummy_message(actor, response='undo')
+        c = send_dummy_message(actor)
+        test.update()
+
+        assert not forum.sent_message_cache
+        assert client.world.dummy_undo_responses_executed[-1] is b
+        assert a._get_server_response() is None
+        assert c._get_server_response() is None
+
+def test_multiplayer_message_backpressure():
+    test = DummyMultiplayerGame()
+
+    for client in test.clients:
+        actor = client.gui_actor
+        forum = client.game.forum
+        forum.max_messages_in_flight = 2
+
+        # Messages can be sent until too many are waiting to be acknowledged.
+
+        send_dummy_message(actor)
+        assert actor.can_send_message()
+        send_dummy_message(actor)
+        assert not actor.can_send_message()
+
+        message = DummyAcceptedMessage()
+        num_executed = len(client.world.dummy_messages_executed)
+
+        with pytest.raises(kxg.MessageBackpressure):
+            send_dummy_message(actor, message)
+
+        assert not message.was_sent()
+        assert len(forum.sent_message_cache) == 2
+        assert len(client.world.dummy_messages_executed) == num_executed
+
+        # Once the server acknowledges the messages in flight, the rejected 
+        # message can be sent again.
+
+        test.update()
+
+        assert actor.can_send_message()
+        send_dummy_message(actor, message)
+        test.update()
+
+        for world in test.worlds:
+            assert world.dummy_messages_executed[-1] == message
+
+    # Actors that don't belong to a client never apply backpressure.
+
+    assert test.referee.can_send_message()
+
+def test_multiplayer_message_prediction():
+    test = DummyMultiplayerGame(client_kwargs={'predict_messages': True})
+    client, other_client = test.clients
+    actor = client.gui_actor
+    forum = client.game.forum
+
+    token = PredictedToken()
+    test.referee >> AddDummyToken(token)
+    test.update()
+
+    local_token = client.world.get_token(token.id)
+    other_token = other_client.world.get_token(token.id)
+
+    # Send a message that the server will reject between two messages that 
+    # it will accept, while a message from another client is in flight.  The 
+    # rejected message doesn't know how to undo itself.
+
+    new_token = PredictedToken()
+    actor >> ShiftPredictedToken(local_token, 1)
+    actor >> RejectedShiftPredictedToken(local_token, 10, new_token)
+    actor >> ShiftPredictedToken(local_token, 100)
+    other_client.gui_actor >> ShiftPredictedToken(other_token, 1000)
+
+    assert local_token.x == 111
+    assert new_token in client.world
+    assert len(forum.checkpoints) == 3
+
+    # The client should roll back to the state before the rejected message, 
+    # then execute the messages after it (including the one from the other 
+    # client) again.
+
+    test.update()
+
+    assert token.x == 1101
+    assert local_token.x == 1101
+    assert other_token.x == 1101
+    assert new_token not in client.world
+    assert client.world.dummy_undo_responses_executed == []
+    assert not forum.sent_message_cache
+    assert not forum.checkpoints
+
+    # Messages from other clients don't need checkpoints if nothing sent from 
+    # this client could be rolled back.
+
+    other_client.gui_actor >> ShiftPredictedToken(other_token, 1)
+    test.update()
+
+    assert local_token.x == 1102
+    assert not forum.checkpoints
+
+def test_multiplayer_rollback_extensions():
+    test = DummyMultiplayerGame(client_kwargs={'predict_messages': True})
+    client = test.clients[0]
+    actor = client.gui_actor
+
+    token = ExtendedPredictedToken()
+    test.referee >> AddDummyToken(token)
+    test.update()
+
+    local_token = client.world.get_token(token.id)
+    extension = local_token.get_extension(actor)
+
+    # Roll back a rejected message, then execute a message that adds a token 
+    # again.
+
+    new_token = ExtendedPredictedToken()
+    actor >> RejectedShiftPredictedToken(local_token, 10)
+    actor >> ShiftPredictedToken(local_token, 1, new_token)
+    new_extension = new_token.get_extension(actor)
+    test.update()
+
+    assert local_token.x == 1
+    assert new_token in client.world
+
+    # Tokens that were only restored should keep their extensions, but tokens 
+    # that were removed and added again should get new ones.
+
+    assert local_token.get_extension(actor) is extension
+    assert new_token.get_extension(actor) is not new_extension
+
+def test_multiplayer_server_ticks():
+    test = DummyMultiplayerGame()
+    test.update(3)
+
+    server_forum = test.server.game.forum
+    assert server_forum.tick == 3
+
+    # Messages received by the clients are stamped with the tick they were 
+    # executed on by the server.
+
+    message = send_dummy_message(test.referee)
+    test.update()
+
+    for client in test.clients:
+        assert client.game.forum.server_tick == 3
+        assert client.world.dummy_messages_executed[-1].server_tick == 3
+
+    client = test.clients[0]
+    message = send_dummy_message(client.gui_actor)
+    test.update()
+
+    assert message.server_tick is None
+    assert test.server.world.dummy_messages_executed[-1].server_tick is None
+    assert test.clients[1].world.dummy_messages_executed[-1].server_tick == 5
+
+def test_multiplayer_interest_management():
+    test = DummyMultiplayerGame()
+    client, other_client = test.clients
+
+    server_actor = next(
+            x for x in test.server.game.actors
+            if isinstance(x, kxg.ServerActor) and x.id == client.gui_actor.id)
+
+    a, b = PredictedToken(), PredictedToken()
+    test.referee >> AddDummyToken(a)
+    test.referee >> AddDummyToken(b)
+    test.update()
+
+    # Only relay messages about tokens relevant to the client.
+
+    server_actor.set_relevant_tokens([a])
+
+    test.referee >> ShiftPredictedToken(a, 1)
+    test.referee >> ShiftPredictedToken(b, 10)
+    message = send_dummy_message(test.referee)
+    test.update()
+
+    assert client.world.get_token(a.id).x == 1
+    assert client.world.get_token(b.id).x == 0
+    assert client.world.dummy_messages_executed[-1] == message
+    assert other_client.world.get_token(a.id).x == 1
+    assert other_client.world.get_token(b.id).x == 10
+
+    # Tokens that become relevant are brought up to date.
+
+    server_actor.set_relevant_tokens([a, b])
+    test.update()
+
+    assert client.world.get_token(b.id).x == 10
+
+    # Tokens are always added and removed, even if they aren't relevant.
+
+    server_actor.set_relevant_tokens([])
+    c = PredictedToken()
+    test.referee >> AddDummyToken(c)
+    test.referee >> RemoveDummyToken(b)
+    test.referee >> ShiftPredictedToken(a, 100)
+    test.update()
+
+    assert c.id in client.world
+    assert b.id not in client.world
+    assert client.world.get_token(a.id).x == 1
+
+    # Go back to relaying everything.
+
+    server_actor.set_relevant_tokens(None)
+    test.referee >> ShiftPredictedToken(a, 1000)
+    test.update()
+
+    assert client.world.get_token(a.id).x == 1001
+
+def test_multiplayer_interest_management_journal():
+    import io
+
+    test = DummyMultiplayerGame()
+    client = test.clients[0]
+    client.game.forum.journal = kxg.MessageJournal(io.BytesIO())
+
+    server_actor = next(
+            x for x in test.server.game.actors
+            if isinstance(x, kxg.ServerActor) and x.id == client.gui_actor.id)
+
+    token = PredictedToken()
+    test.referee >> AddDummyToken(token)
+    test.update()
+
+    # Snapshots should be sent on behalf of the referee, so that clients can 
+    # record them (and check who sent them) like any other message.
+
+    server_actor.set_relevant_tokens([])
+    test.referee >> ShiftPredictedToken(token, 1)
+    test.update()
+
+    snapshots = []
+    client.gui_actor.subscribe_to_message(kxg.TokenSnapshot, snapshots.append)
+    server_actor.set_relevant_tokens([token])
+    test.update()
+
+    assert client.world.get_token(token.id).x == 1
+    assert len(snapshots) == 1
+    assert snapshots[0].was_sent_by_referee()
+
 def test_multiplayer_message_rejection():
     test = DummyMultiplayerGame()
 
@@ -809,6 +1821,57 @@ def test_subscribing_to_multiple_messages():
     test.random_actor >> message_3
     assert token.messages == [message_1, message_2]
 
+def test_decorated_callbacks_found_once_per_class():
+    assert set(ListeningToken._decorated_callbacks) == {
+            ('message', Message1, 'on_either_message'),
+            ('message', Message2, 'on_either_message'),
+    }
+    assert ('sync_response', DummyMessage,
+            'on_sync_dummy_message') in DummyActor._decorated_callbacks
+    assert kxg.Token._decorated_callbacks == ()
+
+def test_subscribing_to_base_messages():
+    test = DummyUniplayerGame()
+    token = ListeningToken()
+    message_1 = Message1()
+    message_3 = Message3()
+    received = []
+
+    add_dummy_token(test.random_actor, token)
+    token.subscribe_to_message(DummyAcceptedMessage, received.append)
+
+    test.random_actor >> message_1
+    assert token.messages == [message_1]
+    assert received == [message_1]
+
+    test.random_actor >> message_3
+    assert token.messages == [message_1]
+    assert received == [message_1, message_3]
+
+def test_subscriptions_dropped_with_token():
+    test = DummyUniplayerGame()
+    world_subscriptions = len(test.world._token_subscriptions._callbacks)
+    actor_subscriptions = {
+            actor: len(actor._subscription_index._callbacks)
+            for actor in test.actors
+    }
+
+    token = add_dummy_token(test.random_actor)
+    extensions = token.get_extensions()
+    assert len(test.world._token_subscriptions._callbacks) > world_subscriptions
+
+    remove_dummy_token(test.random_actor, token)
+    message = send_dummy_message(test.random_actor)
+
+    assert message not in token.dummy_messages_received
+    for extension in extensions:
+        assert message not in extension.dummy_messages_received
+
+    assert len(test.world._token_subscriptions._callbacks) == world_subscriptions
+    for actor in test.actors:
+        assert len(actor._subscription_index._callbacks) == \
+                actor_subscriptions[actor]
+
 def test_unsubscribing_from_messages():
     test = DummyUniplayerGame()
 
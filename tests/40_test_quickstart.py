@@ -169,6 +169,40 @@ def test_reset_initial_stage():
     with raises_api_usage_error():
         theater.initial_stage = DummyStage()
 
+def test_fixed_timestep():
+    timestep = kxg.FixedTimestep(10, max_ticks_per_update=3)
+
+    assert timestep.advance(0.05) == 0
+    assert timestep.advance(0.05) == 1
+    assert timestep.advance(0.25) == 2
+    assert timestep.advance(0.05) == 1
+    assert timestep.num_dropped_ticks == 0
+
+    # Don't try to catch up all at once after a long pause.
+
+    assert timestep.advance(1) == 3
+    assert timestep.num_dropped_ticks == 7
+    assert timestep.advance(0.1) == 1
+
+    with raises_api_usage_error("expected a positive tick rate"):
+        kxg.FixedTimestep(0)
+
+def test_fixed_rate_game_stage():
+    world = DummyWorld()
+    game = kxg.UniplayerGame(world, DummyReferee(), DummyActor())
+    theater = kxg.quickstart.Theater()
+    theater.initial_stage = kxg.quickstart.GameStage(game, tick_rate=20)
+
+    elapsed_times = []
+    world.on_update_game = lambda dt: elapsed_times.append(dt)
+
+    theater.update(0.01)
+    theater.update(0.12)
+    theater.update(0.04)
+
+    assert elapsed_times == [0.05, 0.05, 0.05]
+    assert game.forum.tick == 3
+
 def test_quickstart_process_pool(logged_messages):
     # Make sure exceptions raised in worker processes are handled correctly.  
     # The exception should be re-raised in the main process and all the other 
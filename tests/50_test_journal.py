@@ -0,0 +1,205 @@
+#!/usr/bin/env python
+
+from test_helpers import *
+import io
+
+class JournaledToken (DummyToken):
+    pass
+
+
+class AddJournaledToken (kxg.Message):
+
+    def __init__(self, token):
+        self.token = token
+
+    def tokens_to_add(self):
+        yield self.token
+
+    def on_check(self, world):
+        pass
+
+
+class MoveJournaledToken (DummyMessage):
+
+    def __init__(self, token, x):
+        super().__init__()
+        self.token = token
+        self.x = x
+
+    def on_check(self, world):
+        pass
+
+    def on_execute(self, world):
+        super().on_execute(world)
+        self.token._value = self.x
+
+
+class RemoveJournaledToken (kxg.Message):
+
+    def __init__(self, token):
+        self.token = token
+
+    def tokens_to_remove(self):
+        yield self.token
+
+    def on_check(self, world):
+        pass
+
+
+def record_journal(file):
+    test = DummyUniplayerGame()
+    test.game.forum.journal = kxg.MessageJournal(file)
+
+    token = JournaledToken()
+    test.referee >> AddJournaledToken(token)
+    test.update()
+
+    test.gui_actor >> MoveJournaledToken(token, 1)
+    test.ai_actors[0] >> MoveJournaledToken(token, 2)
+    test.game.update_game(0.5)
+
+    test.referee >> RemoveJournaledToken(token)
+    test.game.forum.journal.close()
+
+    return test, token
+
+def replay_journal(file, world, unpack=True):
+    records = []
+
+    for record in kxg.JournalReader(file, world, unpack=unpack):
+        records.append(record)
+
+        # Execute each message before the next one is read, because later 
+        # messages refer to the tokens added by earlier ones.
+
+        if isinstance(record, kxg.JournalMessage) and unpack:
+            with world._unlock_temporarily():
+                record.message._execute(world)
+
+    return records
+
+
+def test_journal_recording():
+    file = io.BytesIO()
+    test, token = record_journal(file)
+
+    # The file should be left open (and flushed) because the journal didn't 
+    # open it.
+
+    assert not file.closed
+    file.seek(0)
+
+    # Replay the journal into a fresh world, and make sure it ends up in the 
+    # same state as the original.
+
+    world = DummyWorld()
+    records = replay_journal(file, world)
+
+    assert [type(x) for x in records] == [
+            kxg.JournalMessage,
+            kxg.JournalFrame,
+            kxg.JournalMessage,
+            kxg.JournalMessage,
+            kxg.JournalFrame,
+            kxg.JournalMessage,
+    ]
+    assert [x.frame for x in records] == [0, 0, 1, 1, 1, 2]
+    assert [x.sender_id for x in records if hasattr(x, 'sender_id')] == [
+            test.referee.id,
+            test.gui_actor.id,
+            test.ai_actors[0].id,
+            test.referee.id,
+    ]
+    assert [x.dt for x in records if hasattr(x, 'dt')] == [0, 0.5]
+
+    add, _, move_1, move_2, _, remove = records
+    assert isinstance(add.message, AddJournaledToken)
+    assert isinstance(move_1.message, MoveJournaledToken)
+    assert isinstance(remove.message, RemoveJournaledToken)
+
+    # The messages after the first should refer to the token that the first 
+    # message added to the new world, not to copies of it.
+
+    assert add.message.token.id == token.id
+    assert move_1.message.token is add.message.token
+    assert move_2.message.token is add.message.token
+    assert move_2.message.token._value == 2
+    assert add.message.token not in world
+    assert world.dummy_messages_executed == [move_1.message, move_2.message]
+
+def test_journal_files(tmp_path):
+    path = tmp_path / 'journal.kxg'
+    record_journal(path)
+
+    # Make sure both classes can open and close files on their own, and that 
+    # messages can be read without being unpacked.
+
+    with kxg.JournalReader(path, DummyWorld(), unpack=False) as reader:
+        records = list(reader)
+        assert not reader.file.closed
+    assert reader.file.closed
+
+    assert len(records) == 6
+    assert all(
+            isinstance(x.message, bytes)
+            for x in records if isinstance(x, kxg.JournalMessage))
+
+    # Make sure journals are appended to rather than overwritten.
+
+    record_journal(path)
+    records = replay_journal(path, DummyWorld(), unpack=False)
+    assert len(records) == 12
+
+def test_truncated_journal():
+    file = io.BytesIO()
+    record_journal(file)
+
+    file = io.BytesIO(file.getvalue()[:-1])
+    reader = iter(kxg.JournalReader(file, DummyWorld(), unpack=False))
+
+    for i in range(5):
+        next(reader)
+
+    with pytest.raises(EOFError):
+        next(reader)
+
+def test_unknown_journal_record():
+    file = io.BytesIO(b'not a journal')
+    reader = iter(kxg.JournalReader(file, DummyWorld(), unpack=False))
+
+    with raises_api_usage_error("journal record of unknown kind"):
+        next(reader)
+
+def test_journal_replay():
+    file = io.BytesIO()
+    test, token = record_journal(file)
+    file.seek(0)
+
+    world = DummyWorld()
+    stats = kxg.replay_journal(file, world)
+
+    assert stats.num_frames == 2
+    assert stats.num_messages == 4
+    assert stats.total_time > 0
+    assert stats.frames_per_sec > 0
+    assert stats.messages_per_sec > 0
+    assert 'frames/sec' in str(stats)
+
+    # The replayed world should end up in the same state as the original.
+
+    assert len(list(world)) == len(list(test.world)) == 0
+    assert len(world.dummy_messages_executed) == 2
+    assert [x.x for x in world.dummy_messages_executed] == [1, 2]
+    assert world.dummy_messages_executed[0].token.id == token.id
+
+def test_journal_replay_appended_sessions():
+    file = io.BytesIO()
+    record_journal(file)
+    record_journal(file)
+    file.seek(0)
+
+    # Frame numbers start over with each session appended to a journal, and 
+    # each session has to be replayed into a new world.
+
+    with raises_api_usage_error("can't replay a journal containing more than one session"):
+        kxg.replay_journal(file, DummyWorld())
@@ -51,13 +51,14 @@ class DummyMultiplayerGame:
 
     class Server:
 
-        def __init__(self, server_pipes):
+        def __init__(self, server_pipes, **kwargs):
             self.pipes = server_pipes
             self.world = DummyWorld()
             self.referee = DummyReferee()
             self.ai_actors = [DummyActor(), DummyActor()]
             self.game = kxg.MultiplayerServerGame(
-                    self.world, self.referee, self.ai_actors, self.pipes)
+                    self.world, self.referee, self.ai_actors, self.pipes,
+                    **kwargs)
 
         @property
         def actors(self):
@@ -72,12 +73,12 @@ class DummyMultiplayerGame:
 
     class Client:
 
-        def __init__(self, client_pipe):
+        def __init__(self, client_pipe, **kwargs):
             self.pipe = client_pipe
             self.world = DummyWorld()
             self.gui_actor = DummyActor()
             self.game = kxg.MultiplayerClientGame(
-                    self.world, self.gui_actor, self.pipe)
+                    self.world, self.gui_actor, self.pipe, **kwargs)
 
         @property
         def actors(self):
@@ -91,14 +92,21 @@ class DummyMultiplayerGame:
                 yield from token.observers
 
 
-    def __init__(self, num_players=2):
-        # Create the server and a handful of clients.
+    def __init__(self, num_players=2, server_kwargs=None, client_kwargs=None,
+            **kwargs):
+        # Create the server and a handful of clients.  Any keyword arguments 
+        # are passed to both the server and the clients, except those in 
+        # `server_kwargs` and `client_kwargs`, which are only passed to the 
+        # server or the clients, respectively.
 
         client_pipes, server_pipes = \
                 linersock.test_helpers.make_pipes(num_players)
 
-        self.server = DummyMultiplayerGame.Server(server_pipes)
-        self.clients = [DummyMultiplayerGame.Client(p) for p in client_pipes]
+        self.server = DummyMultiplayerGame.Server(
+                server_pipes, **kwargs, **(server_kwargs or {}))
+        self.clients = [
+                DummyMultiplayerGame.Client(p, **kwargs, **(client_kwargs or {}))
+                for p in client_pipes]
 
         # Give each client an id and start playing the game.
         